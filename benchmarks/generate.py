@@ -0,0 +1,198 @@
+"""
+Generator of synthetic input files with the same shape as real ones: Balance, ED807 (BICDirectoryEntry)
+and PacketEPD (ED101), of any size and with configurable defects.
+
+Files are written with incremental `etree.xmlfile` writer, so even 1e7 records are generated in constant memory.
+Without defects generated files pass all checks, except the check of 'date' attribute: operations have 'data' attribute,
+the same as in real Balance.xml, because model reads it. PacketEPD is filled from ED807 the same way the application does it
+(ED101 №k from entries №2k-1 and №2k), so ED807 should be generated with the same seed and twice as many records.
+
+Usage: python -m benchmarks.generate {balance|ed807|epd} <path> --records N [--seed S] [--defect name=rate ...]
+"""
+from lxml import etree
+from typing import Dict, Iterator, NamedTuple
+import argparse
+import random
+
+BALANCE_NAMESPACE = "iso.cbr.ru"
+ED807_NAMESPACE = "urn:cbr-ru:ed:v2.0"
+BALANCE_CORR_ACCOUNT = "40817_K1"
+EPD_HEADER = {"EDAuthor": "4583001999", "EDDate": "2024-11-02", "EDNo": "705999466"}
+DIRECTORY_VERSION = "1"
+
+# Defects which can be injected into each file kind, with rate = probability for each record
+BALANCE_DEFECTS = ("both_dbt_cdt", "corr_acc_as_child", "self_corr_account", "invalid_amount", "missing_status", "other_date")
+ED807_DEFECTS = ("missing_accounts",)
+EPD_DEFECTS = ("wrong_system_code", "edno_gap", "edno_duplicate", "missing_sum", "wrong_payer_name")
+
+STATUSES = ("Выполнена", "Исключен", "Выполняется")
+CORR_ACCOUNTS = ("40717", "40719", "40811", "40911")
+NAME_PARTS = ("БАНК", "КБ", "АО", "ПАО", "ООО", "РОССИИ", "ОТДЕЛЕНИЕ", "ФИЛИАЛ", "СЕВЕРНЫЙ", "ЮЖНЫЙ", "КАПИТАЛ", "КРЕДИТ")
+CITIES = ("Москва", "Тула", "Пенза", "Новосибирск", "Самара", "Казань")
+
+
+class DirectoryEntry(NamedTuple):
+    bic: str
+    name: str
+    rgn: str
+    date_in: str
+    pt_type: str
+    account: str
+
+
+def _defect(rng: random.Random, defects: Dict[str, float], name: str) -> bool:
+    rate = defects.get(name, 0)
+    return rate > 0 and rng.random() < rate
+
+
+def _directory_entries(records: int, seed: int) -> Iterator[DirectoryEntry]:
+    """ED807 entries are generated from their own random stream, so ED807 and PacketEPD generators see the same entries."""
+    rng = random.Random(seed)
+    for position in range(1, records + 1):
+        bic = f"04{position:07d}"
+        yield DirectoryEntry(
+            bic=bic,
+            name=" ".join(rng.sample(NAME_PARTS, 3)),
+            rgn=str(rng.randint(10, 99)),
+            date_in=f"{rng.randint(1994, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            pt_type=rng.choice(("12", "20", "30", "99")),
+            account=f"301018100000{bic[-8:]}",
+        )
+
+
+def generate_balance(path: str, records: int, seed: int = 0, defects: Dict[str, float] = None):
+    defects = defects or {}
+
+    def operations() -> Iterator[dict]:
+        rng = random.Random(seed)
+        for _ in range(records):
+            amount = rng.randint(1, 1000)
+            if _defect(rng, defects, "invalid_amount"):
+                amount = -amount
+            oper = {
+                "data": "05-03-2021" if not _defect(rng, defects, "other_date") else rng.choice(("03-03-2021", "05-05-2021")),
+                "corAcc": BALANCE_CORR_ACCOUNT if _defect(rng, defects, "self_corr_account") else rng.choice(CORR_ACCOUNTS),
+                "status": None if _defect(rng, defects, "missing_status") else rng.choices(STATUSES, weights=(6, 3, 1))[0],
+                "dbt": "", "cdt": "",
+                "corr_acc_as_child": _defect(rng, defects, "corr_acc_as_child"),
+            }
+            oper["dbt" if rng.random() < 0.5 else "cdt"] = str(amount)
+            if _defect(rng, defects, "both_dbt_cdt"):
+                oper["dbt" if oper["cdt"] else "cdt"] = str(rng.randint(1, 1000))
+            yield oper
+
+    # Rest is written before operations, so it is calculated by separate pass over the same random stream
+    start_rest = 57
+    rest = start_rest
+    for oper in operations():
+        if oper["status"] == "Выполнена":
+            rest += int(oper["dbt"] or 0) - int(oper["cdt"] or 0)
+
+    with etree.xmlfile(path, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element("Document", nsmap={None: BALANCE_NAMESPACE}):
+            with xf.element(f"{{{BALANCE_NAMESPACE}}}Ballance", Rest=str(rest)):
+                start_rest_elem = etree.Element(f"{{{BALANCE_NAMESPACE}}}StartRest")
+                start_rest_elem.text = str(start_rest)
+                xf.write(start_rest_elem)
+                for oper in operations():
+                    attrib = {"data": oper["data"]}
+                    if not oper["corr_acc_as_child"]:
+                        attrib["corAcc"] = oper["corAcc"]
+                    for amount_attrib in ("dbt", "cdt"):
+                        if oper[amount_attrib]:
+                            attrib[amount_attrib] = oper[amount_attrib]
+                    elem = etree.Element(f"{{{BALANCE_NAMESPACE}}}Oper", attrib)
+                    if oper["status"] is not None:
+                        etree.SubElement(elem, f"{{{BALANCE_NAMESPACE}}}Status").text = oper["status"]
+                    if oper["corr_acc_as_child"]:
+                        etree.SubElement(elem, f"{{{BALANCE_NAMESPACE}}}corAcc").text = oper["corAcc"]
+                    xf.write(elem)
+
+
+def generate_ed807(path: str, records: int, seed: int = 0, defects: Dict[str, float] = None):
+    defects = defects or {}
+    rng = random.Random(seed + 1)
+    with etree.xmlfile(path, encoding="windows-1251") as xf:
+        xf.write_declaration()
+        header = dict(EPD_HEADER, CreationReason="FCBD", InfoTypeCode="FIRR", DirectoryVersion=DIRECTORY_VERSION)
+        with xf.element("ED807", header, nsmap={None: ED807_NAMESPACE}):
+            for entry in _directory_entries(records, seed):
+                elem = etree.Element(f"{{{ED807_NAMESPACE}}}BICDirectoryEntry", BIC=entry.bic)
+                etree.SubElement(elem, f"{{{ED807_NAMESPACE}}}ParticipantInfo",
+                    NameP=entry.name, CntrCd="RU", Rgn=entry.rgn, Nnp=rng.choice(CITIES),
+                    DateIn=entry.date_in, PtType=entry.pt_type, ParticipantStatus="PSAC")
+                if not _defect(rng, defects, "missing_accounts"):
+                    etree.SubElement(elem, f"{{{ED807_NAMESPACE}}}Accounts",
+                        Account=entry.account, RegulationAccountType="CRSA", DateIn=entry.date_in, AccountStatus="ACAC")
+                xf.write(elem)
+
+
+def generate_packet_epd(path: str, records: int, seed: int = 0, defects: Dict[str, float] = None):
+    """Generate PacketEPD with `records` ED101, filled from ED807 generated with `2 * records` entries and the same seed."""
+    defects = defects or {}
+
+    def documents() -> Iterator[etree._Element]:
+        rng = random.Random(seed + 2)
+        entries = _directory_entries(2 * records, seed)
+        edno = 0
+        for payer, payee in zip(entries, entries): # Consecutive pairs of entries from the same iterator
+            edno += 1
+            if _defect(rng, defects, "edno_gap"):
+                edno += 1
+            elif _defect(rng, defects, "edno_duplicate") and edno > 1:
+                edno -= 1
+            attrib = {"EDAuthor": EPD_HEADER["EDAuthor"], "EDDate": EPD_HEADER["EDDate"], "EDNo": str(edno),
+                      "TransKind": "01", "Priority": "1",
+                      "SystemCode": "02" if _defect(rng, defects, "wrong_system_code") else "01"}
+            if not _defect(rng, defects, "missing_sum"):
+                attrib["Sum"] = payer.rgn
+            elem = etree.Element("ED101", attrib)
+            etree.SubElement(elem, "AccDoc", AccDocNo=payer.pt_type, AccDocDate=payer.date_in)
+            for side, entry in (("Payer", payer), ("Payee", payee)):
+                side_elem = etree.SubElement(elem, side)
+                name = entry.name
+                if side == "Payer" and _defect(rng, defects, "wrong_payer_name"):
+                    name = name[::-1]
+                etree.SubElement(side_elem, "Name").text = name
+                etree.SubElement(side_elem, "Bank", BIC=entry.bic, CorrespAcc=entry.account)
+            etree.SubElement(elem, "Purpose").text = f"Назначение платежа ED101 = {edno}"
+            yield elem
+
+    # Header Sum is written before documents, so it is calculated by separate pass over the same random stream
+    total_sum = sum(int(doc.get("Sum", 0)) for doc in documents())
+    header = dict(EPD_HEADER, EDQuantity=str(records), SystemCode="01", Sum=str(total_sum))
+    with etree.xmlfile(path, encoding="windows-1251") as xf:
+        xf.write_declaration()
+        with xf.element("PacketEPD", header):
+            for doc in documents():
+                xf.write(doc)
+
+
+GENERATORS = {"balance": generate_balance, "ed807": generate_ed807, "epd": generate_packet_epd}
+DEFECTS = {"balance": BALANCE_DEFECTS, "ed807": ED807_DEFECTS, "epd": EPD_DEFECTS}
+
+
+def parse_defects(kind: str, defects: list) -> Dict[str, float]:
+    parsed = {}
+    for defect in defects or []:
+        name, _, rate = defect.partition("=")
+        if name not in DEFECTS[kind]:
+            raise ValueError(f"Unknown defect '{name}' for '{kind}', expected one of {DEFECTS[kind]}")
+        parsed[name] = float(rate or 0.01)
+    return parsed
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Balance, ED807 and PacketEPD files")
+    parser.add_argument("kind", choices=sorted(GENERATORS))
+    parser.add_argument("path", help="Path of generated file")
+    parser.add_argument("--records", type=int, default=1000, help="Amount of Oper / BICDirectoryEntry / ED101 records")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--defect", action="append", default=[], help="Defect to inject as 'name=rate', can be repeated")
+    parsed = parser.parse_args(args)
+    GENERATORS[parsed.kind](parsed.path, parsed.records, seed=parsed.seed, defects=parse_defects(parsed.kind, parsed.defect))
+
+
+if __name__ == "__main__":
+    main()
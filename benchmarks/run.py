@@ -0,0 +1,223 @@
+"""
+Scaling benchmarks for XML parsing, checks and models on generated files of different sizes.
+
+Each case runs in a fresh process, where its setup (e.g. parsing) and measured run (e.g. check) are timed separately
+and peak RSS of the process is taken from `resource`. With `--tracemalloc` peak of python allocations during run is
+measured too (it slows allocations down, so run time is not comparable with runs without it).
+Results are compared with limits from `thresholds.json` and, if `--baseline` is given, with results of previous run:
+the run fails (exit code 1) when any limit or allowed regression is exceeded.
+
+Usage: python -m benchmarks.run [--sizes 1000 100000] [--cases balance_model epd_checks] [--baseline old.json] [--output new.json]
+"""
+from benchmarks.generate import generate_balance, generate_ed807, generate_packet_epd
+from typing import Callable, Dict, List, NamedTuple
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_THRESHOLDS = os.path.join(BENCHMARKS_DIR, "thresholds.json")
+BALANCE_NAMESPACE = "iso.cbr.ru"
+ED807_NAMESPACE = "urn:cbr-ru:ed:v2.0"
+CORR_ACCOUNT = "40817_K1"
+MIN_COMPARABLE_SECONDS = 0.05 # Shorter runs are too noisy to compare with baseline
+
+
+class Case(NamedTuple):
+    setup: Callable[[Dict[str, str]], object] # Gets paths of generated files, result is passed to run
+    run: Callable[[object], object]
+
+
+def _balance_xml(paths, streaming=False):
+    from utils.xml import BalanceXML
+    return BalanceXML(paths["balance"], namespace=BALANCE_NAMESPACE, streaming=streaming)
+
+
+def _balance_model(xml_tree):
+    from model.Balance import Balance
+    return Balance(CORR_ACCOUNT, xml_tree)
+
+
+def _columnar_balance_model(xml_tree):
+    from model.ColumnarBalance import ColumnarBalance
+    return ColumnarBalance(CORR_ACCOUNT, xml_tree)
+
+
+def _epd_xml(paths):
+    from utils.xml import PacketEPDXML
+    return PacketEPDXML(paths["epd"])
+
+
+def _epd_checks(epd_xml_tree):
+    from utils.epd_summary import summarize_packet
+    from utils.edno import analyze_edno
+    summary = summarize_packet(epd_xml_tree)
+    return [getattr(epd_xml_tree, name)() for name in dir(epd_xml_tree)
+            if name.startswith("check_") and name != "check_header_contains_attributes"] + \
+        [summary.check_EDQuantity(), summary.check_Sum(), analyze_edno(epd_xml_tree).is_sequence]
+
+
+def _ed807_index(paths, index_dir):
+    from utils.ed807_index import ED807Index
+    return ED807Index(paths["ed807"], namespace=ED807_NAMESPACE, index_dir=index_dir)
+
+
+def _reconcile_setup(paths):
+    from utils.reconciler import project_ed101, project_ed807
+    index = _ed807_index(paths, paths["index_dir"])
+    return project_ed101(_epd_xml(paths)), project_ed807(index)
+
+
+def _reconcile(records):
+    from utils.reconciler import reconcile
+    return reconcile(*records)
+
+
+CASES: Dict[str, Case] = {
+    "balance_parse": Case(lambda paths: paths, _balance_xml),
+    "balance_structure_checks": Case(_balance_xml, lambda tree: tree.evaluate_rules(tree.node_operation_locator)),
+    "balance_model": Case(_balance_xml, _balance_model),
+    "balance_model_columnar": Case(_balance_xml, _columnar_balance_model),
+    "balance_model_streaming": Case(lambda paths: paths, lambda paths: _balance_model(_balance_xml(paths, streaming=True))),
+    "epd_parse": Case(lambda paths: paths, _epd_xml),
+    "epd_checks": Case(_epd_xml, _epd_checks),
+    "ed807_index_build": Case(lambda paths: paths, lambda paths: _ed807_index(paths, tempfile.mkdtemp(dir=paths["tmp_dir"]))),
+    "ed807_reconcile": Case(_reconcile_setup, _reconcile),
+}
+
+
+def generate_files(data_dir: str, records: int, seed: int) -> Dict[str, str]:
+    """Generate input files for given size, files of previous runs are reused."""
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {
+        "balance": os.path.join(data_dir, f"balance-{records}-s{seed}.xml"),
+        "ed807": os.path.join(data_dir, f"ed807-{2 * records}-s{seed}.xml"),
+        "epd": os.path.join(data_dir, f"epd-{records}-s{seed}.xml"),
+    }
+    for kind, generator, generator_records in (("balance", generate_balance, records),
+                                                ("ed807", generate_ed807, 2 * records),
+                                                ("epd", generate_packet_epd, records)):
+        if not os.path.exists(paths[kind]):
+            tmp_path = paths[kind] + ".tmp"
+            generator(tmp_path, generator_records, seed=seed)
+            os.replace(tmp_path, paths[kind])
+    return paths
+
+
+def _run_case_in_process(case_name: str, paths: Dict[str, str], trace_python_memory: bool, connection):
+    from utils.logger import logger
+    logger.logger.setLevel(logging.WARNING) # Checks log every bad node, which is not what is measured
+    case = CASES[case_name]
+    result = {}
+    try:
+        started = time.perf_counter()
+        state = case.setup(paths)
+        result["setup_seconds"] = time.perf_counter() - started
+        if trace_python_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        case.run(state)
+        result["run_seconds"] = time.perf_counter() - started
+        if trace_python_memory:
+            result["run_python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+    except Exception as e:
+        result["error"] = repr(e)
+    connection.send(result)
+    connection.close()
+
+
+def run_case(case_name: str, paths: Dict[str, str], trace_python_memory: bool = False) -> dict:
+    """Run case in a fresh process, so its memory peak is not affected by other cases."""
+    context = multiprocessing.get_context("spawn")
+    parent_connection, child_connection = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_in_process, args=(case_name, paths, trace_python_memory, child_connection))
+    process.start()
+    child_connection.close()
+    result = parent_connection.recv() if parent_connection.poll(None) else {"error": "no result"}
+    process.join()
+    return result
+
+
+def check_result(case_name: str, records: int, result: dict, thresholds: dict, baseline: dict) -> List[str]:
+    """Return list of exceeded limits for one case result."""
+    if "error" in result:
+        return [f"{case_name}[{records}]: failed with {result['error']}"]
+    failures = []
+    limits = thresholds.get("cases", {}).get(case_name, {})
+    us_per_record = result["run_seconds"] / records * 1e6
+    if "max_us_per_record" in limits and us_per_record > limits["max_us_per_record"]:
+        failures.append(f"{case_name}[{records}]: {us_per_record:.2f} us per record > {limits['max_us_per_record']}")
+    if "max_peak_rss_mb" in limits and result["peak_rss_mb"] > limits["max_peak_rss_mb"]:
+        failures.append(f"{case_name}[{records}]: peak RSS {result['peak_rss_mb']:.1f} MB > {limits['max_peak_rss_mb']}")
+    baseline_result = baseline.get(str(records), {}).get(case_name)
+    max_regression = thresholds.get("max_regression")
+    if baseline_result and "run_seconds" in baseline_result and max_regression is not None \
+            and baseline_result["run_seconds"] >= MIN_COMPARABLE_SECONDS:
+        allowed_seconds = baseline_result["run_seconds"] * (1 + max_regression)
+        if result["run_seconds"] > allowed_seconds:
+            failures.append(f"{case_name}[{records}]: {result['run_seconds']:.3f}s > baseline "
+                            f"{baseline_result['run_seconds']:.3f}s + {max_regression:.0%}")
+    return failures
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Run scaling benchmarks on generated files")
+    parser.add_argument("--sizes", type=lambda value: int(float(value)), nargs="+", default=[1000, 10000],
+                        help="Amounts of records (Oper / ED101) to benchmark, e.g. 1e3 1e5 (default: 1000 10000)")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=".cache/benchmarks", help="Directory for generated files (reused between runs)")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="JSON with limits per case and allowed regression")
+    parser.add_argument("--baseline", default=None, help="Results of previous run to check regression against")
+    parser.add_argument("--output", default=None, help="Path to save results as JSON")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also measure peak of python allocations during run")
+    parsed = parser.parse_args(args)
+
+    with open(parsed.thresholds, "r") as f:
+        thresholds = json.load(f)
+    baseline = {}
+    if parsed.baseline:
+        with open(parsed.baseline, "r") as f:
+            baseline = json.load(f)
+
+    results, failures = {}, []
+    tmp_dir = tempfile.mkdtemp(prefix="benchmarks-")
+    try:
+        for records in parsed.sizes:
+            paths = generate_files(parsed.data_dir, records, parsed.seed)
+            paths.update(tmp_dir=tmp_dir, index_dir=os.path.join(tmp_dir, f"index-{records}"))
+            results[str(records)] = {}
+            for case_name in parsed.cases:
+                result = run_case(case_name, paths, parsed.tracemalloc)
+                results[str(records)][case_name] = result
+                case_failures = check_result(case_name, records, result, thresholds, baseline)
+                failures.extend(case_failures)
+                if "error" in result:
+                    print(f"{case_name:<26} {records:>10}  ERROR {result['error']}")
+                else:
+                    python_peak = f"  py peak {result['run_python_peak_mb']:8.1f} MB" if "run_python_peak_mb" in result else ""
+                    print(f"{case_name:<26} {records:>10}  setup {result['setup_seconds']:8.3f}s  run {result['run_seconds']:8.3f}s"
+                          f"{python_peak}  rss {result['peak_rss_mb']:8.1f} MB{'  FAILED' if case_failures else ''}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if parsed.output:
+        with open(parsed.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,8 +2,17 @@ import pytest
 import json
 import os
 from utils.logger import logger
-from utils.xml import BalanceXML, XMLObject
+from utils.instrumentation import instrumentation, stats_table_html, phase_table_html, profiles_html, SESSION_CONTEXT, PROFILE_CPROFILE, PROFILE_TRACEMALLOC
+from utils.xml import BalanceXML, PacketEPDXML, XMLObject
+from utils.ed807_index import ED807Index
+from utils.reconciler import project_ed101
+from utils.edno import EDNoAnalysis, analyze_edno
+from utils.epd_summary import summarize_packet, PacketSummary
+from utils.snapshot import SnapshotCache
+from utils import failures
 from model.Balance import Balance
+from model.ColumnarBalance import ColumnarBalance
+from model.RunningBalance import RunningBalance
 
 
 
@@ -14,6 +23,95 @@ def pytest_addoption(parser):
         default="config.json",
         help="Path to the config file (default: config.json)"
     )
+    parser.addoption( # Balance model implementation
+        "--balance-model",
+        action="store",
+        default="objects",
+        choices=["objects", "columnar"],
+        help="Balance model: 'objects' (Operation per node) or 'columnar' (array-backed) (default: objects)"
+    )
+    parser.addoption( # Snapshot cache of parsed data
+        "--snapshot-cache",
+        action="store_true",
+        default=False,
+        help="Load parsed models and check data from snapshots of previous runs if input files did not change"
+    )
+    parser.addoption( # Timing of instrumented spans
+        "--instrument",
+        action="store_true",
+        default=False,
+        help="Record time of parsing, models and checks for each test and add it to html report"
+    )
+    parser.addoption( # Allocation peaks of instrumented spans
+        "--trace-memory",
+        action="store_true",
+        default=False,
+        help="Record peak of python allocations for each instrumented span with tracemalloc (slows tests down)"
+    )
+    parser.addoption( # Profiling of chosen check
+        "--profile-check",
+        action="store",
+        default=None,
+        help="Profile spans matching given name pattern, e.g. 'Balance.__init__' or '*check_Sum*', results are added to report"
+    )
+    parser.addoption(
+        "--profile-mode",
+        action="store",
+        default=PROFILE_CPROFILE,
+        choices=[PROFILE_CPROFILE, PROFILE_TRACEMALLOC],
+        help="Profiler for '--profile-check': cProfile stats or tracemalloc allocations diff (default: cprofile)"
+    )
+
+
+def pytest_configure(config):
+    if not hasattr(config, "workerinput"): # Only on controller: xdist workers start when others already write sidecars
+        failures.clear_sidecars() # Sidecars of long defect lists are linked from the report of the current run only
+    # Timing of parsing, models and checks is recorded per test and added to html report only on demand,
+    # memory tracing and profiling are recorded by instrumentation too, so they turn it on
+    instrumentation.configure(
+        enabled=config.getoption("instrument") or config.getoption("trace_memory") or config.getoption("profile_check") is not None,
+        trace_memory=config.getoption("trace_memory"),
+        profile_pattern=config.getoption("profile_check"),
+        profile_mode=config.getoption("profile_mode"),
+    )
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    instrumentation.context = item.nodeid # Session fixtures are recorded to the first test, which requests them
+    yield
+    instrumentation.context = SESSION_CONTEXT
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    report = outcome.get_result()
+    if report.when != "teardown": # Extras of all test phases are shown together, so they are added once
+        return
+    stats = instrumentation.stats.get(item.nodeid)
+    captures = instrumentation.profiles.get(item.nodeid)
+    failure_reports = failures.collected.pop(item.nodeid, None)
+    if not stats and not captures and not failure_reports:
+        return
+    pytest_html = item.config.pluginmanager.getplugin("html")
+    if pytest_html is None:
+        return
+    content = ""
+    if failure_reports: # Long defect lists are shown as amount and examples with link to the full list
+        html_path = getattr(item.config.option, "htmlpath", None)
+        report_dir = os.path.dirname(os.path.abspath(html_path)) if html_path else None
+        content += "".join(failure_report.to_html(report_dir) for failure_report in failure_reports)
+    content += stats_table_html(stats) if stats else ""
+    if captures:
+        content += profiles_html(captures)
+    report.extras = getattr(report, "extras", []) + [pytest_html.extras.html(f"<div>{content}</div>")]
+
+
+def pytest_html_results_summary(prefix, summary, postfix, session):
+    totals = instrumentation.phase_totals()
+    if totals:
+        prefix.append(f"<h3>Time by phase</h3>{phase_table_html(totals)}")
 
 
 @pytest.fixture(scope="session")
@@ -39,13 +137,64 @@ def balance_xml_tree(config: dict):
     """Fixture to parse balance xml and return XML tree object"""
     xml_path = config["balances_xml"]["path"]
     xml_namespace = config["balances_xml"]["namespace"]
-    return BalanceXML(xml_path, namespace=xml_namespace, encoding='utf-8')
+    return BalanceXML(xml_path, namespace=xml_namespace, encoding='utf-8', config=config)
+
+
+@pytest.fixture(scope="session")
+def snapshot_cache(pytestconfig, config):
+    """Fixture to get snapshot cache if it is enabled by '--snapshot-cache' option, otherwise None"""
+    if not pytestconfig.getoption("snapshot_cache"):
+        return None
+    return SnapshotCache(config.get("snapshot_dir", ".cache/snapshots"))
+
+
+def _load_or_build(snapshot_cache: SnapshotCache, source_path: str, kind: str, builder, params: tuple = ()):
+    """Data built from source file, with enabled snapshot cache it is loaded from fresh snapshot if there is one"""
+    if snapshot_cache is None:
+        return builder()
+    return snapshot_cache.load_or_build(source_path, kind, builder, params=params)
 
 
 @pytest.fixture(scope="session")
-def balance(config, balance_xml_tree: BalanceXML):
+def balance_structure(request, config, snapshot_cache: SnapshotCache) -> dict:
+    """Fixture for getting structure of balance xml: balance nodes, their children and results of all 'Oper' rules"""
+    def build_structure():
+        balance_xml_tree = request.getfixturevalue("balance_xml_tree") # XML is parsed only if there is no snapshot
+        return {
+            "balance_node": balance_xml_tree.find("ns:Balance") is not None,
+            "balance_children": balance_xml_tree.get_element_unique_children_names(
+                balance_xml_tree.find(balance_xml_tree.node_balance_locator)),
+            "rules": balance_xml_tree.evaluate_all_rules(),
+        }
+
+    return _load_or_build(snapshot_cache, config["balances_xml"]["path"], "balance_structure", build_structure,
+                          params=(config["balances_xml"]["namespace"],))
+
+
+@pytest.fixture(scope="session")
+def balance(request, pytestconfig, config, snapshot_cache: SnapshotCache):
     """Fixture for getting 'Balance' model"""
-    return Balance(config["corr_account"], balance_xml_tree)
+    balance_model = pytestconfig.getoption("balance_model")
+
+    def build_balance():
+        balance_xml_tree = request.getfixturevalue("balance_xml_tree")
+        if balance_model == "columnar":
+            return ColumnarBalance(config["corr_account"], balance_xml_tree)
+        return Balance(config["corr_account"], balance_xml_tree)
+
+    return _load_or_build(snapshot_cache, config["balances_xml"]["path"], "balance", build_balance,
+                          params=(balance_model, config["corr_account"], config["balances_xml"]["namespace"]))
+
+
+@pytest.fixture(scope="session")
+def running_balance(request, pytestconfig, config, snapshot_cache: SnapshotCache) -> RunningBalance:
+    """Fixture for getting running balance of processed operations with 'StartRest' and 'Rest' of balance xml"""
+    def build_running_balance():
+        balance_xml_tree = request.getfixturevalue("balance_xml_tree")
+        return RunningBalance.from_balance(request.getfixturevalue("balance"), balance_xml_tree.get_start_rest(), balance_xml_tree.get_rest())
+
+    return _load_or_build(snapshot_cache, config["balances_xml"]["path"], "running_balance", build_running_balance,
+                          params=(pytestconfig.getoption("balance_model"), config["corr_account"], config["balances_xml"]["namespace"]))
 
 
 @pytest.fixture(scope="session")
@@ -55,14 +204,87 @@ def application_balances(config):
 
 @pytest.fixture(scope="session")
 def ed807_xml_tree(config: dict):
-    """Fixture to parse ed807 xml and return XML tree object"""
+    """Fixture to parse ed807 xml and return XML tree object (tests use `ed807_index`, which is kept between runs anyway)"""
     xml_path = config["ed807_xml"]["path"]
     xml_namespace = config["ed807_xml"]["namespace"]
     return XMLObject(xml_path, namespace=xml_namespace, encoding='windows-1251')
 
 
+@pytest.fixture(scope="session")
+def ed807_index(config: dict):
+    """Fixture to get persistent BIC index of ed807 xml, it is built only when ed807 file content changes"""
+    ed807_config = config["ed807_xml"]
+    index = ED807Index(ed807_config["path"], namespace=ed807_config["namespace"], encoding='windows-1251',
+                       index_dir=ed807_config.get("index_dir", ".cache/ed807"))
+    yield index
+    index.close()
+
+
 @pytest.fixture(scope="session")
 def epd_xml_tree(config: dict):
     """Fixture to parse epd xml and return XML tree object"""
     xml_path = config["epd_xml"]["path"]
-    return XMLObject(xml_path, encoding='windows-1251')
\ No newline at end of file
+    return PacketEPDXML(xml_path, encoding='windows-1251', config=config)
+
+
+@pytest.fixture(scope="session")
+def epd_header_tree(config: dict):
+    """Fixture to read header of epd xml (root attributes) without parsing of the whole document"""
+    return PacketEPDXML(config["epd_xml"]["path"], encoding='windows-1251', streaming=True, config=config)
+
+
+@pytest.fixture(scope="session")
+def epd_header_failures(config, ed807_index: ED807Index, epd_header_tree: PacketEPDXML) -> list:
+    """Fixture for getting names of failed header checks of epd xml, which ED101 checks compared with header depend on"""
+    mandatory_attributes = config["ed807_xml"]["header_mandatory_attributes"]
+    if not epd_header_tree.check_header_contains_attributes(*mandatory_attributes)[0]:
+        return ["header_contains_mandatory_attributes"]
+    ed807_header, epd_header = ed807_index.get_root_attributes(), epd_header_tree.get_root_attributes()
+    if any(ed807_header.get(attrib) != epd_header[attrib] for attrib in mandatory_attributes):
+        return ["header_mandatory_values_equal_ed807"]
+    return []
+
+
+@pytest.fixture
+def epd_header_passed(epd_header_failures: list):
+    """Fixture to skip test, which is meaningless with bad epd xml header (header itself is reported by its own tests)"""
+    if epd_header_failures:
+        pytest.skip(f"Prerequisites did not pass: {epd_header_failures}")
+
+
+@pytest.fixture
+def ed101_requisites_passed(epd_rules: dict):
+    """Fixture to skip test, which needs requisites of all ED101 (they are reported by their own test)"""
+    failed = [rule_name for side in ("payer", "payee") for attrib in ("BIC", "CorrespAcc")
+              if not epd_rules[rule_name := f"ed101_{side}_{attrib}"][0]]
+    if failed:
+        pytest.skip(f"Prerequisites did not pass: {failed}")
+
+
+@pytest.fixture(scope="session")
+def epd_rules(request, config, snapshot_cache: SnapshotCache) -> dict:
+    """Fixture for getting results of all structure rules of epd xml (see 'rules.json'), checked in one pass over 'ED101'"""
+    return _load_or_build(snapshot_cache, config["epd_xml"]["path"], "epd_rules",
+                          lambda: request.getfixturevalue("epd_xml_tree").evaluate_all_rules(),
+                          params=(config["ed807_xml"]["header_mandatory_attributes"],))
+
+
+@pytest.fixture(scope="session")
+def epd_summary(request, config, snapshot_cache: SnapshotCache) -> PacketSummary:
+    """Fixture for getting header reconciliation and ED101 totals of epd xml, collected in one pass"""
+    return _load_or_build(snapshot_cache, config["epd_xml"]["path"], "epd_summary",
+                          lambda: summarize_packet(request.getfixturevalue("epd_xml_tree")))
+
+
+@pytest.fixture(scope="session")
+def edno_analysis(request, config, snapshot_cache: SnapshotCache) -> EDNoAnalysis:
+    """Fixture for getting EDNo analysis of ED101 of epd xml (duplicates, missing ranges, order), numbers start from 1"""
+    return _load_or_build(snapshot_cache, config["epd_xml"]["path"], "edno_analysis",
+                          lambda: analyze_edno(request.getfixturevalue("epd_xml_tree"), start=1))
+
+
+@pytest.fixture(scope="session")
+def ed101_records(request, config, snapshot_cache: SnapshotCache):
+    """Fixture for getting all ED101 documents of epd xml projected to records"""
+    return _load_or_build(snapshot_cache, config["epd_xml"]["path"], "ed101_records",
+                          lambda: project_ed101(request.getfixturevalue("epd_xml_tree")))
\ No newline at end of file
@@ -1,85 +1,99 @@
 from dataclasses import dataclass
 from model.Operation import Operation
+from model.OperationsAggregator import OperationsAggregator
 from utils.xml import BalanceXML
 from utils.logger import logger
+from utils.instrumentation import instrumented
 
 @dataclass
 class Balance:
-    """ Class for balance model for checking business logic """
-    def __init__(self, self_corr_account: str, xml_tree_root: BalanceXML):
+    """
+    Class for balance model for checking business logic
+
+    If `aggregator` of previously parsed operations is given (e.g. from checkpoint), operations of `xml_tree_root`
+    are numbered after them and added to it, so totals and checks cover all operations, while `operations`
+    contains only the ones parsed from given tree.
+    With `strict` operations, which are both debit and credit or have invalid amount, fail model creation,
+    otherwise they are only reported by the corresponding checks.
+    """
+    @instrumented("model")
+    def __init__(self, self_corr_account: str, xml_tree_root: BalanceXML, aggregator: OperationsAggregator = None, strict: bool = True):
         self.corr_account = self_corr_account
+        # Totals and checks results are collected while parsing
+        self.aggregator = aggregator if aggregator is not None else OperationsAggregator(self_corr_account)
         self.operations = self._parse_operation_nodes(xml_tree_root)
-        self.total_processed_debit = self._calculate_processed_operation(is_debit=True)
-        self.total_processed_credit = self._calculate_processed_operation(is_debit=False)
-        
+        if strict:
+            assert self.each_operation_is_either_debit_or_credit()[0]
+            assert self.each_operation_has_valid_amount()[0]
+        logger.info("Total debit amount is '%s'", self.total_processed_debit)
+        logger.info("Total credit amount is '%s'", self.total_processed_credit)
+
+    @staticmethod
+    def operation_values(xml_tree_root: BalanceXML, oper) -> tuple:
+        """Raw values of operation node: (*date*, *status*, *corr account*, *dbt*, *cdt*)."""
+        return (
+            oper.get("data"),
+            xml_tree_root.find_text(xml_tree_root.node_status_locator, elem=oper),
+            # Т.к. из-за бага 'corAcc' в некоторых элементах аттрибут, а в некоторых подэлемент, то собираем его так:
+            oper.get("corAcc") or xml_tree_root.find_text(xml_tree_root.node_corrAcc_locator, elem=oper),
+            oper.get("dbt", default=''),
+            oper.get("cdt", default=''),
+        )
+
+    @staticmethod
+    def operation_from_node(xml_tree_root: BalanceXML, oper, id: int) -> Operation:
+        return Operation(id, *Balance.operation_values(xml_tree_root, oper))
+
     def _parse_operation_nodes(self, xml_tree_root: BalanceXML) -> list[Operation]:
         operations = []
-        for counter, oper in enumerate(xml_tree_root.find_all(xml_tree_root.node_operation_locator), start=1):
-            operations.append(
-                Operation(
-                    id = counter,
-                    date = oper.get("data"),
-                    status = oper.findtext(xml_tree_root.node_status_locator, namespaces=xml_tree_root.namespace),
-                    # Т.к. из-за бага 'corAcc' в некоторых элементах аттрибут, а в некоторых подэлемент, то собираем его так:
-                    corr_account = oper.get("corAcc") or oper.findtext(xml_tree_root.node_corrAcc_locator, namespaces=xml_tree_root.namespace),
-                    dbt = oper.get("dbt", default=''),
-                    cdt = oper.get("cdt", default='')
-                )
-            )
-        logger.info(f"Successfully parsed XML to Balance object with Operation entities")
+        first_id = self.aggregator.operations_count + 1
+        for counter, oper in enumerate(xml_tree_root.iter_nodes(xml_tree_root.node_operation_locator), start=first_id):
+            date, status, corr_account, dbt, cdt = self.operation_values(xml_tree_root, oper)
+            operation = Operation(counter, date, status, corr_account, dbt, cdt)
+            # Aggregator gets raw values, so fields of operation are decoded only if someone reads them
+            self.aggregator.add(counter, operation.is_processed, date, corr_account, dbt, cdt)
+            operations.append(operation)
+        logger.info("Successfully parsed XML to Balance object with Operation entities")
         return operations
-    
-    def _calculate_processed_operation(self, is_debit: bool):
-        assert self.each_operation_is_either_debit_or_credit()[0]
-        assert self.each_operation_has_valid_amount()[0]
-        total_amount = 0
-        for oper in self.operations:
-            if not oper.is_processed: # Хотя в инструкции про статусы ничего не сказано, но показалось логичным учитывать только заверешнные операции, т.е. со статусом "Выполнена"
-                continue
-            if is_debit and oper.debit_amount is None or not is_debit and oper.credit_amount is None:
-                continue
-            total_amount += oper.debit_amount if is_debit else oper.credit_amount
-        logger.info(f"Total {"debit" if is_debit else "credit"} amount is '{total_amount}'")
-        return total_amount
-    
+
+    @property
+    def total_processed_debit(self) -> int:
+        return self.aggregator.total_processed_debit
+
+    @property
+    def total_processed_credit(self) -> int:
+        return self.aggregator.total_processed_credit
+
+    @instrumented("check")
     def get_unique_dates(self):
-        return set([oper.date.strftime("%d-%m-%Y") for oper in self.operations])
-    
+        return set([date.strftime("%d-%m-%Y") for date in self.aggregator.unique_dates])
+
+    @instrumented("check")
     def cor_accounts_are_different_from_our(self):
-        logger.info(f"Checking that operation's cor accounts are different from our '{self.corr_account}'")
-        bad_ids = []
-        for oper in self.operations:
-            if oper.corr_account == self.corr_account:
-                bad_ids.append(oper.id)
+        logger.info("Checking that operation's cor accounts are different from our '%s'", self.corr_account)
+        bad_ids = self.aggregator.same_corr_account_ids
         if len(bad_ids) > 0:
-            logger.info(f"Ids of operations, which have same cor account as our '{bad_ids}'")
+            logger.info("Ids of operations, which have same cor account as our '%s'", logger.ids(bad_ids, "same_corr_account"))
             return False, bad_ids
-        logger.info(f"All operations have different cor acc from our!")
-        return True, len(self.operations)
+        logger.info("All operations have different cor acc from our!")
+        return True, self.aggregator.operations_count
 
+    @instrumented("check")
     def each_operation_is_either_debit_or_credit(self):
-        logger.info(f"Checking that each operation is either debit or credit")
-        bad_ids = []
-        for oper in self.operations: # Only one of debit or credit should be != None
-            if oper.credit_amount is None and oper.debit_amount is None or oper.credit_amount is not None and oper.debit_amount is not None:
-                bad_ids.append(oper.id)
+        logger.info("Checking that each operation is either debit or credit")
+        bad_ids = self.aggregator.not_debit_or_credit_ids
         if len(bad_ids) > 0:
-            logger.info(f"Ids of operations, which are both debit and credit '{bad_ids}'")
+            logger.info("Ids of operations, which are both debit and credit '%s'", logger.ids(bad_ids, "not_debit_or_credit"))
             return False, bad_ids
-        logger.info(f"All operations are either debit or credit!")
-        return True, len(self.operations)
-    
+        logger.info("All operations are either debit or credit!")
+        return True, self.aggregator.operations_count
+
+    @instrumented("check")
     def each_operation_has_valid_amount(self):
-        logger.info(f"Checking that each operation is valid ( > 0)")
-        bad_ids = []
-        for oper in self.operations: # Only one of debit or credit should be != None
-            if oper.credit_amount is not None and oper.credit_amount <= 0 or oper.debit_amount is not None and oper.debit_amount <= 0:
-                bad_ids.append(oper.id)
+        logger.info("Checking that each operation is valid ( > 0)")
+        bad_ids = self.aggregator.invalid_amount_ids
         if len(bad_ids) > 0:
-            logger.info(f"Ids of operations, which have invalid amount '{bad_ids}'")
+            logger.info("Ids of operations, which have invalid amount '%s'", logger.ids(bad_ids, "invalid_amount"))
             return False, bad_ids
-        logger.info(f"All operations have valid amount!")
-        return True, len(self.operations)
-    
-    
-    
\ No newline at end of file
+        logger.info("All operations have valid amount!")
+        return True, self.aggregator.operations_count
@@ -0,0 +1,114 @@
+from array import array
+from datetime import datetime, date
+from itertools import compress
+from operator import and_, eq, or_
+from model.Operation import PROCESSED_STATUS
+from utils.xml import BalanceXML
+from utils.logger import logger
+from utils.instrumentation import instrumented
+
+class ColumnarBalance:
+    """
+    Columnar variant of 'Balance' model with the same checks interface.
+
+    Instead of one 'Operation' object per 'Oper' node, operations are stored as typed arrays
+    (one value per operation, operation id is position + 1), and every total or check is
+    computed as masks over the whole columns.
+    """
+    DATE_FORMAT = "%d-%m-%Y"
+
+    @instrumented("model")
+    def __init__(self, self_corr_account: str, xml_tree_root: BalanceXML):
+        self.corr_account = self_corr_account
+        self.is_processed = array('b')
+        self.has_debit = array('b')
+        self.debit_amount = array('q') # 0 where operation has no debit, see 'has_debit'
+        self.has_credit = array('b')
+        self.credit_amount = array('q') # 0 where operation has no credit, see 'has_credit'
+        self.date_ordinal = array('l')
+        self.corr_account_code = array('l') # Index in 'corr_accounts'
+        self.corr_accounts: list[str] = [] # Interned corr account values
+        self._parse_operation_nodes(xml_tree_root)
+        assert self.each_operation_is_either_debit_or_credit()[0]
+        assert self.each_operation_has_valid_amount()[0]
+        self.total_processed_debit = self._calculate_processed_operation(is_debit=True)
+        self.total_processed_credit = self._calculate_processed_operation(is_debit=False)
+
+    def __len__(self) -> int:
+        return len(self.is_processed)
+
+    def _parse_operation_nodes(self, xml_tree_root: BalanceXML):
+        corr_account_codes = {}
+        date_ordinals = {}
+        for oper in xml_tree_root.iter_nodes(xml_tree_root.node_operation_locator):
+            status = xml_tree_root.find_text(xml_tree_root.node_status_locator, elem=oper)
+            self.is_processed.append(status == PROCESSED_STATUS)
+
+            raw_date = oper.get("data")
+            if raw_date not in date_ordinals:
+                date_ordinals[raw_date] = datetime.strptime(raw_date, self.DATE_FORMAT).toordinal()
+            self.date_ordinal.append(date_ordinals[raw_date])
+
+            # Т.к. из-за бага 'corAcc' в некоторых элементах аттрибут, а в некоторых подэлемент, то собираем его так:
+            corr_account = str(oper.get("corAcc") or xml_tree_root.find_text(xml_tree_root.node_corrAcc_locator, elem=oper))
+            if corr_account not in corr_account_codes:
+                corr_account_codes[corr_account] = len(self.corr_accounts)
+                self.corr_accounts.append(corr_account)
+            self.corr_account_code.append(corr_account_codes[corr_account])
+
+            dbt = oper.get("dbt", default='')
+            cdt = oper.get("cdt", default='')
+            self.has_debit.append(bool(dbt))
+            self.debit_amount.append(int(dbt) if dbt else 0)
+            self.has_credit.append(bool(cdt))
+            self.credit_amount.append(int(cdt) if cdt else 0)
+        logger.info("Successfully parsed XML to columnar Balance object with %s operations", len(self))
+
+    def _ids(self, mask) -> list[int]:
+        return list(compress(range(1, len(self) + 1), mask))
+
+    def _calculate_processed_operation(self, is_debit: bool):
+        # Missing amounts are stored as 0, so they do not affect the sum
+        amounts = self.debit_amount if is_debit else self.credit_amount
+        total_amount = sum(compress(amounts, self.is_processed))
+        logger.info("Total %s amount is '%s'", "debit" if is_debit else "credit", total_amount)
+        return total_amount
+
+    @instrumented("check")
+    def get_unique_dates(self):
+        return set(date.fromordinal(ordinal).strftime(self.DATE_FORMAT) for ordinal in set(self.date_ordinal))
+
+    @instrumented("check")
+    def cor_accounts_are_different_from_our(self):
+        logger.info("Checking that operation's cor accounts are different from our '%s'", self.corr_account)
+        bad_ids = []
+        if self.corr_account in self.corr_accounts:
+            our_code = self.corr_accounts.index(self.corr_account)
+            bad_ids = self._ids(map(our_code.__eq__, self.corr_account_code))
+        if len(bad_ids) > 0:
+            logger.info("Ids of operations, which have same cor account as our '%s'", logger.ids(bad_ids, "same_corr_account"))
+            return False, bad_ids
+        logger.info("All operations have different cor acc from our!")
+        return True, len(self)
+
+    @instrumented("check")
+    def each_operation_is_either_debit_or_credit(self):
+        logger.info("Checking that each operation is either debit or credit")
+        bad_ids = self._ids(map(eq, self.has_debit, self.has_credit)) # Only one of debit or credit should be present
+        if len(bad_ids) > 0:
+            logger.info("Ids of operations, which are both debit and credit '%s'", logger.ids(bad_ids, "not_debit_or_credit"))
+            return False, bad_ids
+        logger.info("All operations are either debit or credit!")
+        return True, len(self)
+
+    @instrumented("check")
+    def each_operation_has_valid_amount(self):
+        logger.info("Checking that each operation is valid ( > 0)")
+        bad_debit = map(and_, self.has_debit, map((0).__ge__, self.debit_amount))
+        bad_credit = map(and_, self.has_credit, map((0).__ge__, self.credit_amount))
+        bad_ids = self._ids(map(or_, bad_debit, bad_credit))
+        if len(bad_ids) > 0:
+            logger.info("Ids of operations, which have invalid amount '%s'", logger.ids(bad_ids, "invalid_amount"))
+            return False, bad_ids
+        logger.info("All operations have valid amount!")
+        return True, len(self)
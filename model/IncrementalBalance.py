@@ -0,0 +1,198 @@
+from dataclasses import dataclass
+from lxml import etree
+from model.Balance import Balance
+from model.OperationsAggregator import OperationsAggregator
+from utils.xml import BalanceXML
+from utils.logger import logger
+from utils.snapshot import code_fingerprint
+from typing import Dict, Optional, Tuple
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+
+@dataclass
+class BalanceCheckpoint:
+    """ State of balance validation after the last checked operation """
+    format_version: int
+    code_fingerprint: str
+    end_offset: int # Byte offset of balance node closing tag: new operations are appended right before it
+    prefix_sha256: str # Hash of all bytes before 'end_offset', to detect that already checked part of file was not changed
+    aggregator: OperationsAggregator # Totals, dates and bad ids of business rules
+    rules_results: Dict[str, tuple] # Results of structure rules of operation nodes
+
+
+class IncrementalBalance:
+    """
+    Balance validation, which after each run keeps checkpoint and on the next run checks only appended operations.
+
+    Statement grows by new 'Oper' nodes written before closing tag of balance node, so the file up to the offset
+    of that tag stays the same. On rerun only bytes between the checkpoint offset and the new closing tag are parsed
+(wrapped in the original opening tags of the file, so namespaces and prefixes are the same),
+    structure rules and business rules are run on these operations (numbered after already checked ones)
+    and their results are merged with checkpoint. If checkpoint does not exist or the checked part of file was
+    changed (hash of the whole part differs), the whole file is validated again. Checked part is only hashed,
+    not parsed, and the hash of the new checked part continues the hash of the old one, so it is read once.
+    """
+    FORMAT_VERSION = 2
+    BALANCE_NODE = "Ballance" # Same as 'BalanceXML.node_balance_locator'
+    READ_CHUNK = 1024 * 1024
+
+    def __init__(self, xml_path: str, self_corr_account: str, namespace: str = None, encoding: str = 'utf-8',
+                 checkpoint_dir: str = ".cache/checkpoints", strict: bool = True):
+        self.xml_path = xml_path
+        self.corr_account = self_corr_account
+        self.strict = strict # Same as `strict` of 'Balance'
+        self.namespace = namespace
+        self.encoding = encoding
+        self.checkpoint_dir = checkpoint_dir
+        self._closing_tag = re.compile(rb"</(?:[\w.-]+:)?" + re.escape(self.BALANCE_NODE.encode()) + rb"\s*>")
+        self._opening_tag = re.compile(rb"<(?:[\w.-]+:)?" + re.escape(self.BALANCE_NODE.encode()) +
+                                       rb"(?:\s(?:[^>\"']|\"[^\"]*\"|'[^']*')*)?>")
+
+    def _checkpoint_path(self) -> str:
+        key = hashlib.sha256(repr((os.path.abspath(self.xml_path), self.namespace, self.corr_account)).encode()).hexdigest()
+        return os.path.join(self.checkpoint_dir, f"balance-{key[:32]}.pickle")
+
+    def _load_checkpoint(self) -> Tuple[Optional[BalanceCheckpoint], Optional["hashlib._Hash"]]:
+        """Returns tuple of (*checkpoint*, *hash of checked part*) or (None, None) if checkpoint can not be used."""
+        checkpoint_path = self._checkpoint_path()
+        if not os.path.exists(checkpoint_path):
+            return None, None
+        try:
+            with open(checkpoint_path, "rb") as f:
+                checkpoint = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            logger.warning("Could not read checkpoint '%s': %r", checkpoint_path, e)
+            return None, None
+        if getattr(checkpoint, "format_version", None) != self.FORMAT_VERSION or checkpoint.code_fingerprint != code_fingerprint():
+            return None, None
+        if os.path.getsize(self.xml_path) < checkpoint.end_offset:
+            logger.info("'%s' is shorter than its checked part, checkpoint is not used", self.xml_path)
+            return None, None
+        prefix_sha = self._prefix_sha256(checkpoint.end_offset)
+        if prefix_sha.hexdigest() != checkpoint.prefix_sha256:
+            logger.info("Already checked part of '%s' was changed, checkpoint is not used", self.xml_path)
+            return None, None
+        return checkpoint, prefix_sha
+
+    def _store_checkpoint(self, checkpoint: BalanceCheckpoint):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".pickle.tmp", dir=self.checkpoint_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._checkpoint_path())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _prefix_sha256(self, end_offset: int, start: int = 0, sha: "hashlib._Hash" = None) -> "hashlib._Hash":
+        """Hash of file bytes before `end_offset`, read by chunks. `sha` of bytes before `start` is continued."""
+        sha = sha if sha is not None else hashlib.sha256()
+        with open(self.xml_path, "rb") as f:
+            f.seek(start)
+            remaining = end_offset - start
+            while remaining > 0 and (chunk := f.read(min(self.READ_CHUNK, remaining))):
+                sha.update(chunk)
+                remaining -= len(chunk)
+        return sha
+
+    def _find_balance_end(self, start: int) -> int:
+        """Offset of the last balance node closing tag after `start`, only this part of file is read."""
+        overlap = 256 # Tag can be split between chunks
+        end_offset = None
+        with open(self.xml_path, "rb") as f:
+            f.seek(start)
+            buffer_start, buffer = start, b""
+            while chunk := f.read(self.READ_CHUNK):
+                buffer += chunk
+                for match in self._closing_tag.finditer(buffer):
+                    end_offset = buffer_start + match.start()
+                keep = min(len(buffer), overlap)
+                buffer_start += len(buffer) - keep
+                buffer = buffer[len(buffer) - keep:]
+        if end_offset is None:
+            raise ValueError(f"Closing tag of '{self.BALANCE_NODE}' node not found in '{self.xml_path}'")
+        return end_offset
+
+    def _wrapper(self) -> Tuple[bytes, bytes]:
+        """
+        Returns tuple of (*file bytes up to the end of balance node opening tag*, *closing tags of its open ancestors*).
+
+        Fragment of operations is wrapped in them, so it has the same namespace declarations, prefixes and attributes
+        as the whole file. This part of file is before the checkpoint, so it is the same on each run.
+        """
+        with open(self.xml_path, "rb") as f:
+            head = b""
+            while not (match := self._opening_tag.search(head)):
+                chunk = f.read(self.READ_CHUNK)
+                if not chunk:
+                    raise ValueError(f"Opening tag of '{self.BALANCE_NODE}' node not found in '{self.xml_path}'")
+                head += chunk
+        head = head[:match.end()]
+        parser = etree.XMLPullParser(events=("start", "end"), encoding=self.encoding)
+        parser.feed(head)
+        open_nodes = []
+        for event, node in parser.read_events():
+            if event == "start":
+                open_nodes.append(node)
+            else:
+                open_nodes.pop()
+        tail = "".join(f"</{node.prefix + ':' if node.prefix else ''}{etree.QName(node).localname}>" for node in reversed(open_nodes))
+        return head, tail.encode(self.encoding)
+
+    def _parse_fragment(self, start: int, end: int) -> BalanceXML:
+        """Parse operations between given offsets as a document with the same structure as the whole file."""
+        with open(self.xml_path, "rb") as f:
+            f.seek(start)
+            fragment = f.read(end - start)
+        head, tail = self._wrapper()
+        tree = etree.ElementTree(etree.fromstring(head + fragment + tail, etree.XMLParser(encoding=self.encoding)))
+        return BalanceXML(self.xml_path, namespace=self.namespace, encoding=self.encoding, tree=tree)
+
+    @staticmethod
+    def _merge_rules_results(previous: Dict[str, tuple], current: Dict[str, tuple], nodes_total: int) -> Dict[str, tuple]:
+        merged = {}
+        for name, (ok, details) in current.items():
+            previous_ok, previous_details = previous.get(name, (True, 0))
+            bad_nodes = (previous_details if not previous_ok else []) + (details if not ok else [])
+            merged[name] = (False, bad_nodes) if len(bad_nodes) > 0 else (True, nodes_total)
+        return merged
+
+    def validate(self) -> Tuple[Dict[str, tuple], Balance]:
+        """
+        Validate operations appended since the last run (or the whole file) and store new checkpoint.
+
+        Returns tuple of (*results of operation structure rules, same as 'BalanceXML.evaluate_rules'*,
+        *'Balance' with totals and business rules results of all operations*).
+        """
+        checkpoint, prefix_sha = self._load_checkpoint()
+        if checkpoint is None:
+            logger.info("Validating whole '%s'", self.xml_path)
+            xml_tree = BalanceXML(self.xml_path, namespace=self.namespace, encoding=self.encoding)
+            rules_results = dict(xml_tree.evaluate_rules(xml_tree.node_operation_locator))
+            balance = Balance(self.corr_account, xml_tree, strict=self.strict)
+            end_offset = self._find_balance_end(0)
+            prefix_sha = self._prefix_sha256(end_offset)
+        else:
+            end_offset = self._find_balance_end(checkpoint.end_offset)
+            checked_operations = checkpoint.aggregator.operations_count
+            xml_tree = self._parse_fragment(checkpoint.end_offset, end_offset)
+            locator = xml_tree.node_operation_locator
+            rules_results = xml_tree.run_rules(locator, list(xml_tree.rules[locator].values()), start=checked_operations + 1)
+            balance = Balance(self.corr_account, xml_tree, aggregator=checkpoint.aggregator, strict=self.strict)
+            rules_results = self._merge_rules_results(checkpoint.rules_results, rules_results, balance.aggregator.operations_count)
+            logger.info("Validated %s operations appended to '%s' after %s checked ones",
+                        balance.aggregator.operations_count - checked_operations, self.xml_path, checked_operations)
+            prefix_sha = self._prefix_sha256(end_offset, checkpoint.end_offset, prefix_sha)
+        self._store_checkpoint(BalanceCheckpoint(
+            format_version=self.FORMAT_VERSION,
+            code_fingerprint=code_fingerprint(),
+            end_offset=end_offset,
+            prefix_sha256=prefix_sha.hexdigest(),
+            aggregator=balance.aggregator,
+            rules_results=rules_results,
+        ))
+        return rules_results, balance
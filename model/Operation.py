@@ -1,21 +1,58 @@
-from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
-@dataclass
+PROCESSED_STATUS = 'Выполнена'
+
+@lru_cache(maxsize=4096)
+def parse_operation_date(date: str) -> datetime:
+    """Parse operation date, memoized: statement usually has only a handful of distinct dates."""
+    return datetime.strptime(date, "%d-%m-%Y")
+
+
 class Operation:
-    """Class for operation unit in balance"""
-    id: int = field(init=False)
-    is_processed: bool = field(init=False)
-    date: datetime = field(init=False)
-    corr_account: str = field(init=False)
-    debit_amount: Optional[int] = field(init=False)
-    credit_amount: Optional[int] = field(init=False)
+    """
+    Class for operation unit in balance
+
+    Raw values from XML are stored as is and decoded only on the first access to the field
+    (amount slots hold raw string until they are decoded to int or None).
+    """
+    __slots__ = ("id", "is_processed", "_date", "_corr_account", "_debit_amount", "_credit_amount")
 
     def __init__(self, id: int, date: str, status: str, corr_account: str, dbt: str, cdt: str):
-        self.id = id
-        self.is_processed = status == 'Выполнена'
-        self.date = datetime.strptime(date, "%d-%m-%Y")
-        self.corr_account = str(corr_account)
-        self.debit_amount = int(dbt) if dbt else None
-        self.credit_amount = int(cdt) if cdt else None
\ No newline at end of file
+        self.id: int = id
+        self.is_processed: bool = status == PROCESSED_STATUS
+        self._date: str = date
+        self._corr_account = corr_account
+        self._debit_amount = dbt or ''
+        self._credit_amount = cdt or ''
+
+    @property
+    def date(self) -> datetime:
+        return parse_operation_date(self._date)
+
+    @property
+    def corr_account(self) -> str:
+        return str(self._corr_account)
+
+    @property
+    def debit_amount(self) -> Optional[int]:
+        if isinstance(self._debit_amount, str):
+            self._debit_amount = int(self._debit_amount) if self._debit_amount else None
+        return self._debit_amount
+
+    @property
+    def credit_amount(self) -> Optional[int]:
+        if isinstance(self._credit_amount, str):
+            self._credit_amount = int(self._credit_amount) if self._credit_amount else None
+        return self._credit_amount
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Operation):
+            return NotImplemented
+        return (self.id, self.is_processed, self.date, self.corr_account, self.debit_amount, self.credit_amount) == \
+            (other.id, other.is_processed, other.date, other.corr_account, other.debit_amount, other.credit_amount)
+
+    def __repr__(self) -> str:
+        return f"Operation(id={self.id}, is_processed={self.is_processed}, date={self._date!r}, corr_account={self.corr_account!r}, " \
+            f"debit_amount={self.debit_amount}, credit_amount={self.credit_amount})"
@@ -0,0 +1,67 @@
+from datetime import datetime
+import heapq
+from model.Operation import parse_operation_date
+
+class OperationsAggregator:
+    """
+    Class for accumulating totals and business rules results of balance operations in one pass.
+
+    Operations are added one by one while they are parsed, so no check has to scan operations list again.
+    Values are added raw, as they are in XML, so 'Operation' fields stay not decoded: amounts are converted
+    here once, dates are kept as distinct strings and parsed only when `unique_dates` is read.
+    """
+    def __init__(self, self_corr_account: str):
+        self.corr_account = self_corr_account
+        self.operations_count = 0
+        self.total_processed_debit = 0
+        self.total_processed_credit = 0
+        self.raw_dates: set[str] = set()
+        self.processed_by_date: dict[str, list[int]] = {} # Raw date -> [debit, credit] of processed operations of this date
+        self.same_corr_account_ids: list[int] = []
+        self.not_debit_or_credit_ids: list[int] = []
+        self.invalid_amount_ids: list[int] = []
+
+    @property
+    def unique_dates(self) -> set[datetime]:
+        return {parse_operation_date(date) for date in self.raw_dates}
+
+    def add(self, id: int, is_processed: bool, date: str, corr_account: str, dbt: str, cdt: str):
+        """Add operation by raw values of its node (same as arguments of 'Operation')."""
+        self.operations_count += 1
+        self.raw_dates.add(date)
+        if corr_account == self.corr_account:
+            self.same_corr_account_ids.append(id)
+        debit_amount = int(dbt) if dbt else None
+        credit_amount = int(cdt) if cdt else None
+        # Only one of debit or credit should be != None
+        if credit_amount is None and debit_amount is None or credit_amount is not None and debit_amount is not None:
+            self.not_debit_or_credit_ids.append(id)
+        if credit_amount is not None and credit_amount <= 0 or debit_amount is not None and debit_amount <= 0:
+            self.invalid_amount_ids.append(id)
+        # Хотя в инструкции про статусы ничего не сказано, но показалось логичным учитывать только заверешнные операции, т.е. со статусом "Выполнена"
+        if is_processed:
+            date_totals = self.processed_by_date.get(date)
+            if date_totals is None:
+                date_totals = self.processed_by_date[date] = [0, 0]
+            if debit_amount is not None:
+                self.total_processed_debit += debit_amount
+                date_totals[0] += debit_amount
+            if credit_amount is not None:
+                self.total_processed_credit += credit_amount
+                date_totals[1] += credit_amount
+
+    def merge(self, *others: "OperationsAggregator"):
+        """Add totals and results of other operations (e.g. of other partitions), ids stay in document order."""
+        for other in others:
+            self.operations_count += other.operations_count
+            self.total_processed_debit += other.total_processed_debit
+            self.total_processed_credit += other.total_processed_credit
+            self.raw_dates.update(other.raw_dates)
+            for date, (debit, credit) in other.processed_by_date.items():
+                date_totals = self.processed_by_date.setdefault(date, [0, 0])
+                date_totals[0] += debit
+                date_totals[1] += credit
+        # Ids of each aggregator are already sorted, so they are merged, not sorted again
+        self.same_corr_account_ids = list(heapq.merge(self.same_corr_account_ids, *(other.same_corr_account_ids for other in others)))
+        self.not_debit_or_credit_ids = list(heapq.merge(self.not_debit_or_credit_ids, *(other.not_debit_or_credit_ids for other in others)))
+        self.invalid_amount_ids = list(heapq.merge(self.invalid_amount_ids, *(other.invalid_amount_ids for other in others)))
@@ -0,0 +1,216 @@
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from model.Balance import Balance
+from model.Operation import PROCESSED_STATUS
+from model.OperationsAggregator import OperationsAggregator
+from utils.xml import BalanceXML
+from utils.logger import logger, process_pool_context
+from utils.instrumentation import instrumented
+from utils import sources
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from xml.sax.saxutils import quoteattr, unescape
+import mmap
+import os
+import re
+
+PartitionKey = Tuple[str, str] # (account, corr account)
+BALANCE_NODE = "Ballance" # Same as 'BalanceXML.node_balance_locator'
+_BALANCE_TAG = re.compile(rb"<(/?)(?:[\w.-]+:)?" + BALANCE_NODE.encode() + rb"\b([^>]*)>")
+_OPERATION_START = re.compile(rb"<(?:[\w.-]+:)?Oper[\s/>]")
+
+
+class OperationsRange(NamedTuple):
+    """ Consecutive 'Oper' nodes of one balance node as byte offsets in file """
+    account: Optional[str] # Account attribute of balance node, None if it is missing
+    start: int
+    end: int
+
+
+def _aggregate_operations(xml_tree_root: BalanceXML, default_account: str, account_attrib: str) -> Dict[PartitionKey, OperationsAggregator]:
+    """Aggregate all operations of tree by (account, corr account), operations are numbered from 1."""
+    partitions: Dict[PartitionKey, OperationsAggregator] = {}
+    for counter, oper in enumerate(xml_tree_root.iter_nodes(xml_tree_root.node_operation_locator), start=1):
+        balance_node = oper.getparent() # Also available in streaming mode: parent is started before its children
+        account = (balance_node.get(account_attrib) if balance_node is not None else None) or default_account
+        date, status, corr_account, dbt, cdt = Balance.operation_values(xml_tree_root, oper)
+        key = (account, str(corr_account))
+        aggregator = partitions.get(key)
+        if aggregator is None:
+            aggregator = partitions[key] = OperationsAggregator(account)
+        aggregator.add(counter, status == PROCESSED_STATUS, date, corr_account, dbt, cdt)
+    return partitions
+
+
+def _aggregate_range(xml_path: str, namespace: Optional[str], encoding: str, account_attrib: str, default_account: str,
+                     operations_range: OperationsRange) -> Dict[PartitionKey, OperationsAggregator]:
+    """
+    Parse only given range of file in worker process, as a document with the same structure as the whole file.
+    Operations are numbered from 1 in the range, ids are shifted by the caller, which knows amounts of previous ranges.
+    """
+    with open(xml_path, "rb") as f:
+        f.seek(operations_range.start)
+        fragment = f.read(operations_range.end - operations_range.start)
+    xmlns = f" xmlns={quoteattr(namespace)}" if namespace else ""
+    account = f" {account_attrib}={quoteattr(operations_range.account)}" if operations_range.account is not None else ""
+    document = f"<Document{xmlns}><{BALANCE_NODE}{account}>".encode(encoding) + fragment + f"</{BALANCE_NODE}></Document>".encode(encoding)
+    tree = etree.ElementTree(etree.fromstring(document, etree.XMLParser(encoding=encoding)))
+    xml_tree_root = BalanceXML(xml_path, namespace=namespace, encoding=encoding, tree=tree)
+    return _aggregate_operations(xml_tree_root, default_account, account_attrib)
+
+
+def _shift_ids(aggregator: OperationsAggregator, offset: int):
+    aggregator.same_corr_account_ids = [id + offset for id in aggregator.same_corr_account_ids]
+    aggregator.not_debit_or_credit_ids = [id + offset for id in aggregator.not_debit_or_credit_ids]
+    aggregator.invalid_amount_ids = [id + offset for id in aggregator.invalid_amount_ids]
+
+
+def split_operations(xml_path: str, parts: int, account_attrib: str = "acc") -> List[OperationsRange]:
+    """
+    Split 'Oper' nodes of file into about `parts` ranges of equal size in bytes without parsing it: only balance
+    tags are found by regular expression over memory-mapped file, and each range boundary is moved
+    to the next operation start tag. Ranges do not cross balance nodes, so account of each range is known.
+    """
+    account_pattern = re.compile(rb"\s" + re.escape(account_attrib.encode()) + rb"\s*=\s*([\"'])(.*?)\1", re.S)
+    balances = [] # [account, offset after balance start tag, offset of balance closing tag]
+    ranges = []
+    with open(xml_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for match in _BALANCE_TAG.finditer(data):
+            is_closing, attributes = match.groups()
+            if is_closing:
+                if balances and balances[-1][2] is None:
+                    balances[-1][2] = match.start()
+            elif not attributes.endswith(b"/"):
+                account = account_pattern.search(attributes)
+                balances.append([unescape(account.group(2).decode(), {"&quot;": '"', "&apos;": "'"}) if account else None, match.end(), None])
+        if any(end is None for _, _, end in balances):
+            raise ValueError(f"Closing tag of '{BALANCE_NODE}' node not found in '{xml_path}'")
+        part_bytes = max(1, -(-sum(end - start for _, start, end in balances) // max(1, parts)))
+        for account, start, end in balances:
+            first_operation = _OPERATION_START.search(data, start, end)
+            range_start = first_operation.start() if first_operation is not None else end
+            while range_start < end:
+                boundary = _OPERATION_START.search(data, range_start + part_bytes, end) if range_start + part_bytes < end else None
+                range_end = boundary.start() if boundary is not None else end
+                ranges.append(OperationsRange(account, range_start, range_end))
+                range_start = range_end
+    return ranges
+
+
+class PartitionedBalance:
+    """
+    Balance model of consolidated statement with many accounts, checked in one pass over operations
+
+    Account of operation is attribute `account_attrib` of its balance node ('Ballance' nodes can be repeated
+    for each account), statement of a single account without it gets `default_account`. Operations are grouped
+    into partitions by (account, corr account), each partition is aggregated by its own 'OperationsAggregator'
+    (totals, dates and business rules results, same as for 'Balance'). Operation ids are numbers in the whole document.
+
+    With `workers` > 1 and path of plain XML file, the file is not parsed here: it is split into byte ranges of
+    operations (see `split_operations`) and each worker process parses and aggregates only its ranges, so only
+    small aggregators are passed between processes. Like 'IncrementalBalance', ranges are parsed with default
+    namespace `namespace`, so prefixes (if any) should be declared on operation nodes themselves. Pool pays off
+    only on several CPU cores (e.g. 400k operations: range split takes ~8% and each of 4 ranges ~28% of one-process
+    time), so amount of workers is limited by CPU count and with one worker everything is done in the current process.
+    """
+    @instrumented("model")
+    def __init__(self, xml_tree_root: Union[BalanceXML, str], default_account: str, account_attrib: str = "acc", workers: int = 1,
+                 namespace: str = None, encoding: str = 'utf-8'):
+        self.default_account = default_account
+        self.account_attrib = account_attrib
+        xml_path = xml_tree_root if isinstance(xml_tree_root, str) else None
+        workers = min(workers, os.cpu_count() or 1)
+        if workers > 1 and xml_path is not None and sources.plain_path(xml_path) is not None:
+            self.partitions = self._aggregate_in_workers(xml_path, namespace, encoding, workers)
+        else:
+            if xml_path is not None:
+                xml_tree_root = BalanceXML(xml_path, namespace=namespace, encoding=encoding)
+            self.partitions = _aggregate_operations(xml_tree_root, default_account, account_attrib)
+        self._account_aggregators: Dict[str, OperationsAggregator] = None
+        logger.info("Statement is split into %s partitions of %s accounts", len(self.partitions), len(self.accounts()))
+
+    def _aggregate_in_workers(self, xml_path: str, namespace: Optional[str], encoding: str,
+                              workers: int) -> Dict[PartitionKey, OperationsAggregator]:
+        ranges = split_operations(xml_path, workers, self.account_attrib)
+        parts: Dict[PartitionKey, List[OperationsAggregator]] = {}
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(ranges))), mp_context=process_pool_context()) as executor:
+            results = executor.map(_aggregate_range, *zip(*[(xml_path, namespace, encoding, self.account_attrib,
+                                                              self.default_account, operations_range) for operations_range in ranges]))
+            checked_operations = 0
+            for range_partitions in results: # In document order, so ids of each partition stay sorted
+                for key, aggregator in range_partitions.items():
+                    _shift_ids(aggregator, checked_operations)
+                    parts.setdefault(key, []).append(aggregator)
+                checked_operations += sum(aggregator.operations_count for aggregator in range_partitions.values())
+        partitions = {}
+        for key, aggregators in parts.items():
+            partitions[key] = aggregators[0]
+            partitions[key].merge(*aggregators[1:])
+        return partitions
+
+    def accounts(self) -> List[str]:
+        return sorted({account for account, _ in self.partitions})
+
+    def account_aggregator(self, account: str) -> OperationsAggregator:
+        """Totals and rules results of all partitions of the account, they are merged once for all accounts."""
+        if self._account_aggregators is None:
+            account_partitions: Dict[str, List[OperationsAggregator]] = {}
+            for (partition_account, _), partition in self.partitions.items():
+                account_partitions.setdefault(partition_account, []).append(partition)
+            self._account_aggregators = {}
+            for partition_account, partitions in account_partitions.items():
+                aggregator = self._account_aggregators[partition_account] = OperationsAggregator(partition_account)
+                aggregator.merge(*partitions)
+        return self._account_aggregators.get(account) or OperationsAggregator(account)
+
+    def _check_accounts(self, bad_ids_name: str, account: Optional[str]):
+        accounts = [account] if account is not None else self.accounts()
+        bad_ids = {}
+        operations_count = 0
+        for checked_account in accounts:
+            aggregator = self.account_aggregator(checked_account)
+            operations_count += aggregator.operations_count
+            if getattr(aggregator, bad_ids_name):
+                bad_ids[checked_account] = getattr(aggregator, bad_ids_name)
+        if bad_ids:
+            logger.info("Ids of bad operations by account: %s", bad_ids)
+            return False, bad_ids
+        return True, operations_count
+
+    @instrumented("check")
+    def cor_accounts_are_different_from_our(self, account: str = None):
+        """
+        Check that corr account of operations differs from their account (of given one or of all accounts).
+
+        Returns tuple of    (True, *amount of checked operations*) or
+                            (False, *dict of account to ids of bad operations*).
+        """
+        logger.info("Checking that operation's cor accounts are different from their accounts")
+        return self._check_accounts("same_corr_account_ids", account)
+
+    @instrumented("check")
+    def each_operation_is_either_debit_or_credit(self, account: str = None):
+        logger.info("Checking that each operation is either debit or credit")
+        return self._check_accounts("not_debit_or_credit_ids", account)
+
+    @instrumented("check")
+    def each_operation_has_valid_amount(self, account: str = None):
+        logger.info("Checking that each operation is valid ( > 0)")
+        return self._check_accounts("invalid_amount_ids", account)
+
+    def summary(self) -> List[dict]:
+        """Totals and date spread of each partition, sorted by account and corr account."""
+        rows = []
+        for (account, corr_account), aggregator in sorted(self.partitions.items()):
+            dates = sorted(aggregator.unique_dates)
+            rows.append({
+                "account": account,
+                "corr_account": corr_account,
+                "operations": aggregator.operations_count,
+                "processed_debit": aggregator.total_processed_debit,
+                "processed_credit": aggregator.total_processed_credit,
+                "first_date": dates[0].strftime("%d-%m-%Y") if dates else None,
+                "last_date": dates[-1].strftime("%d-%m-%Y") if dates else None,
+                "dates": len(dates),
+                "same_corr_account": len(aggregator.same_corr_account_ids) > 0,
+            })
+        return rows
@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from itertools import accumulate, compress
+from operator import itemgetter
+from typing import Iterable, Optional, Tuple, Union
+from model.Balance import Balance
+from model.Operation import parse_operation_date
+from model.ColumnarBalance import ColumnarBalance
+from utils.logger import logger
+from utils.instrumentation import instrumented
+
+class RunningBalance:
+    """
+    Running balance of processed operations for reconciliation of 'Rest' with 'StartRest' and date queries
+
+    Operations are sorted by date once and prefix sums of debit and credit are built, so balance at any date
+    and turnover between any dates are found by binary search in O(log n) without scanning operations.
+    Balance is 'StartRest' + debit - credit, only processed operations are counted (same as totals of 'Balance').
+    Missing 'StartRest' is not an error of the model: rest can not be calculated then and `check_rest` fails.
+    """
+    DATE_FORMAT = "%d-%m-%Y"
+
+    @instrumented("model")
+    def __init__(self, start_rest: Optional[int], rest: Optional[int], entries: Iterable[Tuple[int, int, int]]):
+        """`entries` are (date ordinal, debit amount, credit amount) of processed operations (or of their dates) in any order."""
+        self.start_rest = start_rest
+        self.rest = rest
+        ordered = sorted(entries, key=itemgetter(0))
+        self.date_ordinals = array('l', map(itemgetter(0), ordered))
+        # prefix_debit[k] is sum of debit of the first k operations by date
+        self.prefix_debit = array('q', accumulate(map(itemgetter(1), ordered), initial=0))
+        self.prefix_credit = array('q', accumulate(map(itemgetter(2), ordered), initial=0))
+
+    @classmethod
+    def from_balance(cls, balance: Union[Balance, ColumnarBalance], start_rest: Optional[int], rest: Optional[int]) -> "RunningBalance":
+        if isinstance(balance, ColumnarBalance):
+            entries = compress(zip(balance.date_ordinal, balance.debit_amount, balance.credit_amount), balance.is_processed)
+        else:
+            # Totals per date of all operations, also of ones from checkpoint, which are not in `balance.operations`
+            entries = ((parse_operation_date(day).toordinal(), debit, credit)
+                       for day, (debit, credit) in balance.aggregator.processed_by_date.items())
+        return cls(start_rest, rest, entries)
+
+    def __len__(self) -> int:
+        return len(self.date_ordinals)
+
+    def _ordinal(self, day: Union[str, date]) -> int:
+        if isinstance(day, str):
+            day = datetime.strptime(day, self.DATE_FORMAT)
+        return day.toordinal()
+
+    @property
+    def final_rest(self) -> Optional[int]:
+        """'StartRest' + debit - credit of all processed operations, None if 'StartRest' is missing."""
+        if self.start_rest is None:
+            return None
+        return self.start_rest + self.prefix_debit[-1] - self.prefix_credit[-1]
+
+    def balance_at(self, day: Union[str, date]) -> int:
+        """Balance at the end of given day (date or string in 'dd-mm-YYYY' format)."""
+        if self.start_rest is None:
+            raise ValueError("Balance can not be calculated without 'StartRest'")
+        position = bisect_right(self.date_ordinals, self._ordinal(day))
+        return self.start_rest + self.prefix_debit[position] - self.prefix_credit[position]
+
+    def turnover(self, first_day: Union[str, date], last_day: Union[str, date]) -> Tuple[int, int]:
+        """Returns tuple of (*debit*, *credit*) of operations from `first_day` to `last_day` inclusive."""
+        start = bisect_left(self.date_ordinals, self._ordinal(first_day))
+        end = max(start, bisect_right(self.date_ordinals, self._ordinal(last_day)))
+        return self.prefix_debit[end] - self.prefix_debit[start], self.prefix_credit[end] - self.prefix_credit[start]
+
+    @instrumented("check")
+    def check_rest(self):
+        """Returns tuple of (*is equal*, (*'Rest' of statement*, *'StartRest' + debit - credit*))."""
+        logger.info("Checking that 'Rest' is equal to 'StartRest' + debit - credit of processed operations")
+        if self.start_rest is None:
+            logger.info("'StartRest' of statement is missing or not numeric, rest can not be calculated")
+            return False, (self.rest, None)
+        if self.rest is None or self.rest != self.final_rest:
+            logger.info("'Rest' of statement is '%s', but calculated rest is '%s'", self.rest, self.final_rest)
+            return False, (self.rest, self.final_rest)
+        logger.info("'Rest' is equal to calculated rest '%s'!", self.final_rest)
+        return True, (self.rest, self.final_rest)
@@ -1,44 +1,43 @@
 from utils.logger import logger
-from utils.xml import BalanceXML
 from model.Balance import Balance
+from model.RunningBalance import RunningBalance
+from utils.failures import failure_report
 from pytest_check import check
 
 
 class TestBalanceXMLStructure:
-    def test_balance_node_exist(self, balance_xml_tree: BalanceXML):
-        search_result = balance_xml_tree.find("ns:Balance")
+    def test_balance_node_exist(self, balance_structure: dict):
+        search_result = balance_structure["balance_node"]
         logger.info(f"Search result for 'Balance' node: {search_result}")
-        assert search_result is not None, "Balance XML should contain 'Balance' as node"
+        assert search_result, "Balance XML should contain 'Balance' as node"
 
-    def test_balance_has_operation_children(self, balance_xml_tree: BalanceXML):
-        unique_child_nodes = balance_xml_tree.get_element_unique_children_names(
-            balance_xml_tree.find(balance_xml_tree.node_balance_locator)
-        )
+    def test_balance_has_operation_children(self, balance_structure: dict):
+        unique_child_nodes = balance_structure["balance_children"]
         
         with check:
             assert "Operation" in unique_child_nodes, "Balance node should contain children called 'Operation'"
         with check:
             assert len(unique_child_nodes) == 1, "Balance node should contain only 1 type of children which is 'Operation'"
 
-    def test_operation_node_contains_attrib_date(self, balance_xml_tree: BalanceXML):
-        check_result, check_descr = balance_xml_tree.check_all_operation_nodes_contain_date()
+    def test_operation_node_contains_attrib_date(self, balance_structure: dict):
+        check_result, check_descr = balance_structure["rules"]["operation_date"]
         assert check_result, \
-            f"All nodes should contain attribute 'date'. Found nodes without it: {check_descr}!"
+            f"All nodes should contain attribute 'date'. Found nodes without it: {failure_report(check_descr, 'operations_without_date')}!"
 
-    def test_operation_node_contains_attrib_corAcc(self, balance_xml_tree: BalanceXML):
-        check_result, check_descr = balance_xml_tree.check_all_operation_nodes_contain_corr_acc()
+    def test_operation_node_contains_attrib_corAcc(self, balance_structure: dict):
+        check_result, check_descr = balance_structure["rules"]["operation_corAcc"]
         assert check_result, \
-            f"All nodes should contain attribute 'corAcc'. Found nodes without it: {check_descr}!"
+            f"All nodes should contain attribute 'corAcc'. Found nodes without it: {failure_report(check_descr, 'operations_without_corAcc')}!"
 
-    def test_operation_node_contains_attrib_one_of_dbt_cdt(self, balance_xml_tree: BalanceXML):
-        check_result, check_descr = balance_xml_tree.check_all_operation_nodes_contain_dbt_or_cdt()
+    def test_operation_node_contains_attrib_one_of_dbt_cdt(self, balance_structure: dict):
+        check_result, check_descr = balance_structure["rules"]["operation_dbt_or_cdt"]
         assert check_result, \
-            f"All nodes should contain only one of attributes 'dbt' or 'cdt'. Found bad nodes: {check_descr}!"
+            f"All nodes should contain only one of attributes 'dbt' or 'cdt'. Found bad nodes: {failure_report(check_descr, 'operations_without_one_of_dbt_cdt')}!"
         
-    def test_operation_node_contains_subNode_with_status(self, balance_xml_tree: BalanceXML):
-        check_result, check_descr = balance_xml_tree.check_all_operation_nodes_contain_status_node()
+    def test_operation_node_contains_subNode_with_status(self, balance_structure: dict):
+        check_result, check_descr = balance_structure["rules"]["operation_status_node"]
         assert check_result, \
-            f"All nodes should contain child node 'Status'. Found nodes without it: {check_descr}!"
+            f"All nodes should contain child node 'Status'. Found nodes without it: {failure_report(check_descr, 'operations_without_status')}!"
 
 
 
@@ -51,17 +50,23 @@ class TestBalanceBusinessLogic:
     def test_corr_accounts_are_different_from_our(self, balance: Balance):
         check_result, check_descr = balance.cor_accounts_are_different_from_our()
         assert check_result, \
-            f"All operations should have different corr account from our! These operations have same corr account: {check_descr}!"
+            f"All operations should have different corr account from our! These operations have same corr account: {failure_report(check_descr, 'operations_with_same_corr_account')}!"
         
     def test_operation_amounts_are_correct(self, balance: Balance):
         check_result, check_descr = balance.each_operation_is_either_debit_or_credit()
         assert check_result, \
-            f"All operations should be either debit or credit! These operations are not correct: {check_descr}!"
+            f"All operations should be either debit or credit! These operations are not correct: {failure_report(check_descr, 'operations_not_debit_or_credit')}!"
         
     def test_operation_amounts_are_valid(self, balance: Balance):
         check_result, check_descr = balance.each_operation_has_valid_amount()
         assert check_result, \
-            f"All operations should have valid amount ( > 0)! These operation amounts are not correct: {check_descr}!"
+            f"All operations should have valid amount ( > 0)! These operation amounts are not correct: {failure_report(check_descr, 'operations_with_invalid_amount')}!"
+        
+    def test_balance_rest_equals_start_rest_and_operations(self, running_balance: RunningBalance):
+        assert running_balance.start_rest is not None, "Balance XML should contain numeric 'StartRest'!"
+        check_result, (rest, calculated_rest) = running_balance.check_rest()
+        assert check_result, \
+            f"'Rest' of balance should be equal to 'StartRest' + debit - credit of processed operations ({calculated_rest}), but got '{rest}'!"
         
     def test_application_difference_is_correct(self, application_balances: dict):
         assert application_balances["difference"] == application_balances["debit_total"] - application_balances["credit_total"], \
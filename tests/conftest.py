@@ -0,0 +1,29 @@
+import os
+import pytest
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BALANCE_NAMESPACE = "iso.cbr.ru"
+ED807_NAMESPACE = "urn:cbr-ru:ed:v2.0"
+CORR_ACCOUNT = "40817_K1"
+
+
+@pytest.fixture(scope="session")
+def fixture_path():
+    """Fixture to get path of small XML file from 'tests/fixtures' by its name"""
+    return lambda name: os.path.join(FIXTURES_DIR, name)
+
+
+@pytest.fixture
+def fixture_config(tmp_path) -> dict:
+    """Fixture to get config of fixture files, same as 'config.json', caches are kept in temporary directory"""
+    return {
+        "balances_xml": {"path": os.path.join(FIXTURES_DIR, "balance_small.xml"), "namespace": BALANCE_NAMESPACE},
+        "corr_account": CORR_ACCOUNT,
+        "ed807_xml": {
+            "path": os.path.join(FIXTURES_DIR, "ed807_small.xml"),
+            "namespace": ED807_NAMESPACE,
+            "header_mandatory_attributes": ["EDNo", "EDDate", "EDAuthor"],
+            "index_dir": str(tmp_path / "ed807"),
+        },
+        "epd_xml": {"path": os.path.join(FIXTURES_DIR, "packet_epd_small.xml")},
+    }
@@ -0,0 +1,23 @@
+from datetime import datetime
+from model.Balance import Balance
+from utils.xml import BalanceXML
+from tests.conftest import BALANCE_NAMESPACE, CORR_ACCOUNT
+
+
+def _balance(fixture_path) -> Balance:
+    return Balance(CORR_ACCOUNT, BalanceXML(fixture_path("balance_small.xml"), namespace=BALANCE_NAMESPACE))
+
+
+class TestBalance:
+    def test_totals_count_only_processed_operations(self, fixture_path):
+        balance = _balance(fixture_path)
+        assert (balance.total_processed_debit, balance.total_processed_credit) == (60, 30)
+        assert balance.get_unique_dates() == {"03-03-2021", "04-03-2021", "05-03-2021"}
+        assert balance.each_operation_is_either_debit_or_credit() == (True, 4)
+
+    def test_operations_are_not_decoded_by_aggregation(self, fixture_path):
+        balance = _balance(fixture_path)
+        operation = balance.operations[0]
+        assert (operation._date, operation._debit_amount) == ("03-03-2021", "50")
+        assert (operation.date, operation.debit_amount, operation.credit_amount) == (datetime(2021, 3, 3), 50, None)
+        assert operation.corr_account == "40719"
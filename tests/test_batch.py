@@ -0,0 +1,37 @@
+from utils.batch import collect_files, detect_kind, validate_batch, KIND_BALANCE, KIND_EPD
+from utils.logger import process_pool_context
+import multiprocessing
+import os
+import shutil
+import time
+
+
+class TestBatch:
+    def test_files_of_directory_are_validated(self, tmp_path, fixture_path, fixture_config):
+        for name in ("balance_small.xml", "packet_epd_small.xml"):
+            shutil.copy(fixture_path(name), tmp_path / name)
+        xml_paths = collect_files([str(tmp_path)])
+        assert [detect_kind(xml_path) for xml_path in xml_paths] == [KIND_BALANCE, KIND_EPD]
+        report = validate_batch(xml_paths, fixture_config, workers=2)
+        balance_result, epd_result = report["files"]
+        assert epd_result["ok"], epd_result
+        assert epd_result["checks"]["ed101_filled_from_ed807"]["ok"]
+        assert not balance_result["ok"] and not balance_result["checks"]["operations_happened_one_date"]["ok"]
+        assert (report["total"], report["passed"], report["failed"]) == (2, 1, 1)
+
+    def test_timeout_is_per_file_and_stuck_worker_is_terminated(self, tmp_path, fixture_path, fixture_config):
+        stuck_path = str(tmp_path / "stuck.xml")
+        os.mkfifo(stuck_path) # Worker blocks on opening it, as there is no writer
+        good_path = shutil.copy(fixture_path("packet_epd_small.xml"), tmp_path / "packet.xml")
+        started = time.monotonic()
+        report = validate_batch([stuck_path, str(good_path)], fixture_config, workers=1, timeout=2)
+        stuck_result, good_result = report["files"]
+        assert "not finished in 2 seconds" in stuck_result["error"]
+        assert good_result["ok"], "File after stuck one should be validated by new worker"
+        assert time.monotonic() - started < 30
+
+    def test_spawned_workers_where_forkserver_is_not_available(self, monkeypatch, fixture_path, fixture_config):
+        monkeypatch.setattr(multiprocessing, "get_all_start_methods", lambda: ["spawn"]) # Same as on Windows
+        assert process_pool_context().get_start_method() == "spawn"
+        report = validate_batch([fixture_path("packet_epd_small.xml")], fixture_config, workers=1)
+        assert report["passed"] == 1, report
@@ -0,0 +1,24 @@
+from model.Balance import Balance
+from model.ColumnarBalance import ColumnarBalance
+from utils.xml import BalanceXML
+from tests.conftest import BALANCE_NAMESPACE, CORR_ACCOUNT
+
+
+class TestColumnarBalance:
+    def test_same_results_as_balance(self, fixture_path):
+        xml_tree = BalanceXML(fixture_path("balance_small.xml"), namespace=BALANCE_NAMESPACE)
+        balance = Balance(CORR_ACCOUNT, xml_tree)
+        columnar = ColumnarBalance(CORR_ACCOUNT, xml_tree)
+        assert len(columnar) == len(balance.operations) == 4
+        assert (columnar.total_processed_debit, columnar.total_processed_credit) == (balance.total_processed_debit, balance.total_processed_credit) == (60, 30)
+        assert columnar.get_unique_dates() == balance.get_unique_dates()
+        for check in ("cor_accounts_are_different_from_our", "each_operation_is_either_debit_or_credit", "each_operation_has_valid_amount"):
+            assert getattr(columnar, check)() == getattr(balance, check)(), check
+
+    def test_operations_with_our_corr_account(self, fixture_path, tmp_path):
+        with open(fixture_path("balance_small.xml"), "r", encoding="utf-8") as f:
+            text = f.read().replace('corAcc="40811"', f'corAcc="{CORR_ACCOUNT}"')
+        xml_path = tmp_path / "balance.xml"
+        xml_path.write_text(text, encoding="utf-8")
+        columnar = ColumnarBalance(CORR_ACCOUNT, BalanceXML(str(xml_path), namespace=BALANCE_NAMESPACE))
+        assert columnar.cor_accounts_are_different_from_our() == (False, [3])
@@ -0,0 +1,51 @@
+from utils.daemon import ValidationDaemon, is_loopback, send_request
+import asyncio
+import os
+import pytest
+import shutil
+
+
+def _run_daemon(config: dict, scenario, socket_path: str, **kwargs):
+    async def run():
+        daemon = ValidationDaemon(config, **kwargs)
+        await daemon.start(socket_path=socket_path)
+        try:
+            return await scenario(daemon)
+        finally:
+            await daemon.close()
+    return asyncio.run(run())
+
+
+class TestValidationDaemon:
+    def test_files_are_validated_over_socket(self, tmp_path, fixture_path, fixture_config):
+        socket_path = str(tmp_path / "validation.sock")
+        packet_path = fixture_path("packet_epd_small.xml")
+
+        async def scenario(daemon):
+            report = await asyncio.to_thread(send_request, {"paths": [packet_path]}, socket_path)
+            status = await asyncio.to_thread(send_request, {"command": "status"}, socket_path)
+            bad_request = await asyncio.to_thread(send_request, {"unknown": 1}, socket_path)
+            return report, status, bad_request
+
+        report, status, bad_request = _run_daemon(fixture_config, scenario, socket_path, workers=1)
+        assert (report["total"], report["passed"]) == (1, 1), report
+        assert status["validated"] == 1
+        assert "error" in bad_request
+
+    def test_stuck_worker_is_replaced(self, tmp_path, fixture_path, fixture_config):
+        stuck_path = str(tmp_path / "stuck.xml")
+        os.mkfifo(stuck_path) # Worker blocks on opening it, as there is no writer
+        packet_path = str(shutil.copy(fixture_path("packet_epd_small.xml"), tmp_path / "packet.xml"))
+
+        async def scenario(daemon):
+            return await daemon.handle_request({"paths": [stuck_path, packet_path]})
+
+        report = _run_daemon(fixture_config, scenario, str(tmp_path / "validation.sock"), workers=1, timeout=2)
+        stuck_result, packet_result = report["files"]
+        assert "not finished in 2 seconds" in stuck_result["error"]
+        assert packet_result["ok"], "File queued behind stuck one should be validated in new pool"
+
+    def test_only_loopback_host(self, fixture_config):
+        assert is_loopback("127.0.0.1") and is_loopback("localhost") and not is_loopback("0.0.0.0")
+        with pytest.raises(ValueError):
+            asyncio.run(ValidationDaemon(fixture_config).start(host="0.0.0.0", port=0))
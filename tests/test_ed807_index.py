@@ -0,0 +1,98 @@
+from utils.ed807_index import ED807Index, KEY_STEP, _assign_sort_keys
+from tests.conftest import ED807_NAMESPACE
+
+NEW_ENTRY = """	<BICDirectoryEntry BIC="046577000">
+		<ParticipantInfo NameP="Bank Ekaterinburg" CntrCd="RU" Rgn="65" Nnp="Ekaterinburg" PtType="20" ParticipantStatus="PSAC"/>
+	</BICDirectoryEntry>
+"""
+
+
+def _read(path) -> str:
+    with open(path, "r", encoding="windows-1251") as f:
+        return f.read()
+
+
+def _write(path, text: str) -> str:
+    with open(path, "w", encoding="windows-1251") as f:
+        f.write(text)
+    return str(path)
+
+
+def _entry_text(text: str, bic: str) -> str:
+    start = text.index(f'\t<BICDirectoryEntry BIC="{bic}">')
+    end = text.index("</BICDirectoryEntry>\n", start) + len("</BICDirectoryEntry>\n")
+    return text[start:end]
+
+
+def _index(xml_path, index_dir) -> ED807Index:
+    return ED807Index(str(xml_path), namespace=ED807_NAMESPACE, index_dir=str(index_dir))
+
+
+class TestED807Index:
+    def test_lookups(self, tmp_path, fixture_path):
+        index = _index(fixture_path("ed807_small.xml"), tmp_path)
+        assert len(index) == 4
+        assert index.get_root_attributes()["EDNo"] == "705999466"
+        entry = index.get("200000155")
+        assert (entry.position, entry.participant_info["Nnp"], len(entry.accounts)) == (2, "Kirov", 2)
+        assert index.at_position(3).bic == "044525787"
+        assert index.at_position(5) is None and index.get("000000000") is None
+        assert [entry.position for entry in index.entries()] == [1, 2, 3, 4]
+        assert "044525311" in index and index.changes() is None
+        index.close()
+
+    def test_delta_updates_only_differing_entries(self, tmp_path, fixture_path):
+        text = _read(fixture_path("ed807_small.xml"))
+        previous = _index(fixture_path("ed807_small.xml"), tmp_path)
+        previous_keys = list(previous.sort_keys())
+
+        new_text = text.replace(_entry_text(text, "200000155"), _entry_text(text, "200000155") + NEW_ENTRY)
+        new_text = new_text.replace(_entry_text(text, "045004162"), "").replace('Nnp="Kirov"', 'Nnp="Kirov-2"').replace('EDNo="705999466"', 'EDNo="705999467"')
+        index = _index(_write(tmp_path / "ed807_new.xml", new_text), tmp_path)
+        changes = index.changes()
+        assert (changes.added, changes.removed, changes.changed) == (["046577000"], ["045004162"], ["200000155"])
+        assert (changes.moved, changes.unchanged) == (0, 2)
+        assert previous.get_root_attributes()["EDNo"] == "705999466" and previous.get("045004162") is not None, \
+            "Open index of the previous version should not be changed"
+        assert index.get_root_attributes()["EDNo"] == "705999467"
+        assert [entry.bic for entry in index.entries()] == ["200000155", "046577000", "044525787", "044525311"]
+        assert index.get("044525787").position == 3 and index.at_position(2).participant_info["Nnp"] == "Ekaterinburg"
+        keys = list(index.sort_keys())
+        assert keys[0] == previous_keys[1] and keys[2:] == previous_keys[2:], "Entries around new one should keep their keys"
+        assert _index(fixture_path("ed807_small.xml"), tmp_path).get("045004162") is not None
+        index.close()
+        previous.close()
+
+    def test_delta_base_is_previous_version_of_same_directory(self, tmp_path, fixture_path):
+        text = _read(fixture_path("ed807_small.xml"))
+        _index(fixture_path("ed807_small.xml"), tmp_path).close()
+        other_author = _index(_write(tmp_path / "other.xml", text.replace('EDAuthor="4583001999"', 'EDAuthor="4525000000"')), tmp_path)
+        assert other_author.changes() is None, "Directory of other author should not be built as delta"
+        other_author.close()
+
+        next_day = text.replace('EDDate="2024-11-02"', 'EDDate="2024-11-03"').replace('Nnp="Kirov"', 'Nnp="Kirov-2"')
+        index = _index(_write(tmp_path / "next_day.xml", next_day), tmp_path)
+        assert index.changes().changed == ["200000155"]
+        index.close()
+
+    def test_moved_entry(self, tmp_path, fixture_path):
+        text = _read(fixture_path("ed807_small.xml"))
+        _index(fixture_path("ed807_small.xml"), tmp_path).close()
+        last = _entry_text(text, "044525311")
+        index = _index(_write(tmp_path / "ed807_new.xml", text.replace(last, "").replace(_entry_text(text, "045004162"), last + _entry_text(text, "045004162"))), tmp_path)
+        changes = index.changes()
+        assert (changes.added, changes.removed, changes.changed, changes.moved, changes.unchanged) == ([], [], [], 1, 3)
+        assert [entry.bic for entry in index.entries()] == ["044525311", "045004162", "200000155", "044525787"]
+        index.close()
+
+
+class TestAssignSortKeys:
+    def test_new_entries_get_keys_in_gaps(self):
+        previous_keys = [None, KEY_STEP, 3 * KEY_STEP, None, 2 * KEY_STEP, None]
+        keys, anchors = _assign_sort_keys(previous_keys)
+        assert len(anchors) == 2 and all(keys[i] == previous_keys[i] for i in anchors)
+        assert keys == sorted(keys) and len(set(keys)) == len(keys)
+
+    def test_exhausted_gap_renumbers_all(self):
+        keys, _ = _assign_sort_keys([1, None, 2])
+        assert keys == [KEY_STEP, 2 * KEY_STEP, 3 * KEY_STEP]
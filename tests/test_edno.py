@@ -0,0 +1,67 @@
+from utils.edno import EDNoBitmap, EDNoRegistry, analyze_edno
+from utils.xml import XMLObject
+import random
+import time
+
+PACKET = """<?xml version="1.0" encoding="UTF-8"?>
+<PacketEPD EDAuthor="4583001999" EDDate="2024-11-02" EDNo="1" EDQuantity="{quantity}" SystemCode="01" Sum="0">{documents}</PacketEPD>
+"""
+
+
+def _packet(*ednos) -> XMLObject:
+    documents = "".join(f'<ED101 EDAuthor="4583001999" EDDate="2024-11-02" EDNo="{edno}" Sum="0"/>' for edno in ednos)
+    return XMLObject(PACKET.format(quantity=len(ednos), documents=documents).encode(), encoding="utf-8")
+
+
+def _brute_force_missing(values: set, start: int, end: int) -> list:
+    ranges = []
+    for value in range(start, end + 1):
+        if value in values:
+            continue
+        if ranges and ranges[-1][1] == value - 1:
+            ranges[-1] = (ranges[-1][0], value)
+        else:
+            ranges.append((value, value))
+    return ranges
+
+
+class TestEDNoBitmap:
+    def test_missing_ranges_are_same_as_brute_force(self):
+        rng = random.Random(0)
+        values = set(rng.sample(range(3 * EDNoBitmap.PAGE_BITS), 5000)) | set(range(100, 300))
+        bitmap = EDNoBitmap()
+        for value in values:
+            bitmap.add(value)
+        for start, end in ((0, 3 * EDNoBitmap.PAGE_BITS), (150, 70000), (EDNoBitmap.PAGE_BITS + 3, 2 * EDNoBitmap.PAGE_BITS + 5)):
+            assert bitmap.missing_ranges(start, end) == _brute_force_missing(values, start, end)
+
+    def test_sparse_large_numbers_are_not_walked(self):
+        bitmap = EDNoBitmap()
+        for value in (1, 2, 3, 10, 200000, 10 ** 12):
+            bitmap.add(value)
+        started = time.perf_counter()
+        assert bitmap.missing_ranges(1, 10 ** 12) == [(4, 9), (11, 199999), (200001, 10 ** 12 - 1)]
+        assert time.perf_counter() - started < 1
+        assert len(bitmap.pages) == 3
+
+
+class TestAnalyzeEDNo:
+    def test_sequence(self):
+        analysis = analyze_edno(_packet(1, 2, 3))
+        assert analysis.is_sequence
+        assert (analysis.count, analysis.min_edno, analysis.max_edno) == (3, 1, 3)
+
+    def test_problems_are_reported_by_positions(self):
+        analysis = analyze_edno(_packet(1, 4, 2, 4, "x", 0), start=1)
+        assert not analysis.is_sequence
+        assert analysis.duplicates == [(4, 4)]
+        assert analysis.missing_ranges == [(3, 3)]
+        assert analysis.out_of_order == [(3, 4, 2), (6, 4, 0)]
+        assert analysis.invalid == [5]
+        assert analysis.below_start == [(6, 0)]
+
+    def test_reuse_across_packets_of_same_author_and_date(self):
+        registry = EDNoRegistry()
+        assert registry.analyze(_packet(1, 2)).is_sequence
+        analysis = registry.analyze(_packet(1, 2, 3))
+        assert analysis.reused_from_other_packets == [(1, 1), (2, 2)]
@@ -0,0 +1,44 @@
+from utils import failures
+from utils.failures import FailureReport, clear_sidecars, read_page, shared_report
+from types import SimpleNamespace
+import conftest
+import glob
+import os
+
+
+class TestFailureReport:
+    def test_short_list_is_kept_in_memory(self, tmp_path):
+        report = FailureReport("ids", max_examples=5, sidecar_dir=str(tmp_path))
+        report.extend([1, 2, 3])
+        assert not report.truncated and str(report) == "[1, 2, 3]" and report.sidecar_path is None
+
+    def test_long_list_is_spilled_to_sidecar(self, tmp_path):
+        report = FailureReport("bad ids", max_examples=3, sidecar_dir=str(tmp_path))
+        report.extend(range(1, 11))
+        message = report.message()
+        assert message.startswith("1\n2\n3\n... (10 total") and report.sidecar_path in message
+        assert [record["defect"] for record in read_page(report.sidecar_path, page=2, page_size=4)] == [5, 6, 7, 8]
+
+    def test_shared_report_is_made_once_per_list(self):
+        ids = list(range(100))
+        report = shared_report(ids, "ids", max_examples=10)
+        assert shared_report(ids, "ids", max_examples=10) is report
+        os.remove(report.sidecar_path)
+
+    def test_clear_sidecars(self, tmp_path):
+        (tmp_path / "old.jsonl").write_text("{}\n")
+        clear_sidecars(str(tmp_path))
+        assert glob.glob(str(tmp_path / "*.jsonl")) == []
+
+
+class TestSidecarsOfRun:
+    def test_sidecars_are_cleared_only_on_controller(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(failures, "clear_sidecars", lambda *args: calls.append(args))
+        monkeypatch.setattr(conftest.instrumentation, "configure", lambda **kwargs: None)
+        options = {"instrument": False, "trace_memory": False, "profile_check": None, "profile_mode": None}
+        worker_config = SimpleNamespace(workerinput={"workerid": "gw0"}, getoption=options.get)
+        conftest.pytest_configure(worker_config)
+        assert calls == []
+        conftest.pytest_configure(SimpleNamespace(getoption=options.get))
+        assert len(calls) == 1
@@ -0,0 +1,74 @@
+from model.Balance import Balance
+from model.IncrementalBalance import IncrementalBalance
+from utils.xml import BalanceXML
+from tests.conftest import BALANCE_NAMESPACE, CORR_ACCOUNT
+import re
+import shutil
+
+APPENDED_OPERATIONS = """		<Oper data="06-03-2021" corAcc="40911" cdt="5">
+			<Status>Выполнена</Status>
+		</Oper>
+		<Oper data="06-03-2021" corAcc="40817_K1" dbt="7">
+			<Status>Выполнена</Status>
+		</Oper>
+"""
+
+
+def _append_operations(xml_path, operations: str = APPENDED_OPERATIONS, closing_tag: str = "</Ballance>"):
+    with open(xml_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write(text.replace("\t" + closing_tag, operations + "\t" + closing_tag))
+
+
+def _full_balance(xml_path) -> Balance:
+    return Balance(CORR_ACCOUNT, BalanceXML(xml_path, namespace=BALANCE_NAMESPACE))
+
+
+class TestIncrementalBalance:
+    def test_appended_operations_are_merged_with_checkpoint(self, tmp_path, fixture_path):
+        xml_path = shutil.copy(fixture_path("balance_small.xml"), tmp_path / "balance.xml")
+        incremental = IncrementalBalance(str(xml_path), CORR_ACCOUNT, namespace=BALANCE_NAMESPACE, checkpoint_dir=str(tmp_path / "checkpoints"))
+        _, first_balance = incremental.validate()
+        assert len(first_balance.operations) == 4
+
+        _append_operations(xml_path)
+        rules_results, balance = incremental.validate()
+        expected = _full_balance(xml_path)
+        assert len(balance.operations) == 2, "Only appended operations should be parsed"
+        assert balance.aggregator.operations_count == 6
+        assert (balance.total_processed_debit, balance.total_processed_credit) == (expected.total_processed_debit, expected.total_processed_credit)
+        assert balance.cor_accounts_are_different_from_our() == (False, [6])
+        assert rules_results["operation_date"] == (False, [1, 2, 3, 4, 5, 6])
+        assert rules_results["operation_status_node"] == (True, 6)
+
+    def test_change_of_checked_part_revalidates_whole_file(self, tmp_path, fixture_path):
+        xml_path = shutil.copy(fixture_path("balance_small.xml"), tmp_path / "balance.xml")
+        _append_operations(xml_path, APPENDED_OPERATIONS * 500) # Changed operation is far from the end of checked part
+        incremental = IncrementalBalance(str(xml_path), CORR_ACCOUNT, namespace=BALANCE_NAMESPACE, checkpoint_dir=str(tmp_path / "checkpoints"))
+        incremental.validate()
+
+        with open(xml_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(xml_path, "w", encoding="utf-8") as f: # Same size, so only hash of checked part can detect it
+            f.write(text.replace('dbt="50"', 'dbt="90"', 1))
+        _append_operations(xml_path)
+        _, balance = incremental.validate()
+        expected = _full_balance(xml_path)
+        assert len(balance.operations) == 1006, "Whole file should be parsed again"
+        assert (balance.total_processed_debit, balance.total_processed_credit) == (expected.total_processed_debit, expected.total_processed_credit)
+
+    def test_prefixed_namespace(self, tmp_path, fixture_path):
+        with open(fixture_path("balance_small.xml"), "r", encoding="utf-8") as f:
+            text = re.sub(r"<(/?)(\w+)", r"<\1b:\2", f.read()) # XML declaration starts with '<?', so it is not changed
+        xml_path = tmp_path / "balance.xml"
+        xml_path.write_text(text.replace('<b:Document xmlns="iso.cbr.ru">', '<b:Document xmlns:b="iso.cbr.ru" Version="1">'), encoding="utf-8")
+        incremental = IncrementalBalance(str(xml_path), CORR_ACCOUNT, namespace=BALANCE_NAMESPACE, checkpoint_dir=str(tmp_path / "checkpoints"))
+        incremental.validate()
+
+        _append_operations(xml_path, re.sub(r"<(/?)(\w+)", r"<\1b:\2", APPENDED_OPERATIONS), closing_tag="</b:Ballance>")
+        rules_results, balance = incremental.validate()
+        expected = _full_balance(xml_path)
+        assert len(balance.operations) == 2, "Only appended operations should be parsed"
+        assert (balance.total_processed_debit, balance.total_processed_credit) == (expected.total_processed_debit, expected.total_processed_credit)
+        assert rules_results["operation_status_node"] == (True, 6)
@@ -0,0 +1,56 @@
+from model.OperationsAggregator import OperationsAggregator
+from model.PartitionedBalance import PartitionedBalance, split_operations
+from utils.xml import BalanceXML
+from tests.conftest import BALANCE_NAMESPACE, CORR_ACCOUNT
+
+
+def _partitioned(xml_path) -> PartitionedBalance:
+    return PartitionedBalance(BalanceXML(xml_path, namespace=BALANCE_NAMESPACE), CORR_ACCOUNT)
+
+
+class TestPartitionedBalance:
+    def test_operations_are_grouped_by_account_of_balance_node(self, fixture_path):
+        partitioned = _partitioned(fixture_path("balance_accounts.xml"))
+        assert partitioned.accounts() == ["A1", "A2"]
+        assert sorted(partitioned.partitions) == [("A1", "40911"), ("A1", "A1"), ("A2", "40719"), ("A2", "40911")]
+        assert partitioned.cor_accounts_are_different_from_our() == (False, {"A1": [2]})
+        assert partitioned.each_operation_is_either_debit_or_credit() == (False, {"A2": [5]})
+        assert partitioned.each_operation_has_valid_amount("A1") == (True, 3)
+        account_aggregator = partitioned.account_aggregator("A2")
+        assert (account_aggregator.total_processed_debit, account_aggregator.total_processed_credit) == (12, 7)
+        assert partitioned.account_aggregator("A2") is account_aggregator, "Rollups should be merged once"
+
+    def test_statement_without_accounts_gets_default_account(self, fixture_path):
+        partitioned = _partitioned(fixture_path("balance_small.xml"))
+        assert partitioned.accounts() == [CORR_ACCOUNT]
+        assert sum(row["operations"] for row in partitioned.summary()) == 4
+
+    def test_ranges_do_not_cross_balance_nodes(self, fixture_path):
+        xml_path = fixture_path("balance_accounts.xml")
+        ranges = split_operations(xml_path, parts=4)
+        with open(xml_path, "rb") as f:
+            data = f.read()
+        assert [operations_range.account for operations_range in ranges] == ["A1", "A1", "A2", "A2"]
+        assert sum(data[start:end].count(b"<Oper ") for _, start, end in ranges) == 6
+        assert all(b"Ballance" not in data[start:end] for _, start, end in ranges)
+
+    def test_ranges_parsed_by_workers_give_same_partitions(self, fixture_path):
+        xml_path = fixture_path("balance_accounts.xml")
+        expected = _partitioned(xml_path)
+        partitioned = PartitionedBalance(xml_path, CORR_ACCOUNT, namespace=BALANCE_NAMESPACE)
+        partitioned.partitions = partitioned._aggregate_in_workers(xml_path, BALANCE_NAMESPACE, "utf-8", workers=4)
+        assert partitioned.summary() == expected.summary()
+        assert partitioned.each_operation_is_either_debit_or_credit() == expected.each_operation_is_either_debit_or_credit()
+        assert partitioned.each_operation_has_valid_amount() == (False, {"A2": [6]})
+
+
+class TestOperationsAggregator:
+    def test_merge_keeps_ids_in_document_order(self):
+        aggregators = [OperationsAggregator("A1") for _ in range(3)]
+        for id in range(1, 10):
+            aggregators[id % 3].add(id, True, "03-03-2021", "A1", "1", "")
+        merged = OperationsAggregator("A1")
+        merged.merge(*aggregators)
+        assert merged.same_corr_account_ids == list(range(1, 10))
+        assert merged.operations_count == 9
+        assert merged.processed_by_date == {"03-03-2021": [9, 0]}
@@ -0,0 +1,51 @@
+from utils.ed807_index import ED807Index
+from utils.reconciler import MODE_BIC, MODE_POSITIONAL, project_ed101, project_ed807, reconcile
+from utils.xml import PacketEPDXML, XMLObject
+from tests.conftest import ED807_NAMESPACE
+import pytest
+
+
+@pytest.fixture
+def ed807_index(tmp_path, fixture_path):
+    index = ED807Index(fixture_path("ed807_small.xml"), namespace=ED807_NAMESPACE, index_dir=str(tmp_path))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def ed101_records(fixture_path):
+    return project_ed101(PacketEPDXML(fixture_path("packet_epd_small.xml"), streaming=True))
+
+
+class TestReconcile:
+    def test_projection_of_index_is_same_as_of_xml(self, fixture_path, ed807_index):
+        xml_tree = XMLObject(fixture_path("ed807_small.xml"), namespace=ED807_NAMESPACE, encoding="windows-1251")
+        assert project_ed807(ed807_index) == project_ed807(xml_tree)
+
+    @pytest.mark.parametrize("mode", [MODE_POSITIONAL, MODE_BIC])
+    def test_filled_packet(self, ed101_records, ed807_index, mode):
+        result = reconcile(ed101_records, ed807_index, mode=mode)
+        assert result.errors == [] and not result.stopped
+
+    def test_modes_differ_on_reordered_directory(self, ed101_records, ed807_index):
+        entries = project_ed807(ed807_index)
+        reordered = entries[2:] + entries[:2]
+        assert reconcile(ed101_records, reordered, mode=MODE_BIC).errors == []
+        errors = reconcile(ed101_records, reordered, mode=MODE_POSITIONAL).errors
+        assert len(errors) > 0 and errors[0].startswith("ED101 1 element's AccDocNo")
+
+    def test_unknown_bic(self, ed101_records, ed807_index):
+        records = [ed101_records[0]._replace(payee_bic="000000000")] + ed101_records[1:]
+        errors = reconcile(records, ed807_index, mode=MODE_BIC).errors
+        assert errors[0] == "ED101 1 element's payee BIC '000000000' is not found in ED807!"
+
+    def test_result_does_not_depend_on_workers(self, ed101_records, ed807_index):
+        records = [record._replace(sum="0") for record in ed101_records]
+        entries = project_ed807(ed807_index)
+        one_process = reconcile(records, entries, chunk_size=1)
+        assert len(one_process.errors) == 2
+        assert reconcile(records, entries, workers=2, chunk_size=1).errors == one_process.errors
+
+    def test_directory_longer_than_packet_stops(self, ed101_records, ed807_index):
+        result = reconcile(ed101_records[:1], ed807_index)
+        assert result.stopped and result.errors[-1].startswith("ED101 elements ended")
@@ -0,0 +1,69 @@
+from lxml import etree
+from utils.rules import (AttributeEquals, NodeRule, OneOfAttributes, RequiredAttribute, RequiredChild, RequiredChildAttribute,
+                         build_rules, compile_rules)
+import pytest
+
+NODES = b"""<Doc xmlns="urn:test">
+    <Node a="1" b="2"><Child x="1"/><Bank BIC="1"/></Node>
+    <Node a="1"><Payer><Bank BIC="2"/></Payer></Node>
+    <Node b="3"><Payer><Bank/></Payer><Child/></Node>
+    <Node/>
+</Doc>"""
+NAMESPACES = {"ns": "urn:test"}
+
+
+class EvenNode(NodeRule):
+    """ Not inlined rule, it is called by compiled function as is """
+    description = "be even"
+
+    def check(self, node, node_num: int) -> bool:
+        return node_num % 2 == 0
+
+
+def _nodes():
+    return etree.fromstring(NODES).findall("ns:Node", namespaces=NAMESPACES)
+
+
+RULES = [
+    RequiredAttribute("a"),
+    OneOfAttributes("a", "b"),
+    RequiredChild("Child"),
+    AttributeEquals("b", "3"),
+    RequiredChildAttribute("ns:Payer/ns:Bank", "BIC", namespaces=NAMESPACES),
+    RequiredChildAttribute("ns:Payer/ns:Bank", "Absent", namespaces=NAMESPACES),
+    EvenNode("even"),
+]
+
+
+class TestCompileRules:
+    def test_compiled_function_is_same_as_rules_checks(self):
+        nodes_total, bad = compile_rules(RULES)(_nodes(), 1)
+        assert nodes_total == 4
+        for rule, bad_nums in zip(RULES, bad):
+            expected = [num for num, node in enumerate(_nodes(), start=1) if not rule.check(node, num)]
+            assert bad_nums == expected, rule.name
+        assert bad[:3] == [[3, 4], [1, 4], [2, 4]]
+
+    def test_numbers_start_from_given_one(self):
+        _, bad = compile_rules([RequiredAttribute("a")])(_nodes(), 11)
+        assert bad == [[13, 14]]
+
+
+class TestBuildRules:
+    def test_references_are_resolved_and_lists_expanded(self):
+        specs = [
+            {"name": "header", "rule": "required_attribute", "attrib": "$config.mandatory"},
+            {"name": "date", "rule": "attribute_equals", "attrib": "EDDate", "value": "$header.EDDate"},
+            {"name": "payer", "rule": "required_child_attribute", "child": "Payer/Bank", "attrib": "BIC"},
+        ]
+        rules = build_rules(specs, {"config": {"mandatory": ["EDNo", "EDDate"]}, "header": {"EDDate": "2024-11-02"}}, NAMESPACES)
+        assert [rule.name for rule in rules] == ["header_EDNo", "header_EDDate", "date", "payer"]
+        assert rules[2].expected_value == "2024-11-02"
+        assert rules[3].child_path == "ns:Payer/ns:Bank"
+
+    def test_rule_with_missing_reference_is_skipped(self):
+        assert build_rules([{"rule": "attribute_equals", "attrib": "EDDate", "value": "$header.EDDate"}], {}) == []
+
+    def test_unknown_rule_type(self):
+        with pytest.raises(ValueError):
+            build_rules([{"rule": "attribute_sequence", "attrib": "EDNo"}], {})
@@ -0,0 +1,42 @@
+from model.Balance import Balance
+from model.ColumnarBalance import ColumnarBalance
+from model.IncrementalBalance import IncrementalBalance
+from model.RunningBalance import RunningBalance
+from utils.xml import BalanceXML
+from tests.conftest import BALANCE_NAMESPACE, CORR_ACCOUNT
+from tests.test_incremental_balance import _append_operations
+import pytest
+import shutil
+
+
+def _running_balance(xml_path, model=Balance) -> RunningBalance:
+    xml_tree = BalanceXML(xml_path, namespace=BALANCE_NAMESPACE)
+    return RunningBalance.from_balance(model(CORR_ACCOUNT, xml_tree), xml_tree.get_start_rest(), xml_tree.get_rest())
+
+
+class TestRunningBalance:
+    @pytest.mark.parametrize("model", [Balance, ColumnarBalance])
+    def test_rest_and_date_queries(self, fixture_path, model):
+        running_balance = _running_balance(fixture_path("balance_small.xml"), model)
+        assert running_balance.check_rest() == (True, (130, 130))
+        assert running_balance.balance_at("02-03-2021") == 100
+        assert running_balance.balance_at("03-03-2021") == 120
+        assert running_balance.turnover("03-03-2021", "05-03-2021") == (60, 30)
+        assert running_balance.turnover("04-03-2021", "04-03-2021") == (0, 0)
+
+    def test_missing_start_rest_is_reported(self):
+        running_balance = RunningBalance(None, 130, [(1, 10, 0)])
+        assert running_balance.final_rest is None
+        assert running_balance.check_rest() == (False, (130, None))
+        with pytest.raises(ValueError):
+            running_balance.balance_at("03-03-2021")
+
+    def test_incremental_balance_counts_checkpoint_operations(self, tmp_path, fixture_path):
+        xml_path = str(shutil.copy(fixture_path("balance_small.xml"), tmp_path / "balance.xml"))
+        incremental = IncrementalBalance(xml_path, CORR_ACCOUNT, namespace=BALANCE_NAMESPACE, checkpoint_dir=str(tmp_path / "checkpoints"))
+        incremental.validate()
+        _append_operations(xml_path)
+        _, balance = incremental.validate()
+        xml_tree = BalanceXML(xml_path, namespace=BALANCE_NAMESPACE)
+        running_balance = RunningBalance.from_balance(balance, xml_tree.get_start_rest(), xml_tree.get_rest())
+        assert running_balance.final_rest == _running_balance(xml_path).final_rest == 100 + 67 - 35
@@ -0,0 +1,71 @@
+from utils.scheduler import Check, CheckScheduler, COST_EXPENSIVE, COST_HEADER, COST_MODEL
+from utils.batch import validate_balance_file, validate_epd_file
+import pytest
+
+
+def _raise(error: Exception):
+    raise error
+
+
+class TestCheckScheduler:
+    def test_cheap_checks_are_run_first(self):
+        order = []
+        checks = [Check(name, lambda name=name: order.append(name) or (True, name), cost)
+                  for name, cost in (("model", COST_MODEL), ("header", COST_HEADER), ("nodes", 10))]
+        outcomes = CheckScheduler(checks).run()
+        assert order == ["header", "nodes", "model"]
+        assert list(outcomes) == ["model", "header", "nodes"], "Outcomes should keep order of declaration"
+
+    @pytest.mark.parametrize("cost", [COST_HEADER, COST_EXPENSIVE])
+    def test_exception_fails_only_its_check(self, cost):
+        checks = [
+            Check("broken", lambda: _raise(ValueError("invalid literal for int() with base 10: 'abc'")), cost),
+            Check("independent", lambda: (True, 1), COST_MODEL),
+            Check("dependent", lambda: (True, 2), COST_HEADER, requires=("broken",)),
+        ]
+        outcomes = CheckScheduler(checks).run()
+        assert not outcomes["broken"].ok and not outcomes["broken"].skipped
+        assert outcomes["broken"].error.startswith("ValueError: invalid literal")
+        assert outcomes["independent"].ok
+        assert outcomes["dependent"].skipped and outcomes["dependent"].error is None
+
+    def test_fail_fast_skips_not_started_checks(self):
+        checks = [Check("first", lambda: (False, []), COST_HEADER), Check("second", lambda: (True, 1), COST_MODEL)]
+        outcomes = CheckScheduler(checks, fail_fast=True).run()
+        assert outcomes["second"].skipped
+
+    def test_cyclic_prerequisites(self):
+        with pytest.raises(ValueError):
+            CheckScheduler([Check("a", lambda: (True, 1), requires=("b",)), Check("b", lambda: (True, 1), requires=("a",))])
+
+
+class TestMalformedFiles:
+    def test_operation_with_debit_and_credit(self, tmp_path, fixture_path, fixture_config):
+        with open(fixture_path("balance_small.xml"), "r", encoding="utf-8") as f:
+            text = f.read().replace('<Oper data="03-03-2021" corAcc="40911" dbt="" cdt="30">',
+                                    '<Oper data="03-03-2021" corAcc="40911" dbt="5" cdt="873">')
+        xml_path = tmp_path / "balance.xml"
+        xml_path.write_text(text, encoding="utf-8")
+        results = validate_balance_file(str(xml_path), fixture_config)
+        assert results["operations_are_either_debit_or_credit"] == {"ok": False, "details": [2]}
+        assert results["operation_nodes_contain_status_node"]["ok"]
+
+    def test_not_numeric_EDQuantity(self, tmp_path, fixture_path, fixture_config):
+        with open(fixture_path("packet_epd_small.xml"), "rb") as f:
+            data = f.read().replace(b'EDQuantity="2"', b'EDQuantity="abc"')
+        xml_path = tmp_path / "packet.xml"
+        xml_path.write_bytes(data)
+        results = validate_epd_file(str(xml_path), fixture_config)
+        assert not results["header_EDQuantity_equals_ed101_amount"]["ok"]
+        assert "ValueError" in results["header_EDQuantity_equals_ed101_amount"]["error"]
+        assert results["header_Sum_equals_ed101_sum"]["ok"] and results["ed101_EDNo_increments_by_one"]["ok"]
+
+    def test_broken_header_fails_before_document_is_parsed(self, tmp_path, fixture_path, fixture_config):
+        with open(fixture_path("packet_epd_small.xml"), "rb") as f:
+            data = f.read().replace(b'SystemCode="01" Sum="95"', b'SystemCode="02" Sum="95"')
+        xml_path = tmp_path / "packet.xml"
+        xml_path.write_bytes(data[:data.index(b"</ED101>")]) # Document body is not even well-formed
+        results = validate_epd_file(str(xml_path), fixture_config, fail_fast=True)
+        assert results["header_contains_mandatory_attributes"]["ok"]
+        assert results["header_SystemCode_is_correct"] == {"ok": False, "details": "02"}
+        assert all(result["skipped"] for name, result in results.items() if name.startswith("ed101_"))
@@ -0,0 +1,65 @@
+from utils.snapshot import SnapshotCache
+from utils import snapshot
+import os
+import pytest
+
+
+class _Builder:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestSnapshotCache:
+    def test_snapshot_is_reused_until_source_changes(self, tmp_path):
+        source = tmp_path / "source.xml"
+        source.write_text("<a/>")
+        cache = SnapshotCache(str(tmp_path / "snapshots"))
+        builder = _Builder({"nodes": 1})
+        assert cache.load_or_build(str(source), "model", builder) == {"nodes": 1}
+        assert cache.load_or_build(str(source), "model", builder) == {"nodes": 1}
+        assert builder.calls == 1
+
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9)) # Touched, content is the same
+        assert SnapshotCache(str(tmp_path / "snapshots")).load_or_build(str(source), "model", builder) == {"nodes": 1}
+        assert builder.calls == 1
+
+        source.write_text("<b/>")
+        cache.load_or_build(str(source), "model", builder)
+        assert builder.calls == 2
+
+    def test_kinds_and_params_have_own_snapshots(self, tmp_path):
+        source = tmp_path / "source.xml"
+        source.write_text("<a/>")
+        cache = SnapshotCache(str(tmp_path / "snapshots"))
+        assert cache.load_or_build(str(source), "rules", lambda: 1, params=("a",)) == 1
+        assert cache.load_or_build(str(source), "rules", lambda: 2, params=("b",)) == 2
+        assert cache.load_or_build(str(source), "summary", lambda: 3) == 3
+        assert cache.load_or_build(str(source), "rules", lambda: 4, params=("a",)) == 1
+
+    def test_other_code_fingerprint(self, tmp_path):
+        source = tmp_path / "source.xml"
+        source.write_text("<a/>")
+        cache = SnapshotCache(str(tmp_path / "snapshots"))
+        cache.store(str(source), "model", 1)
+        cache.code_fingerprint = "changed"
+        assert cache.load_or_build(str(source), "model", lambda: 2) == 2
+
+    @pytest.mark.parametrize("code_file", ["conftest.py", "rules.json", os.path.join("utils", "xml.py")])
+    def test_code_change_rebuilds_snapshot(self, tmp_path, monkeypatch, code_file):
+        project_dir = tmp_path / "project"
+        for name in ("conftest.py", "rules.json", os.path.join("utils", "xml.py")):
+            (project_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (project_dir / name).write_text("# version 1")
+        monkeypatch.setattr(snapshot, "PROJECT_DIR", str(project_dir))
+        source = tmp_path / "source.xml"
+        source.write_text("<a/>")
+        assert SnapshotCache(str(tmp_path / "snapshots")).load_or_build(str(source), "model", lambda: 1) == 1
+
+        (project_dir / code_file).write_text("# version 2, fixture builds other data")
+        assert SnapshotCache(str(tmp_path / "snapshots")).load_or_build(str(source), "model", lambda: 2) == 2
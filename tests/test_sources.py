@@ -0,0 +1,68 @@
+from utils import sources
+from utils.xml import PacketEPDXML
+import gzip
+import mmap
+import os
+import pytest
+import zipfile
+
+
+def _packet_bytes(fixture_path) -> bytes:
+    with open(fixture_path("packet_epd_small.xml"), "rb") as f:
+        return f.read()
+
+
+def _pipe(data: bytes):
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "wb") as writer: # Fixture is smaller than pipe buffer
+        writer.write(data)
+    return os.fdopen(read_fd, "rb")
+
+
+def _gzip(tmp_path, data: bytes) -> str:
+    path = str(tmp_path / "packet.xml.gz")
+    with gzip.open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _zip(tmp_path, data: bytes) -> str:
+    path = str(tmp_path / "packet.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("packet.xml", data)
+    return path
+
+
+def _mmap(tmp_path, data: bytes) -> mmap.mmap:
+    path = tmp_path / "packet.xml"
+    path.write_bytes(data)
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+SOURCES = {
+    "pipe": lambda tmp_path, data: _pipe(data),
+    "gzip": _gzip,
+    "zip": _zip,
+    "bytes": lambda tmp_path, data: data,
+    "mmap": _mmap,
+}
+
+
+class TestSources:
+    @pytest.mark.parametrize("kind", SOURCES)
+    @pytest.mark.parametrize("streaming", [True, False])
+    def test_packet_is_read_from_source(self, tmp_path, fixture_path, kind, streaming):
+        source = SOURCES[kind](tmp_path, _packet_bytes(fixture_path))
+        xml_tree = PacketEPDXML(source, streaming=streaming)
+        assert xml_tree.get_root_attributes()["EDQuantity"] == "2"
+        assert xml_tree.evaluate_rules("ED101")["ed101_sum"] == (True, 2)
+        assert [node.get("EDNo") for node in xml_tree.iter_nodes("ED101")] == ["1", "2"], "Source should be readable again"
+
+    def test_not_seekable_stream_is_spooled(self, fixture_path):
+        data = _packet_bytes(fixture_path)
+        with _pipe(data) as pipe:
+            spool = sources.seekable_source(pipe)
+            assert spool is not pipe and spool.read() == data
+        with open(fixture_path("packet_epd_small.xml"), "rb") as f:
+            assert sources.seekable_source(f) is f
@@ -0,0 +1,330 @@
+"""
+Batch validation of directories of Balance and PacketEPD files.
+
+Files are sharded across a process pool, each worker runs the same checks as autotests
+(`BalanceXML` + `model.Balance` for balances, `PacketEPDXML` for packets) and per-file results
+are merged into one report. Broken or slow file does not stop validation of other files: with `--timeout`
+worker, which validates one file longer than that, is terminated and the pool is restarted.
+
+With `--incremental` each balance keeps checkpoint (see `model.IncrementalBalance`) and on the next run
+only operations appended since then are checked.
+
+Checks of each file are run by `utils.scheduler`: cheap ones first, reconciliation with ED807 only if its
+prerequisites passed, and with `--fail-fast` nothing more after the first failed check.
+
+Usage: python -m utils.batch <dir|glob> [<dir|glob> ...] [--config config.json] [--workers N] [--timeout SEC] [--output report.json] [--incremental] [--fail-fast]
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from lxml import etree
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from utils.xml import BalanceXML, PacketEPDXML
+from utils.ed807_index import ED807Index
+from utils.epd_summary import summarize_packet
+from utils.edno import analyze_edno
+from utils.reconciler import DirectoryRecord, project_ed101, project_ed807, reconcile, MODE_POSITIONAL
+from utils.scheduler import Check, CheckOutcome, CheckScheduler, COST_HEADER, COST_MODEL, COST_EXPENSIVE
+from utils.logger import logger, process_pool_context
+from utils import sources
+import argparse
+import functools
+import glob
+import json
+import os
+import time
+import traceback
+
+KIND_BALANCE = "balance"
+KIND_EPD = "epd"
+ROOT_TAG_TO_KIND = {"Document": KIND_BALANCE, "PacketEPD": KIND_EPD}
+FILE_PATTERNS = ("*.xml", "*.xml.gz", "*.zip")
+# Rules of rules.json, which are already reported by named checks below
+BALANCE_REPORTED_RULES = {"operation_date", "operation_corAcc", "operation_dbt_or_cdt", "operation_status_node"}
+EPD_REPORTED_RULES = {"header_system_code", "ed101_sum", "ed101_system_code", "ed101_date", "ed101_author",
+                      "ed101_payer_BIC", "ed101_payer_CorrespAcc", "ed101_payee_BIC", "ed101_payee_CorrespAcc"}
+REPORTED_RULE_PREFIXES = ("header_mandatory_",)
+
+_worker_config: dict = None
+_worker_ed807_index: ED807Index = None
+_worker_ed807_records: List[DirectoryRecord] = None
+_worker_fail_fast: bool = False
+
+
+def collect_files(patterns: Iterable[str]) -> List[str]:
+    """Expand directories (all XML files inside, also gzip and zip ones) and glob patterns to sorted list of files."""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for file_pattern in FILE_PATTERNS:
+                files.update(glob.glob(os.path.join(pattern, file_pattern)))
+        else:
+            files.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(files)
+
+
+def detect_kind(xml_path: str) -> Optional[str]:
+    """Detect document kind by root element name, reading only the beginning of the file."""
+    for _, root in sources.iterparse(xml_path, events=("start",)):
+        return ROOT_TAG_TO_KIND.get(etree.QName(root).localname)
+    return None
+
+
+def _extra_rules_checks(rules_results: Dict[str, tuple], reported_rules: Iterable[str]) -> Dict[str, tuple]:
+    """Results of rules added to rules.json, which are not reported by named checks, as 'rule_<name>' checks."""
+    return {f"rule_{name}": result for name, result in rules_results.items()
+            if name not in reported_rules and not any(name.startswith(prefix) for prefix in REPORTED_RULE_PREFIXES)}
+
+
+def _check_result(result: tuple) -> dict:
+    ok, details = result
+    return {"ok": bool(ok), "details": details}
+
+
+def _outcome_result(outcome: CheckOutcome) -> dict:
+    result = {"ok": outcome.ok, "details": outcome.details}
+    if outcome.skipped:
+        result["skipped"] = True
+    if outcome.error is not None:
+        result["error"] = outcome.error
+    return result
+
+
+def _ed807_records() -> List[DirectoryRecord]:
+    """ED807 records of worker index, projected once per worker for all packets."""
+    global _worker_ed807_records
+    if _worker_ed807_records is None:
+        _worker_ed807_records = project_ed807(_worker_ed807_index)
+    return _worker_ed807_records
+
+
+def _reconcile_with_ed807(epd_xml_tree: PacketEPDXML) -> tuple:
+    result = reconcile(project_ed101(epd_xml_tree), _ed807_records(), mode=MODE_POSITIONAL)
+    return len(result.errors) == 0, result.errors
+
+
+def validate_balance_file(xml_path: str, config: dict, fail_fast: bool = False) -> Dict[str, dict]:
+    # Imported here, because model depends on utils and should not be loaded in processes, which only check packets
+    from model.Balance import Balance
+    from model.IncrementalBalance import IncrementalBalance
+
+    checkpoint_dir = config["balances_xml"].get("checkpoint_dir")
+    if checkpoint_dir and sources.plain_path(xml_path) is not None: # Checkpoint keeps byte offset in uncompressed file
+        rules_results, balance = IncrementalBalance(xml_path, config["corr_account"], namespace=config["balances_xml"]["namespace"],
+                                                    checkpoint_dir=checkpoint_dir, strict=False).validate()
+        get_balance = lambda: balance
+    else:
+        balance_xml_tree = BalanceXML(xml_path, namespace=config["balances_xml"]["namespace"], encoding='utf-8', config=config)
+        rules_results = balance_xml_tree.evaluate_all_rules()
+        # Model is built only when the first business check is run, with `fail_fast` it may be not needed at all
+        get_balance = functools.cache(lambda: Balance(config["corr_account"], balance_xml_tree, strict=False))
+    rules_checks = {
+        "operation_nodes_contain_date": rules_results["operation_date"],
+        "operation_nodes_contain_corr_acc": rules_results["operation_corAcc"],
+        "operation_nodes_contain_dbt_or_cdt": rules_results["operation_dbt_or_cdt"],
+        "operation_nodes_contain_status_node": rules_results["operation_status_node"],
+    }
+    rules_checks.update(_extra_rules_checks(rules_results, BALANCE_REPORTED_RULES))
+    checks = [Check(name, lambda result=result: result, COST_HEADER) for name, result in rules_checks.items()]
+
+    def operations_happened_one_date():
+        unique_dates = get_balance().get_unique_dates()
+        return len(unique_dates) == 1, sorted(unique_dates)
+
+    checks += [
+        Check("operations_happened_one_date", operations_happened_one_date, COST_MODEL),
+        Check("corr_accounts_are_different_from_our", lambda: get_balance().cor_accounts_are_different_from_our(), COST_MODEL),
+        Check("operations_are_either_debit_or_credit", lambda: get_balance().each_operation_is_either_debit_or_credit(), COST_MODEL),
+        Check("operations_have_valid_amount", lambda: get_balance().each_operation_has_valid_amount(), COST_MODEL),
+    ]
+    return {name: _outcome_result(outcome) for name, outcome in CheckScheduler(checks, fail_fast=fail_fast).run().items()}
+
+
+def validate_epd_file(xml_path: str, config: dict, ed807_index: ED807Index = None, fail_fast: bool = False) -> Dict[str, dict]:
+    """
+    Run packet checks from cheap header checks to reconciliation with ED807, which is run only if ED807 header
+    matches and all ED101 have requisites. With `fail_fast` checks are stopped after the first failed one.
+    Header checks read only root attributes, document is parsed by the first check of its nodes.
+    """
+    header_tree = PacketEPDXML(xml_path, encoding='windows-1251', streaming=True, config=config)
+    get_tree = functools.cache(lambda: PacketEPDXML(xml_path, encoding='windows-1251', config=config))
+    mandatory_attributes = config["ed807_xml"]["header_mandatory_attributes"]
+    # Header totals and EDNo are checked by the same code as autotests (`utils.epd_summary`, `utils.edno`)
+    get_summary = functools.cache(lambda: summarize_packet(get_tree()))
+
+    def ed101_EDNo_increments_by_one():
+        analysis = analyze_edno(get_tree())
+        return analysis.is_sequence, analysis.count if analysis.is_sequence else analysis.to_dict()
+
+    checks = [
+        Check("header_contains_mandatory_attributes", lambda: header_tree.check_header_contains_attributes(*mandatory_attributes), COST_HEADER),
+        Check("header_EDQuantity_equals_ed101_amount", lambda: get_summary().check_EDQuantity()),
+        Check("ed101_contain_sum", lambda: get_tree().check_all_ed101_contain_sum()),
+        Check("header_Sum_equals_ed101_sum", lambda: get_summary().check_Sum()),
+        Check("header_SystemCode_is_correct", header_tree.check_header_SystemCode, COST_HEADER),
+        Check("ed101_SystemCode_is_correct", lambda: get_tree().check_all_ed101_SystemCode()),
+        Check("ed101_date_equal_to_header", lambda: get_tree().check_all_ed101_date_equal_to_header()),
+        Check("ed101_author_equal_to_header", lambda: get_tree().check_all_ed101_author_equal_to_header()),
+        Check("ed101_EDNo_increments_by_one", ed101_EDNo_increments_by_one),
+        Check("ed101_have_required_requisites", lambda: get_tree().check_all_ed101_have_required_requisites()),
+    ]
+    if ed807_index is not None:
+        def header_mandatory_values_equal_ed807():
+            ed807_header = ed807_index.get_root_attributes()
+            epd_header = header_tree.get_root_attributes()
+            different = [attrib for attrib in mandatory_attributes if ed807_header.get(attrib) != epd_header.get(attrib)]
+            return len(different) == 0, different or mandatory_attributes
+
+        checks.append(Check("header_mandatory_values_equal_ed807", header_mandatory_values_equal_ed807, COST_HEADER,
+                            requires=("header_contains_mandatory_attributes",)))
+        checks.append(Check("ed101_filled_from_ed807", lambda: _reconcile_with_ed807(get_tree()), COST_EXPENSIVE,
+                            requires=("header_mandatory_values_equal_ed807", "ed101_have_required_requisites")))
+    results = {name: _outcome_result(outcome) for name, outcome in CheckScheduler(checks, fail_fast=fail_fast).run().items()}
+    if not (fail_fast and any(not result["ok"] for result in results.values())):
+        results.update({name: _check_result(result) for name, result in
+                        _extra_rules_checks(get_tree().evaluate_all_rules(), EPD_REPORTED_RULES).items()})
+    return results
+
+
+VALIDATORS: Dict[str, Callable] = {
+    KIND_BALANCE: lambda xml_path: validate_balance_file(xml_path, _worker_config, _worker_fail_fast),
+    KIND_EPD: lambda xml_path: validate_epd_file(xml_path, _worker_config, _worker_ed807_index, _worker_fail_fast),
+}
+
+
+def _init_worker(config: dict, fail_fast: bool = False):
+    global _worker_config, _worker_ed807_index, _worker_fail_fast
+    _worker_config = config
+    _worker_fail_fast = fail_fast
+    ed807_config = config.get("ed807_xml", {})
+    if ed807_config.get("path") and os.path.exists(ed807_config["path"]):
+        _worker_ed807_index = ED807Index(ed807_config["path"], namespace=ed807_config.get("namespace"),
+                                         index_dir=ed807_config.get("index_dir", ".cache/ed807"))
+
+
+def validate_file(xml_path: str) -> dict:
+    """Validate one file in worker process. Never raises: errors are returned as part of the result."""
+    started = time.perf_counter()
+    result = {"file": xml_path, "kind": None, "ok": False, "checks": {}, "error": None}
+    try:
+        result["kind"] = detect_kind(xml_path)
+        if result["kind"] not in VALIDATORS:
+            raise ValueError(f"Unknown document kind of '{xml_path}'")
+        result["checks"] = VALIDATORS[result["kind"]](xml_path)
+        result["ok"] = all(check["ok"] for check in result["checks"].values())
+    except Exception as e:
+        result["error"] = "".join(traceback.format_exception_only(e)).strip()
+    result["duration"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def error_result(xml_path: str, error: str) -> dict:
+    """Result of file, which was not validated by worker (timeout, worker died)."""
+    return {"file": xml_path, "kind": None, "ok": False, "checks": {}, "error": error}
+
+
+def terminate_pool(executor: ProcessPoolExecutor):
+    """Shut down pool without waiting for running tasks: its worker processes are terminated, so hung ones do not block exit."""
+    processes = list((executor._processes or {}).values()) # No public API to stop running workers before Python 3.14
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+
+def validate_batch(xml_paths: List[str], config: dict, workers: int = None, timeout: float = None, fail_fast: bool = False) -> dict:
+    """
+    Validate given files in process pool and merge results into one report.
+
+    With `fail_fast` checks of each file are stopped after its first failed check (see `utils.scheduler`).
+
+    `timeout` is the time limit for one file from its start in worker: only `workers` files are in progress at once,
+    so each of them has its own deadline. Worker of file, which is not validated in time, is terminated together
+    with the pool (running task can not be cancelled otherwise), the file is reported with error and other files,
+    which were in progress, are started again in new pool.
+    """
+    # Index is built once here, so workers only open it
+    _init_worker(config, fail_fast)
+    logger.info("Validating %s files", len(xml_paths))
+    workers = workers or os.cpu_count() or 1
+    new_pool = lambda: ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config, fail_fast),
+                                           mp_context=process_pool_context())
+    results = {}
+    queued = deque(xml_paths)
+    running: Dict[Future, Tuple[str, Optional[float]]] = {} # future -> (file, deadline)
+    executor = new_pool()
+    try:
+        while queued or running:
+            while queued and len(running) < workers:
+                xml_path = queued.popleft()
+                deadline = time.monotonic() + timeout if timeout is not None else None
+                running[executor.submit(validate_file, xml_path)] = (xml_path, deadline)
+            deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+            wait_timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(running, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            pool_is_broken = False
+            for future in done:
+                xml_path, _ = running.pop(future)
+                try:
+                    results[xml_path] = future.result()
+                except Exception as e: # Worker process died
+                    pool_is_broken = pool_is_broken or isinstance(e, BrokenProcessPool)
+                    results[xml_path] = error_result(xml_path, repr(e))
+                logger.info("Validated '%s': %s", xml_path, "OK" if results[xml_path]["ok"] else "FAILED")
+            now = time.monotonic()
+            expired = [future for future, (_, deadline) in running.items() if deadline is not None and deadline <= now]
+            for future in expired:
+                xml_path, _ = running.pop(future)
+                results[xml_path] = error_result(xml_path, f"Validation was not finished in {timeout} seconds")
+                logger.info("Validation of '%s' was not finished in %s seconds", xml_path, timeout)
+            if expired or pool_is_broken:
+                queued.extendleft(reversed([xml_path for xml_path, _ in running.values()]))
+                running.clear()
+                terminate_pool(executor)
+                executor = new_pool()
+    finally:
+        terminate_pool(executor)
+    files = [results[xml_path] for xml_path in xml_paths]
+    return {
+        "total": len(files),
+        "passed": sum(1 for result in files if result["ok"]),
+        "failed": sum(1 for result in files if not result["ok"]),
+        "files": files,
+    }
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Validate directories of Balance and PacketEPD XML files")
+    parser.add_argument("paths", nargs="+", help="Directories or glob patterns of XML files")
+    parser.add_argument("--config", default="config.json", help="Path to the config file (default: config.json)")
+    parser.add_argument("--workers", type=int, default=None, help="Amount of worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=None, help="Time limit for one file in seconds")
+    parser.add_argument("--output", default=None, help="Path to JSON report (default: print to stdout)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Check only operations appended to balances since the previous run (checkpoints are kept in "
+                             "'balances_xml.checkpoint_dir' of config, default: .cache/checkpoints)")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop checks of a file after its first failed check")
+    parsed = parser.parse_args(args)
+
+    with open(parsed.config, "r") as f:
+        config = json.load(f)
+    if parsed.incremental:
+        config["balances_xml"].setdefault("checkpoint_dir", ".cache/checkpoints")
+    else:
+        config["balances_xml"].pop("checkpoint_dir", None)
+    report = validate_batch(collect_files(parsed.paths), config, workers=parsed.workers, timeout=parsed.timeout,
+                            fail_fast=parsed.fail_fast)
+    report_text = json.dumps(report, ensure_ascii=False, indent=2)
+    if parsed.output:
+        with open(parsed.output, "w", encoding="utf-8") as f:
+            f.write(report_text)
+    else:
+        print(report_text)
+    logger.info("Validated %s files: %s passed, %s failed", report["total"], report["passed"], report["failed"])
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
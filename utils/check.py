@@ -1,10 +1,21 @@
 # Some utils to store all assert fail texts for multiple checking
+from utils.failures import FailureReport, MAX_EXAMPLES, register
 
 def check_error(expected, actual, result_list: list, error_msg: str, dont_continue = False):
+    # `result_list` can be 'FailureReport' to not keep all errors in memory
     if expected != actual:
         result_list.append(error_msg)
         if dont_continue:
             assert_error_list(result_list)
 
-def assert_error_list(errors_list: list):
-    assert len(errors_list) == 0, "\n".join(errors_list)
\ No newline at end of file
+def assert_error_list(errors_list: list, label: str = "errors"):
+    # Long lists are not joined into one message: only first errors are shown, the full list is in sidecar file
+    if not isinstance(errors_list, FailureReport):
+        if len(errors_list) <= MAX_EXAMPLES:
+            assert len(errors_list) == 0, "\n".join(errors_list)
+            return
+        report = FailureReport(label)
+        report.extend(errors_list)
+        errors_list = report
+    register(errors_list)
+    assert len(errors_list) == 0, errors_list.message()
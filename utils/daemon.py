@@ -0,0 +1,237 @@
+"""
+Long-running validation service: config and ED807 index are loaded once, worker processes stay warm
+(modules imported, index opened), so each new Balance or PacketEPD file costs only its own checks.
+
+Checks are the same as in batch validation (`utils.batch.validate_file`), they are run in a process pool,
+while asyncio server only accepts requests. Not more files than workers are sent to the pool at once, so time limit
+`--timeout` is counted from the start of file in worker. File, which is not validated in time, can not be cancelled
+in its worker, so the whole pool is replaced by new one and files, which were in progress there, are validated again.
+Requests are not authenticated, so TCP server listens only on loopback address.
+Protocol is one JSON object per line over Unix socket or localhost TCP:
+    {"path": "PacketEPD.xml"}            -> result of one file, same as file result of batch report
+    {"paths": ["a.xml", "b.xml"]}        -> report of several files, same as batch report
+    {"command": "status"}                -> uptime and amount of validated files
+    {"command": "shutdown"}              -> stop the service
+Errors of request itself are returned as {"error": "..."}.
+
+Usage:
+    python -m utils.daemon serve [--socket PATH | --port N] [--config config.json] [--workers N] [--timeout SEC]
+    python -m utils.daemon validate <file> [<file> ...] [--socket PATH | --port N]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+from utils import batch
+from utils.logger import logger, process_pool_context
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import time
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_SOCKET = ".cache/validation.sock"
+COMMAND_STATUS = "status"
+COMMAND_SHUTDOWN = "shutdown"
+
+
+def _warm_up() -> int:
+    """Run in each worker at start, so the first request does not wait for process start and imports."""
+    import model.Balance # noqa: F401 - imported lazily by balance validation
+    return os.getpid()
+
+
+def is_loopback(host: str) -> bool:
+    """Check that all addresses of `host` are loopback ones, so the service is not reachable from other machines."""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+class ValidationDaemon:
+    """ Asyncio server, which validates files in a pool of warm worker processes """
+    def __init__(self, config: dict, workers: int = None, timeout: float = None):
+        self.config = config
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout # Time limit for one file
+        self.validated = 0
+        self.started = None
+        self._executor: ProcessPoolExecutor = None
+        self._pool_generation = 0 # Incremented when pool is replaced after timeout or death of worker
+        self._server: asyncio.AbstractServer = None
+        self._stopped: asyncio.Event = None
+        self._slots: asyncio.Semaphore = None # Free workers
+
+    async def start(self, socket_path: str = None, host: str = DEFAULT_HOST, port: int = None):
+        """Start worker pool and listen on Unix socket (if `socket_path` is given) or on `host`:`port`."""
+        if not socket_path and not is_loopback(host):
+            raise ValueError(f"Service has no authentication and can listen only on loopback address, got '{host}'")
+        self._stopped = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        # Index is built once here, so workers only open it
+        batch._init_worker(self.config)
+        self._executor = self._new_pool()
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.workers)))
+        logger.info("Started %s warm worker processes", len(set(pids)))
+        if socket_path:
+            os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+        self.started = time.monotonic()
+        addresses = [str(sock.getsockname()) for sock in self._server.sockets]
+        logger.info("Validation service is listening on %s", ", ".join(addresses))
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=batch._init_worker, initargs=(self.config,),
+                                   mp_context=process_pool_context())
+
+    def _replace_pool(self, generation: int):
+        """Terminate workers of pool of given generation and start new pool, if it was not replaced yet."""
+        if generation != self._pool_generation or self._executor is None:
+            return
+        executor = self._executor
+        self._executor = self._new_pool()
+        self._pool_generation += 1
+        batch.terminate_pool(executor)
+        logger.info("Worker pool is replaced")
+
+    async def serve_forever(self):
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            batch.terminate_pool(self._executor)
+            self._executor = None
+
+    async def validate(self, xml_path: str) -> dict:
+        """Validate one file in worker process, result has the same format as file result of batch report."""
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            while True:
+                generation = self._pool_generation
+                future = loop.run_in_executor(self._executor, batch.validate_file, xml_path)
+                try:
+                    result = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    self._replace_pool(generation) # Stuck worker is terminated
+                    result = batch.error_result(xml_path, f"Validation was not finished in {self.timeout} seconds")
+                except (asyncio.CancelledError, Exception) as e:
+                    if generation != self._pool_generation and not asyncio.current_task().cancelling():
+                        continue # Pool was replaced because of another file, validate again in new pool
+                    if not isinstance(e, Exception):
+                        raise
+                    if isinstance(e, BrokenProcessPool): # Worker process died
+                        self._replace_pool(generation)
+                    result = batch.error_result(xml_path, repr(e))
+                break
+        self.validated += 1
+        logger.info("Validated '%s' in %s s: %s", xml_path, result.get("duration"), "OK" if result["ok"] else "FAILED")
+        return result
+
+    async def handle_request(self, request: dict) -> dict:
+        if "path" in request:
+            return await self.validate(request["path"])
+        if "paths" in request:
+            files = await asyncio.gather(*(self.validate(xml_path) for xml_path in request["paths"]))
+            return {
+                "total": len(files),
+                "passed": sum(1 for result in files if result["ok"]),
+                "failed": sum(1 for result in files if not result["ok"]),
+                "files": list(files),
+            }
+        command = request.get("command")
+        if command == COMMAND_STATUS:
+            return {"uptime": round(time.monotonic() - self.started, 3), "validated": self.validated, "workers": self.workers}
+        if command == COMMAND_SHUTDOWN:
+            self._stopped.set()
+            return {"stopping": True}
+        return {"error": f"Unknown request, expected 'path', 'paths' or 'command': {request}"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request should be JSON object")
+                    response = await self.handle_request(request)
+                except ValueError as e:
+                    response = {"error": f"Bad request: {e}"}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def send_request(request: dict, socket_path: str = None, host: str = DEFAULT_HOST, port: int = None) -> dict:
+    """Send one request to running service and wait for the response."""
+    if socket_path:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Validation service with warm ED807 index and worker processes")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Start the service")
+    serve_parser.add_argument("--config", default="config.json", help="Path to the config file (default: config.json)")
+    serve_parser.add_argument("--workers", type=int, default=None, help="Amount of worker processes (default: CPU count)")
+    serve_parser.add_argument("--timeout", type=float, default=None, help="Time limit for one file in seconds")
+    validate_parser = subparsers.add_parser("validate", help="Validate files with running service")
+    validate_parser.add_argument("paths", nargs="+", help="Balance or PacketEPD XML files")
+    for subparser in (serve_parser, validate_parser):
+        subparser.add_argument("--socket", default=None, help=f"Path to Unix socket (default: {DEFAULT_SOCKET}, if port is not given)")
+        subparser.add_argument("--host", default=DEFAULT_HOST, help="Loopback address of TCP server (default: %(default)s)")
+        subparser.add_argument("--port", type=int, default=None, help="Use localhost TCP port instead of Unix socket")
+    parsed = parser.parse_args(args)
+    socket_path = parsed.socket or (DEFAULT_SOCKET if parsed.port is None else None)
+
+    if parsed.action == "serve":
+        if socket_path is None and not is_loopback(parsed.host):
+            parser.error(f"--host should be loopback address, service has no authentication: {parsed.host}")
+        with open(parsed.config, "r") as f:
+            config = json.load(f)
+        config["balances_xml"].pop("checkpoint_dir", None)
+        daemon = ValidationDaemon(config, workers=parsed.workers, timeout=parsed.timeout)
+
+        async def serve():
+            await daemon.start(socket_path=socket_path, host=parsed.host, port=parsed.port)
+            await daemon.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    paths = [os.path.abspath(path) for path in parsed.paths] # Service can be started from another directory
+    report = send_request({"paths": paths}, socket_path=socket_path, host=parsed.host, port=parsed.port)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report.get("failed", 1) == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,417 @@
+from array import array
+from contextlib import closing
+from bisect import bisect_left
+from dataclasses import dataclass
+from utils.xml import XMLObject
+from utils.logger import logger
+from utils.instrumentation import instrumented
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+BICDIRECTORYENTRY = "BICDirectoryEntry"
+PARTICIPANTINFO = "ParticipantInfo"
+ACCOUNTS = "Accounts"
+BIC = "BIC"
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_CHANGED = "changed"
+KEY_STEP = 1 << 20 # Gap between sort keys of neighbouring entries of built index
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash of file content, read by chunks to not keep whole file in memory."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _increasing_subsequence(keys: List[Optional[int]]) -> Set[int]:
+    """Indices of the longest increasing subsequence of not None keys (patience sorting, O(n log n))."""
+    tail_indices: List[int] = [] # Index of the smallest tail key of increasing subsequence of each length
+    tail_keys: List[int] = []
+    previous = [-1] * len(keys)
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        length = bisect_left(tail_keys, key)
+        previous[i] = tail_indices[length - 1] if length > 0 else -1
+        if length == len(tail_keys):
+            tail_indices.append(i)
+            tail_keys.append(key)
+        else:
+            tail_indices[length] = i
+            tail_keys[length] = key
+    indices = set()
+    i = tail_indices[-1] if tail_indices else -1
+    while i >= 0:
+        indices.add(i)
+        i = previous[i]
+    return indices
+
+
+def _assign_sort_keys(previous_keys: List[Optional[int]]) -> Tuple[List[int], Set[int]]:
+    """
+    Sort keys of entries in new document order, `previous_keys` are keys of matched entries (None for new ones).
+    The longest subsequence of entries, which kept their relative order, keeps keys; other entries get keys evenly spread
+    in gaps between them. Only if some gap is too small for its entries, all entries are renumbered.
+
+    Returns tuple of (*sort keys*, *indices of entries, which kept their keys*).
+    """
+    anchors = _increasing_subsequence(previous_keys)
+    sort_keys: List[Optional[int]] = [previous_keys[i] if i in anchors else None for i in range(len(previous_keys))]
+    start = 0
+    while start < len(sort_keys):
+        if sort_keys[start] is not None:
+            start += 1
+            continue
+        end = start
+        while end < len(sort_keys) and sort_keys[end] is None:
+            end += 1
+        amount = end - start
+        low = sort_keys[start - 1] if start > 0 else None
+        high = sort_keys[end] if end < len(sort_keys) else None
+        if low is None:
+            low = (high if high is not None else KEY_STEP * (amount + 1)) - KEY_STEP * (amount + 1)
+        if high is None:
+            high = low + KEY_STEP * (amount + 1)
+        if high - low <= amount:
+            logger.info("No gap for %s ED807 entries, all entries are renumbered", amount)
+            return [position * KEY_STEP for position in range(1, len(sort_keys) + 1)], anchors
+        step = (high - low) // (amount + 1)
+        for n, i in enumerate(range(start, end), start=1):
+            sort_keys[i] = low + step * n
+        start = end
+    return sort_keys, anchors
+
+
+@dataclass(frozen=True)
+class BICEntry:
+    """ One 'BICDirectoryEntry' of ED807 projected to plain python values """
+    position: int # 1-based position of entry in ED807 document
+    bic: str
+    participant_info: Optional[dict] # None if entry has no 'ParticipantInfo' element
+    accounts: List[dict] # Attributes of all 'Accounts' elements, empty if there are none
+
+
+@dataclass
+class ED807Changes:
+    """ Difference of ED807 directory version from the previous indexed one, entries are matched by BIC """
+    previous_source_hash: str
+    source_hash: str
+    added: List[str] # BICs of new entries
+    removed: List[str] # BICs of entries, which are not in the new version
+    changed: List[str] # BICs of entries with changed ParticipantInfo or Accounts
+    moved: int # Amount of not changed entries, which order relative to other entries changed
+    unchanged: int
+
+    def to_dict(self) -> dict:
+        return {
+            "previous_source_hash": self.previous_source_hash,
+            "source_hash": self.source_hash,
+            "added": self.added,
+            "removed": self.removed,
+            "changed": self.changed,
+            "moved": self.moved,
+            "unchanged": self.unchanged,
+        }
+
+
+class ED807Index:
+    """
+    Persistent on-disk index of ED807 directory: BIC -> (ParticipantInfo fields, Accounts).
+
+    Index is stored as SQLite file named by hash of the source ED807 file, so it is built only once
+    per directory version and then reused across runs and pytest workers. Changed source file gets new hash,
+    so outdated index is never used.
+
+    New directory version is indexed as delta of the previous version of the same directory (see `LINEAGE_ATTRIBUTES`)
+    from `index_dir` or of `previous` index: the previous index is copied, entries are matched by BIC and compared
+    by content hash, only added, removed and changed entries are written and the difference is stored in the index
+    as change report (see `changes`). Indexes of all versions stay unchanged, so they can be used at the same time.
+    Document order is stored as sparse sort keys (`KEY_STEP` apart), new and moved entries get keys in gaps between
+    their neighbours, so insertion or deletion of one entry does not rewrite the following ones.
+    """
+    LINEAGE_ATTRIBUTES = ("EDAuthor", "InfoTypeCode") # Root attributes, which are the same for all versions of directory
+    SCHEMA_VERSION = 3
+
+    def __init__(self, xml_path: str, namespace: str = None, encoding: str = 'windows-1251', index_dir: str = ".cache/ed807",
+                 previous: str = None):
+        self.xml_path: str = xml_path
+        self.namespace: str = namespace
+        self.encoding: str = encoding
+        if not os.path.exists(xml_path):
+            logger.error("XML file not found: %s", xml_path)
+            raise FileNotFoundError(f"XML file not found: {xml_path}")
+        self.source_hash: str = file_sha256(xml_path)
+        self.index_path: str = os.path.join(index_dir, f"{self.source_hash}.v{self.SCHEMA_VERSION}.sqlite")
+        if os.path.exists(self.index_path):
+            logger.info("Using ED807 index '%s' for '%s'", self.index_path, xml_path)
+        else:
+            previous_index_path = previous or self._previous_index_path(index_dir)
+            if previous_index_path is None or not self._apply_delta(previous_index_path):
+                self._build()
+        self.connection = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False)
+        self._sort_keys: array = None
+
+    @instrumented("index")
+    def _build(self):
+        logger.info("Building ED807 index '%s' for '%s'", self.index_path, self.xml_path)
+        index_dir = os.path.dirname(self.index_path) or "."
+        os.makedirs(index_dir, exist_ok=True)
+        # Build into temporary file and move it in place at the end, so concurrent workers never see half-built index
+        fd, tmp_path = tempfile.mkstemp(suffix=".sqlite.tmp", dir=index_dir)
+        os.close(fd)
+        try:
+            connection = sqlite3.connect(tmp_path)
+            with connection:
+                self._create_schema(connection)
+                xml_tree = XMLObject(self.xml_path, namespace=self.namespace, encoding=self.encoding, streaming=True)
+                connection.executemany(
+                    "INSERT INTO header (name, value) VALUES (?, ?)",
+                    xml_tree.get_root_attributes().items()
+                )
+                entries_count = connection.executemany(
+                    "INSERT INTO entries (sort_key, bic, participant_info, accounts, content_hash) VALUES (?, ?, ?, ?, ?)",
+                    ((position * KEY_STEP, *row) for position, *row in self._iter_entry_rows(xml_tree))
+                ).rowcount
+            connection.close()
+            os.replace(tmp_path, self.index_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info("ED807 index built with %s entries", entries_count)
+
+    @instrumented("index")
+    def _apply_delta(self, previous_index_path: str) -> bool:
+        """
+        Build index as copy of the previous one with only differing entries rewritten, the previous index is not changed.
+        Returns False if the previous index can not be read, then index should be built from scratch.
+        """
+        logger.info("Building ED807 index '%s' for '%s' as delta of '%s'", self.index_path, self.xml_path, previous_index_path)
+        index_dir = os.path.dirname(self.index_path) or "."
+        os.makedirs(index_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".sqlite.tmp", dir=index_dir)
+        os.close(fd)
+        try:
+            connection = sqlite3.connect(tmp_path)
+            try:
+                # Consistent copy even if the previous index is read by other processes at the same time
+                with closing(sqlite3.connect(f"file:{previous_index_path}?mode=ro", uri=True)) as previous_connection:
+                    previous_connection.backup(connection)
+            except sqlite3.DatabaseError as e:
+                logger.warning("Could not read previous ED807 index '%s': %r", previous_index_path, e)
+                connection.close()
+                return False
+            with connection: # One transaction: interrupted update is rolled back by SQLite
+                previous_source_hash = dict(connection.execute("SELECT name, value FROM meta")).get("source_hash")
+                # (BIC, number of its occurrence) -> (row id, sort key, content hash), so duplicated BICs are matched in order
+                previous_entries: Dict[Tuple[str, int], tuple] = {}
+                occurrences: Dict[str, int] = {}
+                for row_id, sort_key, bic, content_hash in connection.execute(
+                        "SELECT id, sort_key, bic, content_hash FROM entries ORDER BY sort_key"):
+                    occurrence = occurrences[bic] = occurrences.get(bic, 0) + 1
+                    previous_entries[(bic, occurrence)] = (row_id, sort_key, content_hash)
+
+                added, changed = [], []
+                layout: List[tuple] = [] # (row id, previous sort key, is changed) of entries in new order, row id is None for new ones
+                added_rows: Dict[int, tuple] = {} # Index in layout -> row of new entry
+                occurrences.clear()
+                xml_tree = XMLObject(self.xml_path, namespace=self.namespace, encoding=self.encoding, streaming=True)
+                for _, bic, participant_info, accounts, content_hash in self._iter_entry_rows(xml_tree):
+                    occurrence = occurrences[bic] = occurrences.get(bic, 0) + 1
+                    previous_entry = previous_entries.pop((bic, occurrence), None)
+                    if previous_entry is None:
+                        added.append(bic)
+                        added_rows[len(layout)] = (bic, participant_info, accounts, content_hash)
+                        layout.append((None, None, False))
+                        continue
+                    row_id, sort_key, previous_hash = previous_entry
+                    layout.append((row_id, sort_key, previous_hash != content_hash))
+                    if previous_hash != content_hash:
+                        changed.append(bic)
+                        connection.execute(
+                            "UPDATE entries SET participant_info = ?, accounts = ?, content_hash = ? WHERE id = ?",
+                            (participant_info, accounts, content_hash, row_id)
+                        )
+                removed = [bic for bic, _ in previous_entries]
+                connection.executemany("DELETE FROM entries WHERE id = ?", ((row_id,) for row_id, _, _ in previous_entries.values()))
+
+                sort_keys, anchors = _assign_sort_keys([sort_key for _, sort_key, _ in layout])
+                connection.executemany(
+                    "UPDATE entries SET sort_key = ? WHERE id = ?",
+                    ((sort_keys[i], row_id) for i, (row_id, sort_key, _) in enumerate(layout)
+                     if row_id is not None and sort_keys[i] != sort_key)
+                )
+                connection.executemany(
+                    "INSERT INTO entries (sort_key, bic, participant_info, accounts, content_hash) VALUES (?, ?, ?, ?, ?)",
+                    ((sort_keys[i], *row) for i, row in added_rows.items())
+                )
+                moved = sum(1 for i, (row_id, _, is_changed) in enumerate(layout)
+                            if row_id is not None and not is_changed and i not in anchors)
+                unchanged = len(layout) - len(added) - len(changed) - moved
+
+                connection.execute("DELETE FROM header")
+                connection.executemany("INSERT INTO header (name, value) VALUES (?, ?)", xml_tree.get_root_attributes().items())
+                connection.execute("DELETE FROM changes")
+                connection.executemany(
+                    "INSERT INTO changes (kind, bic) VALUES (?, ?)",
+                    [(CHANGE_ADDED, bic) for bic in added] + [(CHANGE_REMOVED, bic) for bic in removed] +
+                    [(CHANGE_CHANGED, bic) for bic in changed]
+                )
+                connection.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", [
+                    ("source_hash", self.source_hash), ("previous_source_hash", previous_source_hash),
+                    ("moved", str(moved)), ("unchanged", str(unchanged)),
+                ])
+            connection.close()
+            os.replace(tmp_path, self.index_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info("ED807 index delta applied: %s added, %s removed, %s changed, %s moved, %s unchanged entries",
+                    len(added), len(removed), len(changed), moved, unchanged)
+        return True
+
+    def _previous_index_path(self, index_dir: str) -> Optional[str]:
+        """
+        Index of the previous version of the same directory in `index_dir`, used as base for delta: index of the same
+        schema with the same `LINEAGE_ATTRIBUTES` and the latest 'EDDate' not after the new one (the newest by mtime).
+        """
+        header = XMLObject(self.xml_path, namespace=self.namespace, encoding=self.encoding, streaming=True).get_root_attributes()
+        candidates = []
+        for path in glob.glob(os.path.join(index_dir, f"*.v{self.SCHEMA_VERSION}.sqlite")):
+            try:
+                with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as connection:
+                    previous_header = dict(connection.execute("SELECT name, value FROM header"))
+                mtime = os.path.getmtime(path)
+            except (sqlite3.DatabaseError, OSError): # Broken or removed by another process
+                continue
+            if all(previous_header.get(name) == header.get(name) for name in self.LINEAGE_ATTRIBUTES) and \
+                    previous_header.get("EDDate", "") <= header.get("EDDate", ""):
+                candidates.append((previous_header.get("EDDate", ""), mtime, path))
+        return max(candidates)[2] if candidates else None
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        connection.execute("CREATE TABLE header (name TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(
+            "CREATE TABLE entries (id INTEGER PRIMARY KEY, sort_key INTEGER, bic TEXT, participant_info TEXT, accounts TEXT, content_hash TEXT)"
+        )
+        connection.execute("CREATE INDEX entries_sort_key ON entries (sort_key)")
+        connection.execute("CREATE INDEX entries_bic ON entries (bic)")
+        connection.execute("CREATE TABLE changes (kind TEXT, bic TEXT)")
+        connection.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("INSERT INTO meta (name, value) VALUES ('source_hash', ?)", (self.source_hash,))
+
+    @staticmethod
+    def _iter_entry_rows(xml_tree: XMLObject) -> Iterator[tuple]:
+        for position, entry in enumerate(xml_tree.iter_nodes(BICDIRECTORYENTRY), start=1):
+            participant_info = xml_tree.find(PARTICIPANTINFO, elem=entry)
+            participant_info = json.dumps(dict(participant_info.attrib), ensure_ascii=False) if participant_info is not None else None
+            accounts = json.dumps([dict(acc.attrib) for acc in xml_tree.find_all(ACCOUNTS, elem=entry)], ensure_ascii=False)
+            content_hash = hashlib.blake2b(f"{participant_info}\x00{accounts}".encode(), digest_size=16).hexdigest()
+            yield position, entry.get(BIC), participant_info, accounts, content_hash
+
+    @staticmethod
+    def _row_to_entry(position: int, row: tuple) -> BICEntry:
+        bic, participant_info, accounts = row
+        return BICEntry(
+            position=position,
+            bic=bic,
+            participant_info=json.loads(participant_info) if participant_info is not None else None,
+            accounts=json.loads(accounts)
+        )
+
+    def get_root_attributes(self) -> dict:
+        """Attributes of ED807 root element, same as `XMLObject.get_root_attributes`."""
+        return dict(self.connection.execute("SELECT name, value FROM header"))
+
+    def sort_keys(self) -> array:
+        """Sort keys of all entries in document order, position of entry is index of its key + 1. Loaded once."""
+        if self._sort_keys is None:
+            self._sort_keys = array('q', (key for key, in self.connection.execute("SELECT sort_key FROM entries ORDER BY sort_key")))
+        return self._sort_keys
+
+    def get(self, bic: str) -> Optional[BICEntry]:
+        """Lookup entry by BIC (first one by position if BIC is duplicated)."""
+        row = self.connection.execute(
+            "SELECT sort_key, bic, participant_info, accounts FROM entries WHERE bic = ? ORDER BY sort_key LIMIT 1", (bic,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._row_to_entry(bisect_left(self.sort_keys(), row[0]) + 1, row[1:])
+
+    def at_position(self, position: int) -> Optional[BICEntry]:
+        """Lookup entry by its 1-based position in ED807 document."""
+        sort_keys = self.sort_keys()
+        if not 1 <= position <= len(sort_keys):
+            return None
+        row = self.connection.execute(
+            "SELECT bic, participant_info, accounts FROM entries WHERE sort_key = ?", (sort_keys[position - 1],)
+        ).fetchone()
+        return self._row_to_entry(position, row) if row is not None else None
+
+    def entries(self) -> Iterator[BICEntry]:
+        """Iterate over all entries in document order."""
+        rows = self.connection.execute("SELECT bic, participant_info, accounts FROM entries ORDER BY sort_key")
+        for position, row in enumerate(rows, start=1):
+            yield self._row_to_entry(position, row)
+
+    def changes(self) -> Optional[ED807Changes]:
+        """Change report against the previous directory version, None if index was built from scratch."""
+        meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+        if "previous_source_hash" not in meta:
+            return None
+        by_kind = {CHANGE_ADDED: [], CHANGE_REMOVED: [], CHANGE_CHANGED: []}
+        for kind, bic in self.connection.execute("SELECT kind, bic FROM changes ORDER BY rowid"):
+            by_kind[kind].append(bic)
+        return ED807Changes(
+            previous_source_hash=meta["previous_source_hash"],
+            source_hash=meta["source_hash"],
+            added=by_kind[CHANGE_ADDED],
+            removed=by_kind[CHANGE_REMOVED],
+            changed=by_kind[CHANGE_CHANGED],
+            moved=int(meta["moved"]),
+            unchanged=int(meta["unchanged"]),
+        )
+
+    def __contains__(self, bic: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM entries WHERE bic = ? LIMIT 1", (bic,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return len(self.sort_keys())
+
+    def close(self):
+        self.connection.close()
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Index new ED807 directory version and print its changes against the previous one")
+    parser.add_argument("path", help="Path to ED807 XML")
+    parser.add_argument("--namespace", default=None)
+    parser.add_argument("--encoding", default="windows-1251")
+    parser.add_argument("--index-dir", default=".cache/ed807")
+    parser.add_argument("--previous", default=None, help="Index of the previous version (default: the latest one in index dir)")
+    parser.add_argument("--output", default=None, help="Path to JSON change report (default: print to stdout)")
+    parsed = parser.parse_args(args)
+
+    index = ED807Index(parsed.path, namespace=parsed.namespace, encoding=parsed.encoding, index_dir=parsed.index_dir,
+                       previous=parsed.previous)
+    changes = index.changes()
+    report_text = json.dumps(changes.to_dict() if changes is not None else None, ensure_ascii=False, indent=2)
+    if parsed.output:
+        with open(parsed.output, "w", encoding="utf-8") as f:
+            f.write(report_text)
+    else:
+        print(report_text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,192 @@
+"""
+Analysis of 'EDNo' of 'ED101' documents: duplicates, missing ranges and out-of-order documents in one pass,
+and reuse of numbers across packets of the same (EDAuthor, EDDate).
+
+Seen numbers are stored in `EDNoBitmap` - bitmap split into fixed pages of 65536 numbers (8 KB), which are allocated
+only when some number of their range is seen, so memory is 8 KB per used range, not per max EDNo. Missing ranges are
+found by scanning allocated pages in C: each page, which is not allocated, and each run of empty bytes is one range,
+bits are checked only in partially filled bytes. So time does not depend on max EDNo, only on amount of documents,
+allocated pages and missing ranges.
+
+Usage: python -m utils.edno <PacketEPD.xml> [<PacketEPD.xml> ...] [--encoding windows-1251] [--output report.json]
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple, Union
+from utils.xml import XMLObject
+from utils.logger import logger
+import argparse
+import json
+import re
+
+ED101 = "ED101"
+EDNO = "EDNo"
+EDAUTHOR = "EDAuthor"
+EDDATE = "EDDate"
+_EMPTY_RUN_OR_PARTIAL_BYTE = re.compile(rb"\x00+|[^\xff]")
+
+
+class EDNoBitmap:
+    """ Set of non-negative integers as paged bitmap """
+    PAGE_BITS = 1 << 16 # 8 KB per page
+
+    def __init__(self):
+        self.pages: Dict[int, bytearray] = {}
+
+    def add(self, value: int) -> bool:
+        """Add value, returns True if it was already present."""
+        page_index, offset = divmod(value, self.PAGE_BITS)
+        page = self.pages.get(page_index)
+        if page is None:
+            page = self.pages[page_index] = bytearray(self.PAGE_BITS // 8)
+        byte_index, bit = divmod(offset, 8)
+        mask = 1 << bit
+        if page[byte_index] & mask:
+            return True
+        page[byte_index] |= mask
+        return False
+
+    def __contains__(self, value: int) -> bool:
+        page_index, offset = divmod(value, self.PAGE_BITS)
+        page = self.pages.get(page_index)
+        return page is not None and bool(page[offset // 8] & (1 << (offset % 8)))
+
+    def missing_ranges(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Inclusive ranges of values between `start` and `end` (inclusive), which are not present."""
+        ranges: List[Tuple[int, int]] = []
+
+        def add(first: int, last: int):
+            first, last = max(first, start), min(last, end)
+            if first > last:
+                return
+            if ranges and ranges[-1][1] + 1 == first: # Adjacent to previous range (e.g. continues in the next page)
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+
+        if start > end:
+            return ranges
+        position = start # Values before it are already classified
+        for page_index in sorted(index for index in self.pages if start // self.PAGE_BITS <= index <= end // self.PAGE_BITS):
+            page_start = page_index * self.PAGE_BITS
+            add(position, page_start - 1) # Pages between allocated ones are not allocated, so they are empty
+            page = self.pages[page_index]
+            first_byte = max(0, start - page_start) // 8
+            last_byte = min(self.PAGE_BITS - 1, end - page_start) // 8
+            for match in _EMPTY_RUN_OR_PARTIAL_BYTE.finditer(page, first_byte, last_byte + 1): # Full bytes are skipped in C
+                byte_index = match.start()
+                byte = page[byte_index]
+                if byte == 0:
+                    add(page_start + byte_index * 8, page_start + match.end() * 8 - 1)
+                    continue
+                for bit in range(8):
+                    if not byte & (1 << bit):
+                        value = page_start + byte_index * 8 + bit
+                        add(value, value)
+            position = page_start + self.PAGE_BITS
+        add(position, end)
+        return ranges
+
+
+@dataclass
+class EDNoAnalysis:
+    """ EDNo problems of one packet, all positions are 1-based numbers of 'ED101' in packet """
+    xml_path: str
+    count: int = 0
+    min_edno: Optional[int] = None
+    max_edno: Optional[int] = None
+    invalid: List[int] = field(default_factory=list) # Positions with missing or not numeric EDNo
+    below_start: List[Tuple[int, int]] = field(default_factory=list) # (position, EDNo) of numbers less than `start`
+    duplicates: List[Tuple[int, int]] = field(default_factory=list) # (position, EDNo) of repeated numbers
+    missing_ranges: List[Tuple[int, int]] = field(default_factory=list) # Numbers between `start` and max EDNo, which are not used
+    out_of_order: List[Tuple[int, int, int]] = field(default_factory=list) # (position, previous EDNo, EDNo) where EDNo decreases
+    reused_from_other_packets: List[Tuple[int, int]] = field(default_factory=list) # (position, EDNo) used by previous packet
+
+    @property
+    def is_sequence(self) -> bool:
+        """True if EDNo of documents are exactly `start`, `start + 1`, ... in document order."""
+        return not (self.invalid or self.below_start or self.duplicates or self.missing_ranges or self.out_of_order or self.reused_from_other_packets)
+
+    def to_dict(self) -> dict:
+        return dict(asdict(self), is_sequence=self.is_sequence)
+
+
+class EDNoRegistry:
+    """ EDNo already used by analyzed packets, per (EDAuthor, EDDate) of documents, to detect reuse across packets """
+    def __init__(self):
+        self.used: Dict[Tuple[Optional[str], Optional[str]], EDNoBitmap] = {}
+
+    def analyze(self, source: Union[str, XMLObject], start: int = 1, encoding: str = 'windows-1251') -> EDNoAnalysis:
+        """Analyze packet (streamed if path is given) and register its numbers."""
+        return analyze_edno(source, start=start, encoding=encoding, registry=self)
+
+
+def analyze_edno(source: Union[str, XMLObject], start: int = 1, encoding: str = 'windows-1251',
+                 registry: EDNoRegistry = None) -> EDNoAnalysis:
+    """
+    Analyze EDNo of all 'ED101' of packet in one pass, numbers are expected to go from `start` by 1.
+
+    With `registry` numbers are also checked against and added to numbers of previously analyzed packets.
+    """
+    xml_tree = source if isinstance(source, XMLObject) else XMLObject(source, encoding=encoding, streaming=True)
+    analysis = EDNoAnalysis(xml_path=xml_tree.xml_path)
+    seen = EDNoBitmap()
+    packet_used: Dict[tuple, List[int]] = {} # Numbers of this packet are registered only after it is analyzed
+    previous = None
+    for position, ed101 in enumerate(xml_tree.iter_nodes(ED101), start=1):
+        analysis.count += 1
+        try:
+            edno = int(ed101.get(EDNO))
+            if edno < 0:
+                raise ValueError(edno)
+        except (TypeError, ValueError):
+            analysis.invalid.append(position)
+            continue
+        if edno < start:
+            analysis.below_start.append((position, edno))
+        if seen.add(edno):
+            analysis.duplicates.append((position, edno))
+        if previous is not None and edno < previous:
+            analysis.out_of_order.append((position, previous, edno))
+        previous = edno
+        analysis.min_edno = edno if analysis.min_edno is None else min(analysis.min_edno, edno)
+        analysis.max_edno = edno if analysis.max_edno is None else max(analysis.max_edno, edno)
+        if registry is not None:
+            key = (ed101.get(EDAUTHOR), ed101.get(EDDATE))
+            used = registry.used.get(key)
+            if used is not None and edno in used:
+                analysis.reused_from_other_packets.append((position, edno))
+            packet_used.setdefault(key, []).append(edno)
+    if analysis.max_edno is not None:
+        analysis.missing_ranges = seen.missing_ranges(start, analysis.max_edno)
+    if registry is not None:
+        for key, ednos in packet_used.items():
+            used = registry.used.setdefault(key, EDNoBitmap())
+            for edno in ednos:
+                used.add(edno)
+    logger.info("EDNo of %s ED101 in '%s': %s duplicates, %s missing ranges, %s out of order, %s invalid, %s reused",
+                analysis.count, analysis.xml_path, len(analysis.duplicates), len(analysis.missing_ranges),
+                len(analysis.out_of_order), len(analysis.invalid), len(analysis.reused_from_other_packets))
+    return analysis
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Analyze EDNo of ED101 in PacketEPD files: duplicates, gaps, order and reuse across packets")
+    parser.add_argument("paths", nargs="+", help="PacketEPD XML files, analyzed in given order")
+    parser.add_argument("--encoding", default="windows-1251")
+    parser.add_argument("--start", type=int, default=1, help="Expected first EDNo in each packet (default: 1)")
+    parser.add_argument("--output", default=None, help="Path to JSON report (default: print to stdout)")
+    parsed = parser.parse_args(args)
+
+    registry = EDNoRegistry()
+    analyses = [registry.analyze(path, start=parsed.start, encoding=parsed.encoding) for path in parsed.paths]
+    report_text = json.dumps([analysis.to_dict() for analysis in analyses], ensure_ascii=False, indent=2)
+    if parsed.output:
+        with open(parsed.output, "w", encoding="utf-8") as f:
+            f.write(report_text)
+    else:
+        print(report_text)
+    return 0 if all(analysis.is_sequence for analysis in analyses) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,126 @@
+"""
+One-pass summary of PacketEPD: header reconciliation (EDQuantity and Sum) and totals of 'ED101' grouped
+by payer BIC, payee BIC and (EDDate, TransKind).
+
+Document is streamed by default, so memory depends only on amount of distinct groups, not on amount of documents.
+
+Usage: python -m utils.epd_summary <PacketEPD.xml> [--encoding windows-1251] [--namespace NS] [--top N] [--output summary.json]
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+from utils.xml import XMLObject
+from utils.logger import logger
+import argparse
+import json
+
+ED101 = "ED101"
+SUM = "Sum"
+EDQUANTITY = "EDQuantity"
+EDDATE = "EDDate"
+TRANSKIND = "TransKind"
+BIC = "BIC"
+PAYER_BANK = "Payer/Bank"
+PAYEE_BANK = "Payee/Bank"
+
+
+@dataclass
+class GroupTotals:
+    count: int = 0
+    total: int = 0
+
+    def add(self, amount: int):
+        self.count += 1
+        self.total += amount
+
+
+@dataclass
+class PacketSummary:
+    header: Dict[str, str]
+    ed101_count: int = 0
+    ed101_sum: int = 0 # Missing or not numeric Sum is counted as 0
+    missing_sum: List[int] = field(default_factory=list) # Numbers of ED101 without numeric Sum
+    by_payer_bic: Dict[Optional[str], GroupTotals] = field(default_factory=dict)
+    by_payee_bic: Dict[Optional[str], GroupTotals] = field(default_factory=dict)
+    by_date_trans_kind: Dict[Tuple[Optional[str], Optional[str]], GroupTotals] = field(default_factory=dict)
+
+    def check_EDQuantity(self) -> Tuple[bool, tuple]:
+        """Returns tuple of (*is equal*, (*header EDQuantity*, *amount of ED101*))."""
+        header_quantity = self.header.get(EDQUANTITY)
+        return header_quantity is not None and int(header_quantity) == self.ed101_count, (header_quantity, self.ed101_count)
+
+    def check_Sum(self) -> Tuple[bool, tuple]:
+        """Returns tuple of (*is equal*, (*header Sum*, *sum of ED101 Sum*))."""
+        header_sum = self.header.get(SUM)
+        return header_sum is not None and int(header_sum) == self.ed101_sum, (header_sum, self.ed101_sum)
+
+    def to_dict(self, top: int = None) -> dict:
+        """JSON-friendly summary, groups are sorted by total (only `top` largest ones if given)."""
+        def groups(totals: dict, key_name) -> list:
+            rows = sorted(totals.items(), key=lambda item: (-item[1].total, -item[1].count))[:top]
+            return [dict(key_name(key), count=value.count, total=value.total) for key, value in rows]
+
+        quantity_ok, _ = self.check_EDQuantity()
+        sum_ok, _ = self.check_Sum()
+        return {
+            "header": dict(self.header),
+            "ed101_count": self.ed101_count,
+            "ed101_sum": self.ed101_sum,
+            "missing_sum": self.missing_sum,
+            "EDQuantity_equals_ed101_amount": quantity_ok,
+            "Sum_equals_ed101_sum": sum_ok,
+            "by_payer_bic": groups(self.by_payer_bic, lambda bic: {"bic": bic}),
+            "by_payee_bic": groups(self.by_payee_bic, lambda bic: {"bic": bic}),
+            "by_date_trans_kind": groups(self.by_date_trans_kind, lambda key: {"date": key[0], "trans_kind": key[1]}),
+        }
+
+
+def summarize_packet(source: Union[str, XMLObject], namespace: str = None, encoding: str = 'windows-1251') -> PacketSummary:
+    """Summarize PacketEPD file (streamed) or already created XML object in one pass over 'ED101'."""
+    xml_tree = source if isinstance(source, XMLObject) else XMLObject(source, namespace=namespace, encoding=encoding, streaming=True)
+    summary = PacketSummary(header=dict(xml_tree.get_root_attributes()))
+    payer_bank = xml_tree.compile_path(xml_tree.qualify_steps(PAYER_BANK), first_only=True)
+    payee_bank = xml_tree.compile_path(xml_tree.qualify_steps(PAYEE_BANK), first_only=True)
+    for number, ed101 in enumerate(xml_tree.iter_nodes(ED101), start=1):
+        try:
+            amount = int(ed101.get(SUM))
+        except (TypeError, ValueError):
+            amount = 0
+            summary.missing_sum.append(number)
+        summary.ed101_count += 1
+        summary.ed101_sum += amount
+        payer = payer_bank(ed101)
+        payee = payee_bank(ed101)
+        payer_bic = payer[0].get(BIC) if payer else None
+        payee_bic = payee[0].get(BIC) if payee else None
+        date_trans_kind = (ed101.get(EDDATE), ed101.get(TRANSKIND))
+        for totals, key in ((summary.by_payer_bic, payer_bic), (summary.by_payee_bic, payee_bic),
+                            (summary.by_date_trans_kind, date_trans_kind)):
+            group = totals.get(key)
+            if group is None:
+                group = totals[key] = GroupTotals()
+            group.add(amount)
+    logger.info("Summarized %s ED101 documents of '%s' with total sum %s", summary.ed101_count, xml_tree.xml_path, summary.ed101_sum)
+    return summary
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Summarize PacketEPD: header reconciliation and ED101 totals per BIC and date")
+    parser.add_argument("path", help="Path to PacketEPD XML")
+    parser.add_argument("--encoding", default="windows-1251")
+    parser.add_argument("--namespace", default=None)
+    parser.add_argument("--top", type=int, default=None, help="Amount of largest groups to output (default: all)")
+    parser.add_argument("--output", default=None, help="Path to JSON summary (default: print to stdout)")
+    parsed = parser.parse_args(args)
+
+    summary = summarize_packet(parsed.path, namespace=parsed.namespace, encoding=parsed.encoding)
+    summary_text = json.dumps(summary.to_dict(top=parsed.top), ensure_ascii=False, indent=2)
+    if parsed.output:
+        with open(parsed.output, "w", encoding="utf-8") as f:
+            f.write(summary_text)
+    else:
+        print(summary_text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,190 @@
+"""
+Bounded reporting of large defect lists (bad node ids, reconciliation errors and so on).
+
+`FailureReport` is list-like sink of defects: the first `max_examples` are kept in memory, and once there are
+more of them all defects are streamed to JSONL sidecar file in `.cache/failures` (one JSON object per line),
+so assertion message and html report show only amount, examples and path to the full list, whatever the amount is.
+Reports with defects are collected per test (by instrumentation context) and added to pytest-html report.
+Long id lists in logs (`logger.ids`) are spilled by the same reports, and a list, which is both logged and shown
+in assertion message, is written to one sidecar. Only the newest `MAX_SIDECARS` sidecars are kept in the directory.
+
+Usage: python -m utils.failures <sidecar.jsonl> [--page N] [--page-size 50]
+"""
+from collections import OrderedDict
+from html import escape
+from itertools import count, islice
+from typing import Dict, Iterable, List, Tuple
+from utils.instrumentation import instrumentation
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+
+MAX_EXAMPLES = 20
+MAX_SIDECARS = 500
+MAX_SHARED_REPORTS = 64
+DEFAULT_SIDECAR_DIR = ".cache/failures"
+
+
+class FailureReport:
+    _sidecar_numbers = count(1)
+
+    def __init__(self, label: str = "failures", max_examples: int = MAX_EXAMPLES, sidecar_dir: str = DEFAULT_SIDECAR_DIR):
+        self.label = label
+        self.max_examples = max_examples
+        self.sidecar_dir = sidecar_dir
+        self.count = 0
+        self.examples: list = []
+        self.sidecar_path: str = None
+        self._sidecar = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _write(self, number: int, defect):
+        self._sidecar.write(json.dumps({"n": number, "defect": defect}, ensure_ascii=False, default=str) + "\n")
+
+    def _open_sidecar(self):
+        os.makedirs(self.sidecar_dir, exist_ok=True)
+        _rotate_sidecars(self.sidecar_dir, MAX_SIDECARS - 1)
+        name = re.sub(r"[^\w.-]+", "_", self.label).strip("_") or "failures"
+        self.sidecar_path = os.path.join(self.sidecar_dir, f"{name}-{os.getpid()}-{next(FailureReport._sidecar_numbers)}.jsonl")
+        self._sidecar = open(self.sidecar_path, "w", encoding="utf-8")
+        for number, defect in enumerate(self.examples, start=1):
+            self._write(number, defect)
+
+    def append(self, defect):
+        self.count += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append(defect)
+            return
+        if self._sidecar is None:
+            self._open_sidecar()
+        self._write(self.count, defect)
+
+    def extend(self, defects: Iterable):
+        for defect in defects:
+            self.append(defect)
+
+    def close(self):
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+
+    @property
+    def truncated(self) -> bool:
+        return self.count > len(self.examples)
+
+    def message(self, separator: str = "\n") -> str:
+        """All defects if there are not more than `max_examples` of them, otherwise examples, amount and sidecar path."""
+        text = separator.join(str(defect) for defect in self.examples)
+        if self.truncated:
+            self.close()
+            text += f"{separator}... ({self.count} total, full list in '{self.sidecar_path}')"
+        return text
+
+    def __str__(self) -> str:
+        if not self.truncated:
+            return str(self.examples)
+        return f"[{self.message(', ')}]"
+
+    def to_html(self, report_dir: str = None) -> str:
+        """Amount and examples of defects with link to sidecar (relative to `report_dir`, if it is given)."""
+        examples = "".join(f"<li>{escape(str(defect))}</li>" for defect in self.examples)
+        html = f"<p>{escape(self.label)}: {self.count} defects</p><ol>{examples}</ol>"
+        if self.truncated:
+            self.close()
+            href = os.path.relpath(self.sidecar_path, report_dir) if report_dir else self.sidecar_path
+            html += f"<p>Shown first {len(self.examples)}, full list: <a href=\"{escape(href)}\">{escape(self.sidecar_path)}</a> " \
+                f"(<code>python -m utils.failures {escape(self.sidecar_path)} --page N</code>)</p>"
+        return html
+
+
+def _rotate_sidecars(sidecar_dir: str, keep: int):
+    """Remove the oldest sidecars, so that at most `keep` of them are left."""
+    paths = glob.glob(os.path.join(sidecar_dir, "*.jsonl"))
+    if len(paths) <= keep:
+        return
+    def mtime(path: str) -> float:
+        try:
+            return os.path.getmtime(path)
+        except OSError: # Removed by another process
+            return 0.0
+    for path in sorted(paths, key=mtime)[:len(paths) - keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+collected: Dict[str, List[FailureReport]] = {} # Instrumentation context (test id) -> reports with defects
+_shared_reports: "OrderedDict[int, Tuple[object, FailureReport]]" = OrderedDict() # id of defects list -> (list, its report)
+_shared_reports_lock = threading.Lock() # Reports are also made by logging thread
+
+
+def register(report: FailureReport) -> FailureReport:
+    """Add report to the current test, it is shown in html report if it has defects."""
+    report.close()
+    if len(report) > 0:
+        collected.setdefault(instrumentation.context, []).append(report)
+    return report
+
+
+def shared_report(defects: Iterable, label: str, max_examples: int = MAX_EXAMPLES, key: object = None) -> FailureReport:
+    """
+    Closed report of defects, which is made once per list object (`key`, by default `defects` itself):
+    the same list of bad ids, which is logged and then shown in assertion message, is spilled to one sidecar.
+    """
+    key = defects if key is None else key
+    if not hasattr(key, "__len__"): # Iterator can not be recognized next time
+        report = FailureReport(label, max_examples=max_examples)
+        report.extend(defects)
+        report.close()
+        return report
+    with _shared_reports_lock:
+        cached = _shared_reports.get(id(key))
+        if cached is not None and cached[0] is key and len(cached[1]) == len(key) and cached[1].max_examples == max_examples:
+            return cached[1]
+        report = FailureReport(label, max_examples=max_examples)
+        report.extend(defects)
+        report.close()
+        if report.truncated: # Short lists are cheap to format again
+            _shared_reports[id(key)] = (key, report)
+            while len(_shared_reports) > MAX_SHARED_REPORTS:
+                _shared_reports.popitem(last=False)
+    return report
+
+
+def failure_report(defects: Iterable, label: str, max_examples: int = MAX_EXAMPLES) -> FailureReport:
+    """Bounded report of already collected defects for assertion message, e.g. f"Found bad nodes: {failure_report(ids, 'no_date')}"."""
+    return register(shared_report(defects, label, max_examples))
+
+
+def clear_sidecars(sidecar_dir: str = DEFAULT_SIDECAR_DIR):
+    """Remove sidecars of previous runs."""
+    for path in glob.glob(os.path.join(sidecar_dir, "*.jsonl")):
+        os.remove(path)
+
+
+def read_page(sidecar_path: str, page: int = 1, page_size: int = 50) -> List[dict]:
+    """Records of given page (1-based) of sidecar, only this page is kept in memory."""
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in islice(f, (page - 1) * page_size, page * page_size)]
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description="Show page of defects from failure sidecar file")
+    parser.add_argument("path", help="Path to JSONL sidecar")
+    parser.add_argument("--page", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=50)
+    parsed = parser.parse_args(args)
+
+    for record in read_page(parsed.path, parsed.page, parsed.page_size):
+        print(f"{record['n']}: {record['defect']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
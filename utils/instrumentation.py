@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from functools import wraps
+from html import escape
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+SESSION_CONTEXT = "session" # Context of spans, which are recorded outside of any test
+PROFILE_CPROFILE = "cprofile"
+PROFILE_TRACEMALLOC = "tracemalloc"
+PROFILE_TOP_LINES = 25
+
+
+@dataclass
+class SpanStats:
+    """Aggregated stats of all calls of one span (phase, name) in one context."""
+    calls: int = 0
+    seconds: float = 0.0 # Including nested spans
+    self_seconds: float = 0.0 # Excluding nested spans, so self time of all spans adds up to total time
+    max_seconds: float = 0.0
+    peak_alloc_bytes: Optional[int] = None # Only if memory is traced
+    counters: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class ProfileCapture:
+    name: str
+    mode: str
+    text: str
+
+
+class _OpenSpan:
+    __slots__ = ("key", "started", "child_seconds", "counters", "mem_started", "child_peak")
+
+    def __init__(self, key: Tuple[str, str], mem_started: Optional[int]):
+        self.key = key
+        self.started = time.perf_counter()
+        self.child_seconds = 0.0
+        self.counters: Dict[str, int] = {}
+        self.mem_started = mem_started
+        self.child_peak = 0
+
+
+class Instrumentation:
+    """
+    Timing spans and counters for parsing, queries, models and checks, aggregated per context (test id).
+
+    Recording is disabled by default, so instrumented code costs only one flag check per call. Only coarse
+    phases (parsing, projections, models, rules passes and checks) are instrumented, not per-node lookups.
+    Span time includes nested spans, self time does not. With `trace_memory` peak of python allocations
+    is recorded for every span (requires running `tracemalloc`, which slows allocations down).
+    Spans with names matching `profile_pattern` are additionally profiled with cProfile or tracemalloc.
+    """
+    def __init__(self):
+        self.enabled: bool = False
+        self.trace_memory: bool = False
+        self.profile_pattern: Optional[str] = None
+        self.profile_mode: str = PROFILE_CPROFILE
+        self.context: str = SESSION_CONTEXT
+        self.stats: Dict[str, Dict[Tuple[str, str], SpanStats]] = {} # context -> (phase, name) -> stats
+        self.profiles: Dict[str, List[ProfileCapture]] = {} # context -> captures
+        self._local = threading.local()
+        self._profiling = False
+
+    def _stack(self) -> List[_OpenSpan]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def configure(self, enabled: bool = False, trace_memory: bool = False, profile_pattern: str = None, profile_mode: str = PROFILE_CPROFILE):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.profile_pattern = profile_pattern
+        self.profile_mode = profile_mode
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        self.stats.clear()
+        self.profiles.clear()
+
+    @contextmanager
+    def span(self, phase: str, name: str) -> Iterator[None]:
+        """Record wall time (and allocation peak) of the block as one call of span `name` of given phase."""
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        mem_started = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack: # Peak is reset below, so keep the peak seen by outer span so far
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            mem_started = current
+        opened = _OpenSpan((phase, name), mem_started)
+        stack.append(opened)
+        try:
+            if self.profile_pattern and not self._profiling and fnmatchcase(name, self.profile_pattern):
+                with self._profile(name):
+                    yield
+            else:
+                yield
+        finally:
+            stack.pop()
+            self._close(opened, stack[-1] if stack else None)
+
+    def _close(self, opened: _OpenSpan, parent: Optional[_OpenSpan]):
+        seconds = time.perf_counter() - opened.started
+        stats = self.stats.setdefault(self.context, {}).setdefault(opened.key, SpanStats())
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.self_seconds += seconds - opened.child_seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        for counter, value in opened.counters.items():
+            stats.counters[counter] = stats.counters.get(counter, 0) + value
+        if opened.mem_started is not None:
+            peak = max(tracemalloc.get_traced_memory()[1], opened.child_peak)
+            stats.peak_alloc_bytes = max(stats.peak_alloc_bytes or 0, peak - opened.mem_started)
+            if parent is not None:
+                parent.child_peak = max(parent.child_peak, peak)
+        if parent is not None:
+            parent.child_seconds += seconds
+
+    @contextmanager
+    def _profile(self, name: str) -> Iterator[None]:
+        self._profiling = True
+        try:
+            if self.profile_mode == PROFILE_TRACEMALLOC:
+                started_tracing = not tracemalloc.is_tracing()
+                if started_tracing:
+                    tracemalloc.start()
+                before = tracemalloc.take_snapshot()
+                try:
+                    yield
+                finally:
+                    diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+                    if started_tracing:
+                        tracemalloc.stop()
+                    text = "\n".join(str(line) for line in diff[:PROFILE_TOP_LINES])
+                    self.profiles.setdefault(self.context, []).append(ProfileCapture(name, self.profile_mode, text))
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    output = io.StringIO()
+                    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_LINES)
+                    self.profiles.setdefault(self.context, []).append(ProfileCapture(name, self.profile_mode, output.getvalue()))
+        finally:
+            self._profiling = False
+
+    def count(self, counter: str, value: int = 1):
+        """Add value to counter of the innermost open span (e.g. amount of processed nodes)."""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if stack:
+            stack[-1].counters[counter] = stack[-1].counters.get(counter, 0) + value
+
+    def instrumented(self, phase: str, name: str = None, nodes: Callable[[object], int] = None):
+        """
+        Decorator to record each call of function as span of given phase, named '<Class>.<method>' by default.
+
+        `nodes` gets function result and returns amount of nodes to add to 'nodes' counter of the span.
+        """
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(phase, span_name):
+                    result = func(*args, **kwargs)
+                    if nodes is not None:
+                        self.count("nodes", nodes(result))
+                    return result
+            return wrapper
+        return decorator
+
+    def phase_totals(self, context: str = None) -> Dict[str, SpanStats]:
+        """Stats summed by phase for one context or for all of them, time is self time of spans."""
+        totals: Dict[str, SpanStats] = {}
+        contexts = [context] if context is not None else list(self.stats)
+        for context_name in contexts:
+            for (phase, _), stats in self.stats.get(context_name, {}).items():
+                total = totals.setdefault(phase, SpanStats())
+                total.calls += stats.calls
+                total.seconds += stats.self_seconds
+                total.self_seconds += stats.self_seconds
+                total.max_seconds = max(total.max_seconds, stats.max_seconds)
+                if stats.peak_alloc_bytes is not None:
+                    total.peak_alloc_bytes = max(total.peak_alloc_bytes or 0, stats.peak_alloc_bytes)
+                for counter, value in stats.counters.items():
+                    total.counters[counter] = total.counters.get(counter, 0) + value
+        return totals
+
+
+def _format_counters(counters: Dict[str, int]) -> str:
+    return ", ".join(f"{counter}: {value}" for counter, value in sorted(counters.items()))
+
+
+def _format_peak(peak_alloc_bytes: Optional[int]) -> str:
+    return "" if peak_alloc_bytes is None else f"{peak_alloc_bytes / 2 ** 20:.2f}"
+
+
+def stats_table_html(stats: Dict[Tuple[str, str], SpanStats]) -> str:
+    """HTML table of spans of one context, slowest (by self time) first."""
+    rows = [
+        f"<tr><td>{escape(phase)}</td><td>{escape(name)}</td><td>{span.calls}</td><td>{span.seconds:.4f}</td>"
+        f"<td>{span.self_seconds:.4f}</td><td>{span.max_seconds:.4f}</td><td>{_format_peak(span.peak_alloc_bytes)}</td>"
+        f"<td>{escape(_format_counters(span.counters))}</td></tr>"
+        for (phase, name), span in sorted(stats.items(), key=lambda item: -item[1].self_seconds)
+    ]
+    return "<table class=\"instrumentation\"><tr><th>Phase</th><th>Span</th><th>Calls</th><th>Time, s</th><th>Self time, s</th>" \
+        "<th>Max call, s</th><th>Peak alloc, MB</th><th>Counters</th></tr>" + "".join(rows) + "</table>"
+
+
+def phase_table_html(totals: Dict[str, SpanStats]) -> str:
+    """HTML table of self time per phase."""
+    rows = [
+        f"<tr><td>{escape(phase)}</td><td>{span.calls}</td><td>{span.self_seconds:.4f}</td>"
+        f"<td>{_format_peak(span.peak_alloc_bytes)}</td><td>{escape(_format_counters(span.counters))}</td></tr>"
+        for phase, span in sorted(totals.items(), key=lambda item: -item[1].self_seconds)
+    ]
+    return "<table class=\"instrumentation\"><tr><th>Phase</th><th>Calls</th><th>Self time, s</th><th>Peak alloc, MB</th>" \
+        "<th>Counters</th></tr>" + "".join(rows) + "</table>"
+
+
+def profiles_html(captures: List[ProfileCapture]) -> str:
+    return "".join(f"<p>{escape(capture.mode)} profile of '{escape(capture.name)}'</p><pre>{escape(capture.text)}</pre>"
+                   for capture in captures)
+
+
+instrumentation = Instrumentation()
+instrumented = instrumentation.instrumented
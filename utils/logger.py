@@ -1,25 +1,122 @@
+from utils.failures import shared_report
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+
+class TruncatedIds:
+    """
+    List of ids (e.g. numbers of bad nodes) for logging, which is formatted only when log record is emitted.
+
+    Short lists are formatted as is, long ones are truncated to first `max_shown` ids and the full list
+    is written to failure sidecar (see `utils.failures`), which path is added to the message. The same list,
+    shown in assertion message by `failure_report`, is not written again.
+    With `copy` ids are copied, because record is formatted later in background and list could change until then.
+    """
+    def __init__(self, ids, label: str, max_shown: int, copy: bool = True):
+        self.source = ids
+        self.ids = tuple(ids) if copy else ids
+        self.label = label
+        self.max_shown = max_shown
+        self._formatted: str = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __str__(self) -> str:
+        with self._lock: # Same record can be formatted by several handlers, sidecar is written only once
+            if self._formatted is None:
+                if len(self.ids) <= self.max_shown:
+                    self._formatted = str(list(self.ids))
+                else:
+                    self._formatted = str(shared_report(self.ids, self.label, self.max_shown, key=self.source))
+            return self._formatted
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler, which leaves message formatting to listener thread instead of the logging one."""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 
 class Logger:
-    def __init__(self, name=__name__, level=logging.INFO):
+    """
+    Project logger with lazy %-style formatting: `logger.info("Found %s nodes", count)`.
+
+    Message is formatted only if its level is enabled. With `background=True` (default) records are put
+    into a queue and formatted and written to console by a separate thread, so logging does not block checks.
+    Long id lists should be passed as `logger.ids(ids, label)`, so they are truncated in the message.
+    """
+    def __init__(self, name=__name__, level=logging.INFO, background: bool = True, max_shown_ids: int = 20):
         # Set up logging configuration
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
+        self.max_shown_ids = max_shown_ids
         handler = logging.StreamHandler()  # Log to console
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
+        self._console_handler = handler
+        self._queue_handler = None
+        self._listener = None
+        if background:
+            self._queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+            self._start_listener()
+            # Listener thread does not survive fork, records queued by parent should not be written by child
+            if hasattr(os, "register_at_fork"): # There is no fork on Windows
+                os.register_at_fork(after_in_child=lambda: self._start_listener(new_queue=True))
+            atexit.register(self._stop_listener)
+            handler = self._queue_handler
         self.logger.addHandler(handler)
 
-    def info(self, message):
-        self.logger.info(message)
+    def _start_listener(self, new_queue: bool = False):
+        if new_queue:
+            self._queue_handler.queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._queue_handler.queue, self._console_handler, respect_handler_level=True)
+        self._listener.start()
+
+    def _stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop() # Writes all queued records before stopping
+            self._listener = None
+
+    def is_enabled_for(self, level: int) -> bool:
+        """Check level before preparing expensive log arguments."""
+        return self.logger.isEnabledFor(level)
+
+    def ids(self, ids, label: str = "ids", level: int = logging.INFO) -> TruncatedIds:
+        """Ids for message of given level, they are copied only if the message will be formatted in background."""
+        copy = self._queue_handler is not None and self.logger.isEnabledFor(level)
+        return TruncatedIds(ids, label, self.max_shown_ids, copy=copy)
+
+    def flush(self):
+        """Wait until all queued records are written."""
+        if self._listener is not None:
+            self._stop_listener()
+            self._start_listener()
+
+    def info(self, message, *args):
+        self.logger.info(message, *args)
+
+    def warning(self, message, *args):
+        self.logger.warning(message, *args)
+
+    def error(self, message, *args):
+        self.logger.error(message, *args)
 
-    def warning(self, message):
-        self.logger.warning(message)
+    def debug(self, message, *args):
+        self.logger.debug(message, *args)
 
-    def error(self, message):
-        self.logger.error(message)
 
-    def debug(self, message):
-        self.logger.debug(message)
+def process_pool_context() -> multiprocessing.context.BaseContext:
+    """
+    Start method for worker process pools. Processes are not forked, because logger has background thread
+    (fork of multi-threaded process may deadlock): forkserver is used where it is available, otherwise spawn (Windows).
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
 
-logger = Logger()
\ No newline at end of file
+logger = Logger()
@@ -0,0 +1,103 @@
+"""
+Projection of XML nodes into typed columns: one value per node for each requested field.
+
+Field spec is a string '<child path>/@<attribute>[:<type>]' relative to projected node, e.g. '@Sum:int' or
+'Payer/Bank/@BIC'. Integer fields are stored in `IntColumn` (int64 `array` + presence flags), string fields
+in `CategoricalColumn` (codes `array` + list of distinct values), so checks are computed over whole columns
+instead of Python loops over lxml elements.
+"""
+from array import array
+from itertools import compress
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+TYPE_INT = "int"
+TYPE_STR = "str"
+
+
+class FieldSpec(NamedTuple):
+    child_path: Optional[str] # None for attribute of the node itself
+    attrib: str
+    type: str
+
+    @classmethod
+    def parse(cls, spec: str) -> "FieldSpec":
+        locator, _, field_type = spec.partition(":")
+        child_path, _, attrib = locator.rpartition("@")
+        if not attrib:
+            raise ValueError(f"Field spec '{spec}' should contain attribute, e.g. '@Sum:int' or 'Payer/Bank/@BIC'")
+        field_type = field_type or TYPE_STR
+        if field_type not in (TYPE_INT, TYPE_STR):
+            raise ValueError(f"Unknown type '{field_type}' of field '{spec}', expected '{TYPE_INT}' or '{TYPE_STR}'")
+        return cls(child_path.rstrip("/") or None, attrib, field_type)
+
+
+class IntColumn:
+    """ Integer column, missing or not numeric values are stored as 0 with presence flag 0 """
+    def __init__(self):
+        self.values = array('q')
+        self.present = array('b')
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def append(self, raw: Optional[str]):
+        try:
+            self.values.append(int(raw))
+            self.present.append(True)
+        except (TypeError, ValueError):
+            self.values.append(0)
+            self.present.append(False)
+
+    def sum(self) -> int:
+        return sum(self.values)
+
+    def missing(self) -> List[int]:
+        """Numbers (1-based) of nodes without numeric value."""
+        return list(compress(range(1, len(self) + 1), map((0).__eq__, self.present)))
+
+
+class CategoricalColumn:
+    """ String column as codes of distinct values (missing value is category None) """
+    def __init__(self):
+        self.codes = array('l')
+        self.categories: List[Optional[str]] = []
+        self._category_codes: Dict[Optional[str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        return self.categories[self.codes[index]]
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        return map(self.categories.__getitem__, self.codes)
+
+    def append(self, raw: Optional[str]):
+        code = self._category_codes.get(raw)
+        if code is None:
+            code = self._category_codes[raw] = len(self.categories)
+            self.categories.append(raw)
+        self.codes.append(code)
+
+    def not_equal(self, value: Optional[str]) -> List[int]:
+        """Numbers (1-based) of nodes, which value is not equal to given one."""
+        code = self._category_codes.get(value)
+        if code is None:
+            return list(range(1, len(self) + 1))
+        return list(compress(range(1, len(self) + 1), map(code.__ne__, self.codes)))
+
+
+class Projection:
+    """ Columns of projected nodes by field name """
+    def __init__(self, fields: Dict[str, FieldSpec]):
+        self.fields = fields
+        self.columns: Dict[str, object] = {
+            name: IntColumn() if spec.type == TYPE_INT else CategoricalColumn() for name, spec in fields.items()
+        }
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
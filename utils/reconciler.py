@@ -0,0 +1,268 @@
+"""
+Reconciliation of PacketEPD 'ED101' documents with ED807 'BICDirectoryEntry' elements.
+
+Both sides are projected once into compact records and then joined:
+    - positional mode: ED101 №k is filled from ED807 entries №2k-1 (payer) and №2k (payee);
+    - BIC mode: ED101 payer and payee are looked up in ED807 by their 'BIC'.
+ED101 stream can be split into chunks, which are reconciled in parallel worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+from utils.check import check_error
+from utils.ed807_index import ED807Index
+from utils.instrumentation import instrumented
+from utils.logger import process_pool_context
+from utils.xml import XMLObject
+
+ED101 = "ED101"
+PAYER = "Payer"
+PAYEE = "Payee"
+BANK = "Bank"
+BIC = "BIC"
+CORRESPACC = "CorrespAcc"
+SUM = "Sum"
+ACCDOC = "AccDoc"
+ACCDOCNO = "AccDocNo"
+ACCDOCDATE = "AccDocDate"
+NAME = "Name"
+
+BICDIRECTORYENTRY = "BICDirectoryEntry"
+PARTICIPANTINFO = "ParticipantInfo"
+ACCOUNT = "Account"
+ACCOUNTS = "Accounts"
+PTTYPE = "PtType"
+DATEIN = "DateIn"
+RGN = "Rgn"
+NAMEP = "NameP"
+
+MODE_POSITIONAL = "positional"
+MODE_BIC = "bic"
+
+
+class ED101Record(NamedTuple):
+    """ Fields of 'ED101' used for reconciliation """
+    number: int # 1-based position in PacketEPD
+    sum: Optional[str]
+    acc_doc_no: Optional[str]
+    acc_doc_date: Optional[str]
+    payer_name: Optional[str]
+    payer_bic: Optional[str]
+    payer_corresp_acc: Optional[str]
+    payee_name: Optional[str]
+    payee_bic: Optional[str]
+    payee_corresp_acc: Optional[str]
+
+
+class DirectoryRecord(NamedTuple):
+    """ Fields of ED807 'BICDirectoryEntry' used for reconciliation """
+    position: int # 1-based position in ED807
+    bic: Optional[str]
+    pt_type: Optional[str]
+    date_in: Optional[str]
+    rgn: Optional[str]
+    name_p: Optional[str]
+    has_accounts: bool
+    account: Optional[str] # 'Account' of the first 'Accounts' element
+
+
+@dataclass
+class ReconciliationResult:
+    errors: List[str] = field(default_factory=list)
+    stopped: bool = False # True if reconciliation stopped on an error, after which further checks make no sense
+
+
+@instrumented("model", nodes=len)
+def project_ed101(xml_tree: XMLObject) -> List[ED101Record]:
+    """Project all 'ED101' of PacketEPD into records in one pass (works in streaming mode too)."""
+    records = []
+    for number, ed101 in enumerate(xml_tree.iter_nodes(ED101), start=1):
+        acc_doc = xml_tree.find(ACCDOC, elem=ed101)
+        payer = xml_tree.find(PAYER, elem=ed101)
+        payee = xml_tree.find(PAYEE, elem=ed101)
+        payer_bank = xml_tree.find(BANK, elem=payer) if payer is not None else None
+        payee_bank = xml_tree.find(BANK, elem=payee) if payee is not None else None
+        records.append(ED101Record(
+            number=number,
+            sum=ed101.get(SUM),
+            acc_doc_no=acc_doc.get(ACCDOCNO) if acc_doc is not None else None,
+            acc_doc_date=acc_doc.get(ACCDOCDATE) if acc_doc is not None else None,
+            payer_name=xml_tree.find_text(NAME, elem=payer) if payer is not None else None,
+            payer_bic=payer_bank.get(BIC) if payer_bank is not None else None,
+            payer_corresp_acc=payer_bank.get(CORRESPACC) if payer_bank is not None else None,
+            payee_name=xml_tree.find_text(NAME, elem=payee) if payee is not None else None,
+            payee_bic=payee_bank.get(BIC) if payee_bank is not None else None,
+            payee_corresp_acc=payee_bank.get(CORRESPACC) if payee_bank is not None else None,
+        ))
+    return records
+
+
+def _directory_record(position: int, bic: str, participant_info: Optional[dict], accounts: List[dict]) -> DirectoryRecord:
+    participant_info = participant_info or {}
+    return DirectoryRecord(
+        position=position,
+        bic=bic,
+        pt_type=participant_info.get(PTTYPE),
+        date_in=participant_info.get(DATEIN),
+        rgn=participant_info.get(RGN),
+        name_p=participant_info.get(NAMEP),
+        has_accounts=len(accounts) > 0,
+        account=accounts[0].get(ACCOUNT) if len(accounts) > 0 else None,
+    )
+
+
+def project_ed807(source: Union[ED807Index, XMLObject]) -> List[DirectoryRecord]:
+    """Project all 'BICDirectoryEntry' of ED807 (from its index or XML) into records in document order."""
+    if isinstance(source, ED807Index):
+        return [_directory_record(entry.position, entry.bic, entry.participant_info, entry.accounts) for entry in source.entries()]
+    records = []
+    for position, entry in enumerate(source.iter_nodes(BICDIRECTORYENTRY), start=1):
+        participant_info = source.find(PARTICIPANTINFO, elem=entry)
+        accounts = [dict(acc.attrib) for acc in source.find_all(ACCOUNTS, elem=entry)]
+        records.append(_directory_record(position, entry.get(BIC), dict(participant_info.attrib) if participant_info is not None else None, accounts))
+    return records
+
+
+def _check_payer(ed101: ED101Record, entry: DirectoryRecord, errors: list, entry_name: str):
+    n = ed101.number
+    check_error(ed101.acc_doc_no, entry.pt_type, errors,
+        f"ED101 {n} element's {ACCDOCNO} should be equal to {entry_name}'s {PTTYPE}!\n" +
+        f"ED101 val = {ed101.acc_doc_no}, ED807 val = {entry.pt_type}"
+    )
+    check_error(ed101.acc_doc_date, entry.date_in, errors,
+        f"ED101 {n} element's {ACCDOCDATE} should be equal to {entry_name}'s {DATEIN}!\n" +
+        f"ED101 val = {ed101.acc_doc_date}, ED807 val = {entry.date_in}"
+    )
+    check_error(ed101.sum, entry.rgn, errors,
+        f"ED101 {n} element's {SUM} should be equal to {entry_name}'s {RGN}!\n" +
+        f"ED101 val = {ed101.sum}, ED807 val = {entry.rgn}"
+    )
+    check_error(ed101.payer_name, entry.name_p, errors,
+        f"ED101 {n} element's payer {NAME} should be equal to {entry_name}'s {NAMEP}!\n" +
+        f"ED101 val = {ed101.payer_name}, ED807 val = {entry.name_p}"
+    )
+    check_error(ed101.payer_bic, entry.bic, errors,
+        f"ED101 {n} element's payer {BIC} should be equal to {entry_name}'s {BIC}!\n" +
+        f"ED101 val = {ed101.payer_bic}, ED807 val = {entry.bic}"
+    )
+    check_error(ed101.payer_corresp_acc, entry.account, errors,
+        f"ED101 {n} element's payer {CORRESPACC} should be equal to {entry_name}'s {ACCOUNT}!\n" +
+        f"ED101 val = {ed101.payer_corresp_acc}, ED807 val = {entry.account}"
+    )
+
+
+def _check_payee(ed101: ED101Record, entry: DirectoryRecord, errors: list, entry_name: str):
+    n = ed101.number
+    check_error(ed101.payee_name, entry.name_p, errors,
+        f"ED101 {n} element's payee {NAME} should be equal to {entry_name}'s {NAMEP}!\n" +
+        f"ED101 val = {ed101.payee_name}, ED807 val = {entry.name_p}"
+    )
+    check_error(ed101.payee_bic, entry.bic, errors,
+        f"ED101 {n} element's payee {BIC} should be equal to {entry_name}'s {BIC}!\n" +
+        f"ED101 val = {ed101.payee_bic}, ED807 val = {entry.bic}"
+    )
+    check_error(ed101.payee_corresp_acc, entry.account, errors,
+        f"ED101 {n} element's payee {CORRESPACC} should be equal to {entry_name}'s {ACCOUNT}!\n" +
+        f"ED101 val = {ed101.payee_corresp_acc}, ED807 val = {entry.account}"
+    )
+
+
+def _reconcile_positional_chunk(ed101_records: List[ED101Record], entries: List[DirectoryRecord]) -> ReconciliationResult:
+    """
+    Reconcile chunk of pairs: `entries` are ED807 records for payers and payees of given `ed101_records`
+    (two per ED101, in order). If there are more entry pairs than ED101 records, reconciliation stops.
+    """
+    result = ReconciliationResult()
+    for pair_num in range(len(entries) // 2):
+        entry_for_payer, entry_for_payee = entries[2 * pair_num], entries[2 * pair_num + 1]
+        for entry in (entry_for_payer, entry_for_payee):
+            if not entry.has_accounts:
+                result.errors.append(f"ED807 {BICDIRECTORYENTRY} at position {entry.position} should contain {ACCOUNTS} element!")
+                result.stopped = True
+                return result
+        if pair_num >= len(ed101_records):
+            result.errors.append(f"ED101 elements ended, but size should be enough to cover all {BICDIRECTORYENTRY} elements!")
+            result.stopped = True
+            return result
+        ed101 = ed101_records[pair_num]
+        _check_payer(ed101, entry_for_payer, result.errors, f"ED807 {entry_for_payer.position} element")
+        _check_payee(ed101, entry_for_payee, result.errors, f"ED807 {entry_for_payee.position} element")
+    return result
+
+
+def _reconcile_bic_chunk(ed101_records: List[ED101Record], entries_by_bic: Dict[str, DirectoryRecord]) -> ReconciliationResult:
+    result = ReconciliationResult()
+    for ed101 in ed101_records:
+        for side, bic, check_side in ((PAYER, ed101.payer_bic, _check_payer), (PAYEE, ed101.payee_bic, _check_payee)):
+            entry = entries_by_bic.get(bic)
+            if entry is None:
+                result.errors.append(f"ED101 {ed101.number} element's {side.lower()} {BIC} '{bic}' is not found in ED807!")
+                continue
+            if not entry.has_accounts:
+                result.errors.append(f"ED807 {BICDIRECTORYENTRY} at position {entry.position} should contain {ACCOUNTS} element!")
+            check_side(ed101, entry, result.errors, f"ED807 element with {BIC} '{bic}'")
+    return result
+
+
+def _positional_chunks(ed101_records: List[ED101Record], entries: List[DirectoryRecord], chunk_size: int) -> Iterable[Tuple]:
+    if len(entries) % 2 == 1:
+        entries = entries[:-1] # Если для последнего ED101 нет записи для формирования получателя (ed:Payee), то игнорируем – не добавляем данный полуфабрикат ED101 в пакет PacketEPD
+    for start in range(0, len(entries) // 2, chunk_size):
+        yield ed101_records[start:start + chunk_size], entries[2 * start:2 * (start + chunk_size)]
+
+
+def _bic_chunks(ed101_records: List[ED101Record], entries: Union[List[DirectoryRecord], ED807Index], chunk_size: int) -> Iterable[Tuple]:
+    entries_by_bic = {}
+    if not isinstance(entries, ED807Index):
+        for entry in entries:
+            entries_by_bic.setdefault(entry.bic, entry)
+    for start in range(0, len(ed101_records), chunk_size):
+        chunk = ed101_records[start:start + chunk_size]
+        # Each worker gets only entries, which are needed for its chunk
+        chunk_entries = {}
+        for bic in set(bic for ed101 in chunk for bic in (ed101.payer_bic, ed101.payee_bic)):
+            if isinstance(entries, ED807Index):
+                entry = entries.get(bic)
+                entry = _directory_record(entry.position, entry.bic, entry.participant_info, entry.accounts) if entry is not None else None
+            else:
+                entry = entries_by_bic.get(bic)
+            if entry is not None:
+                chunk_entries[bic] = entry
+        yield chunk, chunk_entries
+
+
+@instrumented("check")
+def reconcile(ed101_records: List[ED101Record], entries: Union[List[DirectoryRecord], ED807Index], mode: str = MODE_POSITIONAL,
+              workers: int = 1, chunk_size: int = 10000, errors: list = None) -> ReconciliationResult:
+    """
+    Reconcile ED101 records with ED807 records (or ED807 index for BIC mode).
+
+    ED101 stream is split into chunks of `chunk_size` documents, chunks are processed in `workers` processes.
+    Errors are merged in document order; in positional mode everything after the first stopping error is dropped,
+    so result does not depend on amount of workers. Errors of chunks are added to `errors` (e.g. 'FailureReport',
+    so only errors of one chunk are kept in memory at once), by default to a new list.
+    """
+    if mode == MODE_POSITIONAL:
+        if isinstance(entries, ED807Index):
+            entries = project_ed807(entries)
+        chunk_func, chunks = _reconcile_positional_chunk, _positional_chunks(ed101_records, entries, chunk_size)
+    elif mode == MODE_BIC:
+        chunk_func, chunks = _reconcile_bic_chunk, _bic_chunks(ed101_records, entries, chunk_size)
+    else:
+        raise ValueError(f"Unknown reconciliation mode: '{mode}'")
+
+    if workers == 1:
+        return _merge((chunk_func(*chunk) for chunk in chunks), errors)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as executor:
+        futures = [executor.submit(chunk_func, *chunk) for chunk in chunks]
+        return _merge((future.result() for future in futures), errors)
+
+
+def _merge(chunk_results: Iterable[ReconciliationResult], errors: list = None) -> ReconciliationResult:
+    result = ReconciliationResult(errors=errors if errors is not None else [])
+    for chunk_result in chunk_results:
+        result.errors.extend(chunk_result.errors)
+        if chunk_result.stopped:
+            result.stopped = True
+            break
+    return result
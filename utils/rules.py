@@ -0,0 +1,245 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from lxml import etree
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from utils.logger import logger
+import json
+import os
+
+# Structural rules for XML nodes. Rules are registered in `XMLObject.register_rule` (by hand or from rules DSL
+# in `rules.json`) and then all rules for the same nodes path are compiled into one function by `compile_rules`
+# and evaluated in one traversal by `XMLObject.evaluate_rules`.
+
+
+class NodeRule(ABC):
+    """ Base class for rule, which is checked on each node found by some path """
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    @abstractmethod
+    def description(self) -> str:
+        ...
+
+    @abstractmethod
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        """Return True if node (with 1-based number `node_num` among found nodes) satisfies the rule."""
+
+
+class RequiredAttribute(NodeRule):
+    """ Node should contain given attribute """
+    def __init__(self, attrib_name: str, name: str = None):
+        super().__init__(name or f"required_attribute_{attrib_name}")
+        self.attrib_name = attrib_name
+
+    @property
+    def description(self) -> str:
+        return f"contain attribute '{self.attrib_name}'"
+
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        return node.get(self.attrib_name) is not None
+
+
+class OneOfAttributes(NodeRule):
+    """ Node should contain exactly one of given attributes """
+    def __init__(self, *attrib_options: str, name: str = None):
+        super().__init__(name or f"one_of_attributes_{'_'.join(attrib_options)}")
+        self.attrib_options = attrib_options
+
+    @property
+    def description(self) -> str:
+        return f"contain only one attribute of '{self.attrib_options}'"
+
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        found_options = 0
+        for cur_attrib in self.attrib_options:
+            if node.get(cur_attrib) is not None:
+                found_options += 1
+                if found_options > 1:
+                    break
+        return found_options == 1
+
+
+class RequiredChild(NodeRule):
+    """ Node should contain child node with given name (without namespace) """
+    def __init__(self, child_node_name: str, name: str = None):
+        super().__init__(name or f"required_child_{child_node_name}")
+        self.child_node_name = child_node_name
+
+    @property
+    def description(self) -> str:
+        return f"contain child node '{self.child_node_name}'"
+
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        for child in node:
+            if isinstance(child.tag, str) and child.tag.rpartition('}')[2] == self.child_node_name:
+                return True
+        return False
+
+
+class AttributeEquals(NodeRule):
+    """ Node attribute should be equal to expected value """
+    def __init__(self, attrib_name: str, expected_value: str, name: str = None):
+        super().__init__(name or f"attribute_{attrib_name}_equals_{expected_value}")
+        self.attrib_name = attrib_name
+        self.expected_value = expected_value
+
+    @property
+    def description(self) -> str:
+        return f"have attribute '{self.attrib_name}' equal to '{self.expected_value}'"
+
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        return node.get(self.attrib_name) == self.expected_value
+
+
+class RequiredChildAttribute(NodeRule):
+    """ Node should contain child by given path (ElementPath, relative to node) with given attribute """
+    def __init__(self, child_path: str, attrib_name: str, namespaces: dict = None, name: str = None):
+        super().__init__(name or f"required_attribute_{child_path.replace('/', '_')}_{attrib_name}")
+        self.child_path = child_path
+        self.attrib_name = attrib_name
+        self.namespaces = namespaces
+
+    @property
+    def description(self) -> str:
+        return f"contain attribute '{self.attrib_name}' in child '{self.child_path}'"
+
+    def check(self, node: etree._Element, node_num: int) -> bool:
+        child = node.find(self.child_path, namespaces=self.namespaces)
+        return child is not None and child.get(self.attrib_name) is not None
+
+
+class _CodegenContext:
+    """ Names shared by generated validator code: constants and helpers are passed to it as globals """
+    def __init__(self):
+        self.globals: dict = {}
+        self.needs_child_names = False
+        self.child_lookups: Dict[tuple, Tuple[str, str]] = {} # (child path, namespaces) -> (local name, lookup expression)
+
+    def constant(self, value) -> str:
+        name = f"const_{len(self.globals)}"
+        self.globals[name] = value
+        return name
+
+    def child(self, child_path: str, namespaces: Optional[dict]) -> str:
+        """Local name of child found by path, it is looked up once per node for all rules of the same child."""
+        key = (child_path, tuple(sorted((namespaces or {}).items())))
+        if key not in self.child_lookups:
+            lookup = f"node.find({self.constant(child_path)}, namespaces={self.constant(namespaces)})"
+            self.child_lookups[key] = (f"child_{len(self.child_lookups)}", lookup)
+        return self.child_lookups[key][0]
+
+
+def int_or_none(value) -> Optional[int]:
+    """Integer value of attribute or node text, None if it is missing or not a number."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rule_expression(rule: NodeRule, ctx: _CodegenContext) -> str:
+    """Python expression, which is True if `node` (number `node_num`) satisfies rule. `get` is bound `node.get`."""
+    rule_type = type(rule)
+    if rule_type is RequiredAttribute:
+        return f"get({ctx.constant(rule.attrib_name)}) is not None"
+    if rule_type is OneOfAttributes:
+        present = " + ".join(f"(get({ctx.constant(attrib)}) is not None)" for attrib in rule.attrib_options)
+        return f"({present or '0'}) == 1"
+    if rule_type is RequiredChild:
+        ctx.needs_child_names = True
+        return f"{ctx.constant(rule.child_node_name)} in child_names"
+    if rule_type is AttributeEquals:
+        return f"get({ctx.constant(rule.attrib_name)}) == {ctx.constant(rule.expected_value)}"
+    if rule_type is RequiredChildAttribute:
+        child = ctx.child(rule.child_path, rule.namespaces)
+        return f"{child} is not None and {child}.get({ctx.constant(rule.attrib_name)}) is not None"
+    # Any other rule is called as is
+    return f"{ctx.constant(rule)}.check(node, node_num)"
+
+
+def compile_rules(rules: List[NodeRule]) -> Callable[[Iterable[etree._Element], int], Tuple[int, List[List[int]]]]:
+    """
+    Compile rules into one specialized function, which checks all of them in one pass over nodes.
+
+    Known rule types are inlined as expressions (attributes are read via bound `node.get`, child names are collected
+    once per node for all child rules and each child path is looked up once per node for all its attributes),
+    other rules are called by their `check`.
+    Function takes nodes and number of the first node and returns (*amount of nodes*, *list of bad node numbers per rule*).
+    """
+    ctx = _CodegenContext()
+    checks = [f"        if not ({_rule_expression(rule, ctx)}):\n            append_{i}(node_num)" for i, rule in enumerate(rules)]
+    lines = ["def validate(nodes, start):"]
+    lines += [f"    bad_{i} = []\n    append_{i} = bad_{i}.append" for i in range(len(rules))]
+    lines += ["    nodes_total = 0",
+              "    for node_num, node in enumerate(nodes, start):",
+              "        nodes_total += 1",
+              "        get = node.get"]
+    if ctx.needs_child_names:
+        lines.append("        child_names = {child.tag.rpartition('}')[2] for child in node if isinstance(child.tag, str)}")
+    lines += [f"        {name} = {lookup}" for name, lookup in ctx.child_lookups.values()]
+    lines += checks
+    lines.append(f"    return nodes_total, [{', '.join(f'bad_{i}' for i in range(len(rules)))}]")
+    namespace = dict(ctx.globals)
+    exec(compile("\n".join(lines), "<compiled rules>", "exec"), namespace)
+    return namespace["validate"]
+
+
+# Rules DSL: per document kind, nodes path -> list of rule specs, e.g.
+#   {"balance": {"Ballance/ns:Oper": [{"name": "operation_date", "rule": "required_attribute", "attrib": "date"}]}}
+# String values starting with '$' are references to context: '$header.EDDate', '$config.ed807_xml.header_mandatory_attributes'.
+# Rule with list in 'attrib' is expanded into one rule per attribute named '<name>_<attrib>'.
+ROOT_PATH = "." # Nodes path of the root element (document header)
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules.json")
+
+RULE_TYPES: Dict[str, Callable[..., NodeRule]] = {
+    "required_attribute": lambda spec, namespaces: RequiredAttribute(spec["attrib"], name=spec.get("name")),
+    "one_of_attributes": lambda spec, namespaces: OneOfAttributes(*spec["attribs"], name=spec.get("name")),
+    "required_child": lambda spec, namespaces: RequiredChild(spec["child"], name=spec.get("name")),
+    "attribute_equals": lambda spec, namespaces: AttributeEquals(spec["attrib"], spec["value"], name=spec.get("name")),
+    "required_child_attribute": lambda spec, namespaces: RequiredChildAttribute(
+        _qualify_child_path(spec["child"], namespaces), spec["attrib"], namespaces=namespaces, name=spec.get("name")
+    ),
+}
+
+
+def _qualify_child_path(path: str, namespaces: Optional[dict]) -> str:
+    if namespaces:
+        return "/".join(step if step.startswith("ns:") else "ns:" + step for step in path.split("/"))
+    return path
+
+
+def _resolve(value, context: dict):
+    if not isinstance(value, str) or not value.startswith("$"):
+        return value
+    resolved = context
+    for key in value[1:].split("."):
+        if not isinstance(resolved, dict) or key not in resolved:
+            raise LookupError(f"Reference '{value}' is not found in rules context")
+        resolved = resolved[key]
+    return resolved
+
+
+@lru_cache(maxsize=None)
+def load_rules_config(path: str = DEFAULT_RULES_PATH) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_rules(rule_specs: List[dict], context: dict, namespaces: dict = None) -> List[NodeRule]:
+    """Build rules from DSL specs. Rules with references, which are missing in context, are skipped."""
+    rules = []
+    for spec in rule_specs:
+        if spec["rule"] not in RULE_TYPES:
+            raise ValueError(f"Unknown rule type '{spec['rule']}', expected one of {sorted(RULE_TYPES)}")
+        try:
+            spec = {key: _resolve(value, context) for key, value in spec.items()}
+        except LookupError as e:
+            logger.info("Rule '%s' is skipped: %s", spec.get("name", spec["rule"]), e)
+            continue
+        if spec["rule"] == "required_attribute" and isinstance(spec["attrib"], list):
+            rules += [RULE_TYPES["required_attribute"](dict(spec, attrib=attrib, name=f"{spec.get('name', 'required_attribute')}_{attrib}"), namespaces)
+                      for attrib in spec["attrib"]]
+        else:
+            rules.append(RULE_TYPES[spec["rule"]](spec, namespaces))
+    return rules
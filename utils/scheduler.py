@@ -0,0 +1,94 @@
+"""
+Scheduler of checks of one document by their estimated cost and prerequisites.
+
+Each `Check` declares cost and names of checks, which should pass before it (e.g. reconciliation with ED807
+only if ED101 have all requisites). Ready checks are run one by one from the cheapest one: checks are
+CPU-bound Python code, so threads would not run them faster. Check, which prerequisite failed or was skipped,
+is skipped without running, and with `fail_fast` the first failed check skips all remaining checks. So on bad input expensive checks are not paid for.
+Exception of a check (e.g. on malformed document) fails only this check: it is recorded in its outcome
+and independent checks are still run.
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from utils.logger import logger
+import time
+import traceback
+
+COST_HEADER = 1 # Reads only root attributes
+COST_NODES = 10 # One pass over document nodes
+COST_MODEL = 50 # Builds model of all document nodes
+COST_EXPENSIVE = 100 # Joins with other documents, e.g. reconciliation with ED807
+
+
+@dataclass
+class Check:
+    name: str
+    func: Callable[[], tuple] # Returns tuple of (*is ok*, *details*), same as check_* methods of XML objects
+    cost: float = COST_NODES
+    requires: Tuple[str, ...] = ()
+
+
+@dataclass
+class CheckOutcome:
+    ok: bool
+    details: object
+    skipped: bool = False
+    seconds: float = 0.0
+    error: Optional[str] = None # Exception raised by check, it is failed then
+
+
+class CheckScheduler:
+    def __init__(self, checks: Iterable[Check], fail_fast: bool = False):
+        self.checks: Dict[str, Check] = {check.name: check for check in checks}
+        self.fail_fast = fail_fast
+        self._validate()
+
+    def _validate(self):
+        """Check that all prerequisites are declared and there are no cycles."""
+        for check in self.checks.values():
+            unknown = [name for name in check.requires if name not in self.checks]
+            if unknown:
+                raise ValueError(f"Check '{check.name}' requires unknown checks: {unknown}")
+        resolved = set()
+        remaining = dict(self.checks)
+        while remaining:
+            ready = [name for name, check in remaining.items() if resolved.issuperset(check.requires)]
+            if not ready:
+                raise ValueError(f"Checks have cyclic prerequisites: {sorted(remaining)}")
+            resolved.update(ready)
+            for name in ready:
+                del remaining[name]
+
+    @staticmethod
+    def _run(check: Check) -> CheckOutcome:
+        started = time.perf_counter()
+        try:
+            ok, details = check.func()
+        except Exception as e:
+            logger.info("Check '%s' raised %r", check.name, e)
+            return CheckOutcome(False, None, seconds=time.perf_counter() - started,
+                                error="".join(traceback.format_exception_only(e)).strip())
+        return CheckOutcome(ok=bool(ok), details=details, seconds=time.perf_counter() - started)
+
+    def run(self) -> Dict[str, CheckOutcome]:
+        """Run all checks, outcomes are returned in order of declaration."""
+        outcomes: Dict[str, CheckOutcome] = {}
+        pending = sorted(self.checks.values(), key=lambda check: check.cost) # Stable: equal costs keep declaration order
+        failed_check: Optional[str] = None
+        while pending:
+            # The cheapest check, which prerequisites are done (there are no cycles, so there is always one)
+            check = next(check for check in pending if all(name in outcomes for name in check.requires))
+            pending.remove(check)
+            not_passed = [name for name in check.requires if not outcomes[name].ok]
+            if failed_check is not None and self.fail_fast:
+                outcomes[check.name] = CheckOutcome(False, f"Skipped after failure of '{failed_check}'", skipped=True)
+            elif not_passed:
+                outcomes[check.name] = CheckOutcome(False, f"Prerequisites did not pass: {not_passed}", skipped=True)
+            else:
+                outcome = outcomes[check.name] = self._run(check)
+                if not outcome.ok and failed_check is None:
+                    failed_check = check.name
+        skipped = sum(1 for outcome in outcomes.values() if outcome.skipped)
+        if skipped:
+            logger.info("Skipped %s of %s checks after failed checks", skipped, len(outcomes))
+        return {name: outcomes[name] for name in self.checks}
@@ -0,0 +1,108 @@
+from utils.logger import logger
+from utils.ed807_index import file_sha256
+from typing import Any, Callable
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODE_DIRS = ("model", "utils")
+CODE_FILES = (
+    "conftest.py", # Fixtures, which build snapshot data
+    "rules.json", # Rules of structure checks, results of which are stored in snapshots
+)
+
+
+def code_fingerprint() -> str:
+    """Fingerprint of project code, which builds snapshot data: snapshot is rebuilt when any of these files changes."""
+    sha = hashlib.sha256()
+    for code_dir in CODE_DIRS:
+        for path in sorted(glob.glob(os.path.join(PROJECT_DIR, code_dir, "*.py"))):
+            stat = os.stat(path)
+            sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    for path in (os.path.join(PROJECT_DIR, name) for name in CODE_FILES):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return sha.hexdigest()
+
+
+class SnapshotCache:
+    """
+    Cache of data extracted from input files (e.g. parsed models), which lives between test sessions.
+
+    Snapshot of each (source file, kind, params) is a pickle file with metadata header: source path, size,
+    mtime and content hash, and code fingerprint. Snapshot is used if size and mtime of source are the same,
+    or if only mtime changed but content hash is the same. Otherwise data is built again and snapshot is replaced.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir: str = ".cache/snapshots"):
+        self.cache_dir = cache_dir
+        self.code_fingerprint = code_fingerprint()
+
+    def _snapshot_path(self, source_path: str, kind: str, params: tuple) -> str:
+        key = hashlib.sha256(repr((os.path.abspath(source_path), kind, params)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{kind}-{key[:32]}.pickle")
+
+    def _source_meta(self, source_path: str, content_hash: str = None) -> dict:
+        stat = os.stat(source_path)
+        return {
+            "format_version": self.FORMAT_VERSION,
+            "code_fingerprint": self.code_fingerprint,
+            "source_path": os.path.abspath(source_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": content_hash,
+        }
+
+    def _is_fresh(self, stored_meta: dict, source_path: str) -> bool:
+        current_meta = self._source_meta(source_path)
+        for key in ("format_version", "code_fingerprint", "source_path", "size"):
+            if stored_meta.get(key) != current_meta[key]:
+                return False
+        if stored_meta.get("mtime_ns") == current_meta["mtime_ns"]:
+            return True
+        # File was touched or rewritten with the same size: check its content
+        return stored_meta.get("sha256") == file_sha256(source_path)
+
+    def load(self, source_path: str, kind: str, params: tuple = ()) -> Any:
+        """Load snapshot data, raises KeyError if there is no fresh snapshot."""
+        snapshot_path = self._snapshot_path(source_path, kind, params)
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, "rb") as f:
+                    stored_meta = pickle.load(f) # Header is read first, so stale data is not unpickled at all
+                    if self._is_fresh(stored_meta, source_path):
+                        logger.info("Using '%s' snapshot '%s' of '%s'", kind, snapshot_path, source_path)
+                        return pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+                logger.warning("Could not read snapshot '%s': %r", snapshot_path, e)
+        raise KeyError(f"No fresh '{kind}' snapshot of '{source_path}'")
+
+    def store(self, source_path: str, kind: str, data: Any, params: tuple = ()):
+        snapshot_path = self._snapshot_path(source_path, kind, params)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = self._source_meta(source_path, content_hash=file_sha256(source_path))
+        # Write to temporary file and move it in place, so concurrent pytest workers never read half-written snapshot
+        fd, tmp_path = tempfile.mkstemp(suffix=".pickle.tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info("Stored '%s' snapshot '%s' of '%s'", kind, snapshot_path, source_path)
+
+    def load_or_build(self, source_path: str, kind: str, builder: Callable[[], Any], params: tuple = ()) -> Any:
+        """Load data from fresh snapshot or build it with `builder` and store new snapshot."""
+        try:
+            return self.load(source_path, kind, params)
+        except KeyError:
+            data = builder()
+            self.store(source_path, kind, data, params)
+            return data
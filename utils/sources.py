@@ -0,0 +1,141 @@
+"""
+Input sources of XML documents: plain or compressed (gzip, zip with one XML file) files, file-like objects
+and in-memory or memory-mapped buffers.
+
+Compressed and in-memory sources are read in fixed-size chunks and fed to lxml feed parsers, so neither
+decompressed copy on disk nor whole-file copy in memory is needed. Plain files are given to lxml by path.
+File-like object is read from its beginning on each pass if it is seekable. Not seekable stream (pipe, socket)
+can be read only once, so for several passes it is spooled to temporary file by `seekable_source`.
+"""
+from contextlib import contextmanager
+from lxml import etree
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
+import gzip
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+
+Source = Union[str, os.PathLike, BinaryIO, bytes, bytearray, memoryview, mmap.mmap]
+
+
+class _BufferReader(io.RawIOBase):
+    """ Read-only file-like view of bytes-like buffer, chunks are copied only when read """
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._offset + size)
+        chunk = bytes(self._view[self._offset:end])
+        self._offset = end
+        return chunk
+
+
+def is_path(source: Source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+
+def source_name(source: Source) -> str:
+    """Name of source for messages: path of file or name of file object."""
+    if is_path(source):
+        return os.fspath(source)
+    name = getattr(source, "name", None)
+    return name if isinstance(name, str) else f"<{type(source).__name__}>"
+
+
+def plain_path(source: Source) -> Optional[str]:
+    """Path of source, if it is not compressed file, which can be parsed by lxml directly."""
+    if not is_path(source):
+        return None
+    path = os.fspath(source)
+    with open(path, "rb") as f:
+        magic = f.read(len(ZIP_MAGIC))
+    return path if not (magic.startswith(GZIP_MAGIC) or magic == ZIP_MAGIC) else None
+
+
+def seekable_source(source: Source, chunk_size: int = CHUNK_SIZE) -> Source:
+    """Source, which can be read several times: not seekable stream is copied by chunks to temporary file."""
+    if is_path(source) or not hasattr(source, "read"):
+        return source
+    seekable = getattr(source, "seekable", None)
+    if seekable is not None and seekable():
+        return source
+    spool = tempfile.TemporaryFile() # Removed when closed or garbage collected with its XML object
+    shutil.copyfileobj(source, spool, chunk_size)
+    spool.seek(0)
+    return spool
+
+
+def _zip_member(archive: zipfile.ZipFile, path: str) -> str:
+    members = [info.filename for info in archive.infolist() if not info.is_dir()]
+    xml_members = [name for name in members if name.lower().endswith(".xml")] or members
+    if len(xml_members) != 1:
+        raise ValueError(f"Archive '{path}' should contain exactly one XML file, found: {xml_members}")
+    return xml_members[0]
+
+
+@contextmanager
+def open_binary(source: Source) -> Iterator[BinaryIO]:
+    """Open source as binary file object, decompressing gzip and zip files on the fly."""
+    if is_path(source):
+        path = os.fspath(source)
+        with open(path, "rb") as raw:
+            magic = raw.read(len(ZIP_MAGIC))
+            raw.seek(0)
+            if magic.startswith(GZIP_MAGIC):
+                with gzip.GzipFile(fileobj=raw) as f:
+                    yield f
+            elif magic == ZIP_MAGIC:
+                with zipfile.ZipFile(raw) as archive, archive.open(_zip_member(archive, path)) as f:
+                    yield f
+            else:
+                yield raw
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield _BufferReader(source)
+    elif hasattr(source, "read"):
+        try:
+            source.seek(0)
+        except (AttributeError, OSError, ValueError):
+            pass # Not seekable stream is read from the current position
+        yield source
+    else:
+        raise TypeError(f"Unsupported XML source: {type(source).__name__}")
+
+
+def iter_chunks(source: Source, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open_binary(source) as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def parse_tree(source: Source, encoding: str = None, chunk_size: int = CHUNK_SIZE) -> etree._ElementTree:
+    """Parse whole document by feeding chunks of source to parser."""
+    parser = etree.XMLParser(encoding=encoding)
+    for chunk in iter_chunks(source, chunk_size):
+        parser.feed(chunk)
+    return etree.ElementTree(parser.close())
+
+
+def iterparse(source: Source, events: Tuple[str, ...] = ("end",), encoding: str = None,
+              chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, etree._Element]]:
+    """Same as `etree.iterparse`, but for any source: chunks are fed to `XMLPullParser` and its events are yielded."""
+    path = plain_path(source)
+    if path is not None:
+        yield from etree.iterparse(path, events=events, encoding=encoding)
+        return
+    parser = etree.XMLPullParser(events=events, encoding=encoding)
+    for chunk in iter_chunks(source, chunk_size):
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
@@ -1,47 +1,189 @@
 from lxml import etree
 from utils.logger import logger
-from typing import List, Set
+from utils.instrumentation import instrumentation, instrumented
+from utils.projection import FieldSpec, Projection
+from utils.rules import NodeRule, RequiredAttribute, OneOfAttributes, RequiredChild, compile_rules, build_rules, load_rules_config, ROOT_PATH, int_or_none
+from utils import sources
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import os
 
+
+@lru_cache(maxsize=1024)
+def _compile_path(path: str, namespace: Optional[str], first_only: bool) -> etree.XPath:
+    if namespace is not None and not path.startswith("ns:"):
+        path = "ns:" + path
+    if first_only:
+        path = f"({path})[1]"
+    return etree.XPath(path, namespaces={"ns": namespace} if namespace is not None else None)
+
+
 class XMLObject:
-    """ Class for abstract XML doc with basic operations """
-    def __init__(self, xml_path: str, namespace: str=None, encoding: str ='utf-8'):
-        self.xml_path: str = xml_path
-        self.tree: etree._ElementTree = self._load_xml_tree(encoding)
+    """
+    Class for abstract XML doc with basic operations
+
+    In streaming mode (`streaming=True`) the document is not kept in memory: nodes are
+    read with `iterparse` by `iter_nodes` and cleared right after use.
+    Already parsed `tree` (e.g. of a document fragment) can be given instead of reading `xml_path`.
+
+    Besides path of plain XML file `xml_path` can be path of gzip or zip file, file-like object, bytes or mmap
+    (see `utils.sources`): such sources are fed to parser by chunks without decompressing to disk. Streaming mode
+    reads source once per pass, so not seekable stream (e.g. pipe) is spooled to temporary file first.
+    """
+
+    def __init__(self, xml_path: sources.Source, namespace: str=None, encoding: str ='utf-8', streaming: bool = False,
+                 tree: etree._ElementTree = None):
+        self.xml_path: str = sources.source_name(xml_path)
+        self.encoding: str = encoding
+        self.streaming: bool = streaming and tree is None
+        self.source: sources.Source = sources.seekable_source(xml_path) if self.streaming else xml_path
+        if tree is not None:
+            self.tree: etree._ElementTree = tree
+        else:
+            self.tree: etree._ElementTree = None if streaming else self._load_xml_tree(encoding)
         self.namespace: dict = {"ns": namespace} if namespace is not None else None
+        self._root_attributes: dict = None
+        self.rules: Dict[str, Dict[str, NodeRule]] = {} # nodes path -> rule name -> rule
+        self._rules_results: Dict[str, Dict[str, tuple]] = {}
+
+    def _check_xml_exists(self):
+        if sources.is_path(self.source) and not os.path.exists(self.xml_path):
+            logger.error("XML file not found: %s", self.xml_path)
+            raise FileNotFoundError(f"XML file not found: {self.xml_path}")
 
+    @instrumented("parse")
     def _load_xml_tree(self, encoding) -> etree._ElementTree:
         """Load and parse the XML file."""
-        if not os.path.exists(self.xml_path):
-            logger.error(f"XML file not found: {self.xml_path}")
-            raise FileNotFoundError(f"XML file not found: {self.xml_path}")
-        
+        self._check_xml_exists()
+        path = sources.plain_path(self.source)
+        if path is None:
+            return sources.parse_tree(self.source, encoding)
         parser = etree.XMLParser(encoding=encoding)
-        return etree.parse(self.xml_path, parser)
+        return etree.parse(path, parser)
+
+    def _get_tree(self) -> etree._ElementTree:
+        if self.tree is None:
+            raise RuntimeError(f"XML tree of '{self.xml_path}' is not loaded in streaming mode, use 'iter_nodes' instead")
+        return self.tree
+
+    def _qualify_tag(self, step: str) -> str:
+        """Convert locator step (with or without 'ns:' prefix) to tag name as it is seen by lxml."""
+        step = step.removeprefix("ns:")
+        if self.namespace:
+            return f"{{{self.namespace['ns']}}}{step}"
+        return step
 
     def get_root_attributes(self) -> dict:
-        return self.tree.getroot().attrib
+        if not self.streaming:
+            return self.tree.getroot().attrib
+        if self._root_attributes is None:
+            self._check_xml_exists()
+            for _, root in sources.iterparse(self.source, events=("start",), encoding=self.encoding):
+                self._root_attributes = dict(root.attrib)
+                break
+        return self._root_attributes
+
+    def compile_path(self, path: str, first_only: bool = False) -> etree.XPath:
+        """
+        Get precompiled XPath for locator `path` (same syntax as for `find`), which is evaluated relative to given element.
+
+        Compiled expressions are cached by (path, namespace), so they are built only once for all documents
+        of the same type (cache is bounded, so paths built at runtime do not grow it). With `first_only` expression returns only the first found element.
+        """
+        return _compile_path(path, self.namespace["ns"] if self.namespace else None, first_only)
 
+    def _context(self, elem: etree._Element) -> etree._Element:
+        # Same as for ElementTree.find: path without element is relative to the root element
+        return elem if elem is not None else self._get_tree().getroot()
+
+    # Lookups are not instrumented: they are called per node, span would cost more than lookup itself
     def find(self, path: str, elem: etree._Element = None) -> etree._Element:
-        if self.namespace:
-            path = "ns:" + path
-        if elem:
-            return elem.find(path, namespaces=self.namespace)
-        return self.tree.find(path, namespaces=self.namespace)
+        found = self.compile_path(path, first_only=True)(self._context(elem))
+        return found[0] if found else None
 
     def find_all(self, path: str, elem: etree._Element = None) -> List[etree._Element]:
-        if self.namespace:
-            path = "ns:" + path
-        if elem:
-            return elem.findall(path, namespaces=self.namespace)
-        return self.tree.findall(path, namespaces=self.namespace)
+        return self.compile_path(path)(self._context(elem))
     
     def find_text(self, path: str, default = None,  elem: etree._Element = None):
+        found = self.compile_path(path, first_only=True)(self._context(elem))
+        if not found:
+            return default
+        return found[0].text or ''
+
+    def qualify_steps(self, path: str) -> str:
+        """Add 'ns:' prefix to each step of relative path (`compile_path` adds it only to the first one)."""
         if self.namespace:
-            path = "ns:" + path
-        if elem:
-            return elem.findtext(path, default=default, namespaces=self.namespace)
-        return self.tree.findtext(path, default=default, namespaces=self.namespace)
+            return "/".join(step if step.startswith("ns:") else "ns:" + step for step in path.split("/"))
+        return path
+
+    @instrumented("query")
+    def project(self, path: str, fields: Dict[str, str]) -> Projection:
+        """
+        Read given fields of all nodes by path in one pass (streamed in streaming mode) into typed columns.
+
+        `fields` is dict of column name to field spec, e.g. {"sum": "@Sum:int", "payer_bic": "Payer/Bank/@BIC"},
+        see `utils.projection`. Each child path is looked up once per node for all its attributes.
+        """
+        specs = {name: FieldSpec.parse(spec) for name, spec in fields.items()}
+        projection = Projection(specs)
+        own_fields = []
+        child_fields: Dict[str, list] = {}
+        for name, spec in specs.items():
+            if spec.child_path is None:
+                own_fields.append((spec.attrib, projection[name].append))
+            else:
+                child_fields.setdefault(spec.child_path, []).append((spec.attrib, projection[name].append))
+        child_lookups = [(self.compile_path(self.qualify_steps(child_path), first_only=True), attribs)
+                         for child_path, attribs in child_fields.items()]
+        nodes_total = 0
+        for node in self.iter_nodes(path):
+            nodes_total += 1
+            get = node.get
+            for attrib, append in own_fields:
+                append(get(attrib))
+            for lookup, attribs in child_lookups:
+                found = lookup(node)
+                child = found[0] if found else None
+                for attrib, append in attribs:
+                    append(child.get(attrib) if child is not None else None)
+        projection.length = nodes_total
+        instrumentation.count("nodes", nodes_total)
+        return projection
+
+    def iter_nodes(self, path: str) -> Iterator[etree._Element]:
+        """
+        Iterate over nodes by given path (relative to root, same as for `find_all`), `ROOT_PATH` gives the root element.
+
+        In streaming mode each yielded node is cleared after consumer moves to the next one,
+        so it should not be stored outside of the loop. Root element is given there only with its attributes.
+        """
+        if path == ROOT_PATH:
+            yield self._get_tree().getroot() if not self.streaming else etree.Element("root", self.get_root_attributes())
+            return
+        if not self.streaming:
+            yield from self.find_all(path)
+            return
+        yield from self._stream_nodes(path)
+
+    def _stream_nodes(self, path: str) -> Iterator[etree._Element]:
+        self._check_xml_exists()
+        steps = [self._qualify_tag(step) for step in path.split("/")]
+        depth = len(steps)
+        stack = []
+        for event, elem in sources.iterparse(self.source, events=("start", "end"), encoding=self.encoding):
+            if event == "start":
+                if not stack and self._root_attributes is None: # Root attributes are known without one more pass
+                    self._root_attributes = dict(elem.attrib)
+                stack.append(elem.tag)
+                continue
+            elem_depth = len(stack) - 1 # Root element has depth 0
+            if elem_depth == depth and elem.tag == steps[-1] and stack[1:] == steps:
+                yield elem
+            stack.pop()
+            if elem_depth <= depth: # Deeper elements are freed together with their ancestor on this level
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
     
     def get_element_children_elems(self, elem: etree._Element) -> List[etree._Element]:
         return elem.getchildren()
@@ -52,6 +194,67 @@ class XMLObject:
             results = [elem.split('}')[1] for elem in results]
         return set(results)
     
+    def register_rule(self, nodes_path: str, rule: NodeRule):
+        """
+        Register structural rule for nodes by given path.
+
+        All rules registered for the same path are evaluated together in one traversal by `evaluate_rules`.
+        """
+        self.rules.setdefault(nodes_path, {})[rule.name] = rule
+        self._rules_results.pop(nodes_path, None)
+
+    def register_rules_from_config(self, rules_config: Dict[str, List[dict]], context: dict):
+        """
+        Register rules from DSL config of document kind (nodes path -> list of rule specs, see `utils.rules`).
+
+        `context` gives values for references in specs, e.g. {"header": ..., "config": ...}.
+        """
+        for nodes_path, rule_specs in rules_config.items():
+            for rule in build_rules(rule_specs, context, namespaces=self.namespace):
+                self.register_rule(nodes_path, rule)
+
+    def evaluate_rules(self, nodes_path: str) -> Dict[str, tuple]:
+        """
+        Evaluate all rules registered for nodes by given path in one traversal, results are cached until new rule is registered.
+
+        Returns dict of rule name to tuple of   (True, *len of nodes total*) if all nodes satisfy rule or
+                                                (False, *list of numbers of bad nodes*) if some nodes do not.
+        """
+        if nodes_path not in self._rules_results:
+            self._rules_results[nodes_path] = self.run_rules(nodes_path, list(self.rules.get(nodes_path, {}).values()))
+        return self._rules_results[nodes_path]
+
+    def evaluate_all_rules(self) -> Dict[str, tuple]:
+        """Evaluate rules of all registered paths, returns dict of rule name to result same as `evaluate_rules`."""
+        results = {}
+        for nodes_path in self.rules:
+            results.update(self.evaluate_rules(nodes_path))
+        return results
+
+    @instrumented("rules")
+    def run_rules(self, nodes_path: str, rules: List[NodeRule], nodes: Iterable[etree._Element] = None, start: int = 1) -> Dict[str, tuple]:
+        """
+        Check given rules on nodes by given path (or on given `nodes`, numbered from `start`) in one traversal.
+        Rules are compiled into one specialized validator function, see `utils.rules.compile_rules`.
+
+        Returns dict of rule name to check result, same as `evaluate_rules`.
+        """
+        for rule in rules:
+            logger.info("Checking that nodes '%s' %s", nodes_path, rule.description)
+        if nodes is None:
+            nodes = self.iter_nodes(nodes_path)
+        nodes_total, bad_nodes = compile_rules(rules)(nodes, start)
+        instrumentation.count("nodes", nodes_total)
+        results = {}
+        for rule, rule_bad_nodes in zip(rules, bad_nodes):
+            if len(rule_bad_nodes) > 0:
+                logger.info("Ids of nodes, which do not %s: '%s'", rule.description, logger.ids(rule_bad_nodes, rule.name))
+                results[rule.name] = (False, rule_bad_nodes)
+            else:
+                logger.info("All nodes '%s' %s", nodes_path, rule.description)
+                results[rule.name] = (True, nodes_total)
+        return results
+
     def all_given_nodes_contain_attrib(self, nodes_path: str, attrib_name: str):
         """
         Check that all nodes by given path contain given attribute.
@@ -59,17 +262,8 @@ class XMLObject:
         Returns tuple of    (True, *len of nodes total*) if all nodes contain attribute or
                             (False, *list of numbers of bad nodes*) if some nodes do not contain them.
         """
-        logger.info(f"Checking that nodes '{nodes_path}' contain attribute '{attrib_name}'")
-        found_nodes = self.find_all(nodes_path)
-        bad_nodes = []
-        for node_num, node in enumerate(found_nodes, start=1):
-            if node.get(attrib_name) is None:
-                bad_nodes.append(node_num)
-        if len(bad_nodes) > 0:
-            logger.info(f"Ids of nodes, which do not contain specified attribute: '{bad_nodes}'")
-            return False, bad_nodes
-        logger.info(f"All nodes contain specified attribute'")
-        return True, len(found_nodes)
+        rule = RequiredAttribute(attrib_name)
+        return self.run_rules(nodes_path, [rule])[rule.name]
     
     def all_given_nodes_contain_one_of_attrib(self, nodes_path: str, *attrib_options):
         """
@@ -78,23 +272,8 @@ class XMLObject:
         Returns tuple of    (True, *len of nodes total*) if all nodes contain only one of options or
                             (False, *list of numbers of bad nodes*) if some nodes contain options != 1.
         """
-        logger.info(f"Checking that nodes '{nodes_path}' contain only one attribute of '{attrib_options}'")
-        found_nodes = self.find_all(nodes_path)
-        bad_nodes = []
-        for node_num, node in enumerate(found_nodes, start=1):
-            found_options = 0
-            for cur_attrib in attrib_options:
-                if node.get(cur_attrib) is not None:
-                    found_options += 1
-                    if found_options > 1:
-                        break
-            if found_options != 1:
-                bad_nodes.append(node_num)
-        if len(bad_nodes) > 0:
-            logger.info(f"Ids of nodes, which contain not one attribute: '{bad_nodes}'")
-            return False, bad_nodes
-        logger.info(f"All nodes contain only one of specified attributes'")
-        return True, len(found_nodes)
+        rule = OneOfAttributes(*attrib_options)
+        return self.run_rules(nodes_path, [rule])[rule.name]
     
     def all_given_nodes_contain_child_node(self, nodes_path: str, child_node_name: str):
         """
@@ -103,37 +282,105 @@ class XMLObject:
         Returns tuple of    (True, *len of nodes total*) if all nodes contain child or
                             (False, *list of numbers of bad nodes*) if some nodes do not contain them.
         """
-        logger.info(f"Checking that nodes '{nodes_path}' contain child node '{child_node_name}'")
-        found_nodes = self.find_all(nodes_path)
-        bad_nodes = []
-        for node_num, node in enumerate(found_nodes, start=1):
-            node_childs = self.get_element_unique_children_names(node)
-            if child_node_name not in node_childs:
-                bad_nodes.append(node_num)
-        if len(bad_nodes) > 0:
-            logger.info(f"Ids of nodes, which do not contain specified child: '{bad_nodes}'")
-            return False, bad_nodes
-        logger.info(f"All nodes contain specified child'")
-        return True, len(found_nodes)
+        rule = RequiredChild(child_node_name)
+        return self.run_rules(nodes_path, [rule])[rule.name]
 
         
 class BalanceXML(XMLObject):
     """ Class for balance XML with specific locators and operations """
-    def __init__(self, xml_path: str, namespace: str=None, encoding: str ='utf-8'):
-        super().__init__(xml_path, namespace, encoding)
+    def __init__(self, xml_path: sources.Source, namespace: str=None, encoding: str ='utf-8', streaming: bool = False,
+                 tree: etree._ElementTree = None, rules_config: dict = None, config: dict = None):
+        super().__init__(xml_path, namespace, encoding, streaming, tree)
         self.node_balance_locator = "Ballance"
         self.node_operation_locator = f"{self.node_balance_locator}/ns:Oper"
         self.node_status_locator = "Status"
         self.node_corrAcc_locator = "corAcc"
+        self.node_start_rest_locator = f"{self.node_balance_locator}/ns:StartRest"
+        self.rest_attrib = "Rest"
+        # All operation checks ('balance' rules of rules.json) are done in one pass over 'Oper' nodes on first call of any of them
+        rules_config = rules_config if rules_config is not None else load_rules_config()["balance"]
+        self.register_rules_from_config(rules_config, {"config": config or {}})
+
+    def get_rest(self) -> Optional[int]:
+        """Value of 'Rest' attribute of balance node, None if it is missing or not numeric."""
+        balance_node = self.find(self.node_balance_locator)
+        return int_or_none(balance_node.get(self.rest_attrib)) if balance_node is not None else None
+
+    def get_start_rest(self) -> Optional[int]:
+        """Value of 'StartRest' node of balance, None if it is missing or not numeric."""
+        return int_or_none(self.find_text(self.node_start_rest_locator))
 
+    @instrumented("check")
     def check_all_operation_nodes_contain_date(self):
-        return self.all_given_nodes_contain_attrib(self.node_operation_locator, "date")
+        return self.evaluate_rules(self.node_operation_locator)["operation_date"]
     
+    @instrumented("check")
     def check_all_operation_nodes_contain_corr_acc(self):
-        return self.all_given_nodes_contain_attrib(self.node_operation_locator, "corAcc")
+        return self.evaluate_rules(self.node_operation_locator)["operation_corAcc"]
     
+    @instrumented("check")
     def check_all_operation_nodes_contain_dbt_or_cdt(self):
-        return self.all_given_nodes_contain_one_of_attrib(self.node_operation_locator, "dbt", "cdt")
+        return self.evaluate_rules(self.node_operation_locator)["operation_dbt_or_cdt"]
     
+    @instrumented("check")
     def check_all_operation_nodes_contain_status_node(self):
-        return self.all_given_nodes_contain_child_node(self.node_operation_locator, "Status")
+        return self.evaluate_rules(self.node_operation_locator)["operation_status_node"]
+
+
+class PacketEPDXML(XMLObject):
+    """ Class for PacketEPD XML with specific locators and operations """
+    def __init__(self, xml_path: sources.Source, namespace: str=None, encoding: str ='windows-1251', streaming: bool = False, expected_system_code: str = "01",
+                 rules_config: dict = None, config: dict = None):
+        super().__init__(xml_path, namespace, encoding, streaming)
+        self.node_ed101_locator = "ED101"
+        self.expected_system_code = expected_system_code
+        # All ED101 checks ('epd' rules of rules.json) are done in one pass over 'ED101' nodes on first call of any of them
+        rules_config = rules_config if rules_config is not None else load_rules_config()["epd"]
+        self.register_rules_from_config(rules_config, {
+            "header": dict(self.get_root_attributes()),
+            "config": config or {},
+            "expected_system_code": expected_system_code,
+        })
+
+    def _ed101_rule(self, rule_name: str):
+        return self.evaluate_rules(self.node_ed101_locator)[rule_name]
+
+    @instrumented("check")
+    def check_header_contains_attributes(self, *attribs):
+        """Returns tuple of (True, *list of attribs*) or (False, *list of missing attribs*)."""
+        header = self.get_root_attributes()
+        missing = [attrib for attrib in attribs if attrib not in header]
+        if len(missing) > 0:
+            return False, missing
+        return True, list(attribs)
+
+    @instrumented("check")
+    def check_all_ed101_contain_sum(self):
+        return self._ed101_rule("ed101_sum")
+
+    @instrumented("check")
+    def check_header_SystemCode(self):
+        """Returns tuple of (*is correct*, *header SystemCode*)."""
+        header_system_code = self.get_root_attributes().get("SystemCode")
+        return self.evaluate_rules(ROOT_PATH)["header_system_code"][0], header_system_code
+
+    @instrumented("check")
+    def check_all_ed101_SystemCode(self):
+        return self._ed101_rule("ed101_system_code")
+
+    @instrumented("check")
+    def check_all_ed101_date_equal_to_header(self):
+        return self._ed101_rule("ed101_date")
+
+    @instrumented("check")
+    def check_all_ed101_author_equal_to_header(self):
+        return self._ed101_rule("ed101_author")
+
+    @instrumented("check")
+    def check_all_ed101_have_required_requisites(self):
+        """Returns tuple of (True, *len of nodes total*) or (False, *sorted list of numbers of ED101 without any requisite*)."""
+        results = [self._ed101_rule(f"ed101_{side}_{attrib}") for side in ("payer", "payee") for attrib in ("BIC", "CorrespAcc")]
+        bad_nodes = sorted(set(node_num for ok, descr in results if not ok for node_num in descr))
+        if len(bad_nodes) > 0:
+            return False, bad_nodes
+        return True, results[0][1]